@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Measure the init phase of the query Lambda in fresh interpreters.
+
+Each run imports kbquery_handler in a new process, builds the Bedrock client
+the way the first request would, and collects the init timing report. The
+slowest modules from `python -X importtime` are listed to show where the time
+goes. Exits non-zero when the median init time exceeds --budget-ms so it can
+guard against cold start regressions.
+
+    python3 benchmarks/coldstart.py --runs 10 --budget-ms 300 --output coldstart.json
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import kbquery_handler, inittiming, awsclients
+imported = time.perf_counter()
+awsclients.get_client("bedrock-agent-runtime")
+built = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000,
+                  "first_client_ms": (built - imported) * 1000,
+                  "imports_ms": inittiming._imports,
+                  "clients_ms": inittiming._clients}))
+"""
+
+
+def probe_environment():
+    env = dict(os.environ)
+    env.setdefault("AWS_REGION", "us-gov-west-1")
+    env.setdefault("KNOWLEDGE_BASE_ID", "BENCHMARK")
+    env.setdefault("MODEL_ARN", "arn:aws:bedrock:us-gov-west-1::foundation-model/amazon.nova-micro-v1:0")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [SRC_DIR, env.get("PYTHONPATH")]))
+    return env
+
+
+def run_probe():
+    output = subprocess.run([sys.executable, "-c", PROBE], env=probe_environment(),
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(top):
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import kbquery_handler, awsclients; awsclients.get_client('bedrock-agent-runtime')"],
+                            env=probe_environment(), capture_output=True, text=True, check=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        modules.append((int(cumulative) / 1000, name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules to list")
+    parser.add_argument("--budget-ms", type=float, help="Fail when the median import plus client time exceeds this")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    runs = [run_probe() for _ in range(args.runs)]
+    totals = [run["import_ms"] + run["first_client_ms"] for run in runs]
+    results = {
+        "runs": args.runs,
+        "import_ms_median": statistics.median(run["import_ms"] for run in runs),
+        "first_client_ms_median": statistics.median(run["first_client_ms"] for run in runs),
+        "total_ms_median": statistics.median(totals),
+        "total_ms_max": max(totals),
+        "last_run": runs[-1],
+        "slowest_imports_ms": [{"module": name, "cumulative_ms": ms} for ms, name in slowest_imports(args.top)],
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.budget_ms is not None and results["total_ms_median"] > args.budget_ms:
+        print(f"Median init {results['total_ms_median']:.1f} ms exceeds the {args.budget_ms:.1f} ms budget", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
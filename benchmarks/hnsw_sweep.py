@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Sweep HNSW parameters over a sample of our vectors and report recall@k,
+query latency, build time and memory for each combination.
+
+Indexes are built locally with FAISS, the engine the collection uses, and
+compared against exact inner product top-k computed with NumPy. Queries are
+held out from the sample unless a separate query file is given.
+
+    python3 benchmarks/hnsw_sweep.py --vectors sample.npy --m 8,16,32 \\
+        --ef-construction 128,256,512 --ef-search 64,128,256,512 --k 5 --output sweep.json
+    python3 benchmarks/hnsw_sweep.py --synthetic 50000 --dimension 1024
+
+--vectors takes an (n, d) .npy array or a JSONL file with a "vector" (or the
+index vector field) per line. Requires numpy and faiss-cpu, which are not
+needed by the deployed functions.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+
+try:
+    import numpy as np
+    import faiss
+except ImportError as e:
+    sys.exit(f"hnsw_sweep needs numpy and faiss-cpu: pip install numpy faiss-cpu ({e})")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from config import OpenSearchServerlessConfig
+
+
+def load_vectors(path, field):
+    if path.endswith(".npy"):
+        return np.load(path).astype(np.float32)
+    with open(path) as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return np.array([row.get("vector", row.get(field)) for row in rows], dtype=np.float32)
+
+
+def synthetic_vectors(count, dimension, clusters, seed):
+    """
+    Unit vectors around random cluster centres, closer to real embeddings than uniform noise
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    vectors = centres[rng.integers(0, clusters, count)] + 0.6 * rng.standard_normal((count, dimension)).astype(np.float32)
+    return vectors
+
+
+def normalize(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def ground_truth(base, queries, k, block=1024):
+    """
+    Exact top-k ids by inner product, computed in blocks to bound memory
+    """
+    truth = np.empty((len(queries), k), dtype=np.int64)
+    for start in range(0, len(queries), block):
+        scores = queries[start:start + block] @ base.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        truth[start:start + block] = np.take_along_axis(top, order, axis=1)
+    return truth
+
+
+def recall_at_k(found, truth):
+    hits = sum(len(set(row_found) & set(row_truth)) for row_found, row_truth in zip(found, truth))
+    return hits / truth.size
+
+
+def percentile(values, pct):
+    return float(np.percentile(values, pct))
+
+
+def build(base, m, ef_construction):
+    index = faiss.IndexHNSWFlat(base.shape[1], m, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = ef_construction
+    start = time.perf_counter()
+    index.add(base)
+    build_s = time.perf_counter() - start
+    return index, build_s, faiss.serialize_index(index).nbytes
+
+
+def search(index, queries, k, ef_search):
+    index.hnsw.efSearch = ef_search
+    # One query at a time, like the knowledge base issues them
+    latencies, found = [], np.empty((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found[i] = ids[0]
+    return found, latencies
+
+
+def sweep(base, queries, args):
+    truth = ground_truth(base, queries, args.k)
+    results = []
+    for m in args.m:
+        for ef_construction in args.ef_construction:
+            index, build_s, index_bytes = build(base, m, ef_construction)
+            for ef_search in args.ef_search:
+                found, latencies = search(index, queries, args.k, ef_search)
+                result = {"m": m, "ef_construction": ef_construction, "ef_search": ef_search,
+                          f"recall@{args.k}": recall_at_k(found, truth),
+                          "latency_ms_p50": percentile(latencies, 50), "latency_ms_p99": percentile(latencies, 99),
+                          "build_s": build_s, "index_mb": index_bytes / 1024 / 1024,
+                          "bytes_per_vector": index_bytes / len(base)}
+                results.append(result)
+                print(f"m={m:<3} ef_construction={ef_construction:<4} ef_search={ef_search:<4} "
+                      f"recall@{args.k}={result[f'recall@{args.k}']:.4f} p50={result['latency_ms_p50']:.3f}ms "
+                      f"p99={result['latency_ms_p99']:.3f}ms build={build_s:.1f}s index={result['index_mb']:.1f}MB",
+                      file=sys.stderr)
+            del index
+    return results
+
+
+def pareto(results, k):
+    """
+    Settings that no other setting beats on both recall and p99 latency
+    """
+    key = f"recall@{k}"
+    return [result for result in results
+            if not any(other[key] >= result[key] and other["latency_ms_p99"] < result["latency_ms_p99"]
+                       for other in results if other is not result)]
+
+
+def integers(value):
+    return [int(item) for item in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--vectors", help=".npy array or JSONL file of embeddings")
+    source.add_argument("--synthetic", type=int, help="Generate this many clustered vectors instead")
+    parser.add_argument("--queries", help="Separate query vectors; by default --num-queries are held out from the sample")
+    parser.add_argument("--num-queries", type=int, default=500)
+    parser.add_argument("--dimension", type=int, default=1024, help="Dimension of synthetic vectors")
+    parser.add_argument("--k", type=int, default=5, help="Results per query, as numberOfResults in the knowledge base")
+    parser.add_argument("--m", type=integers, default=[8, 16, 32])
+    parser.add_argument("--ef-construction", type=integers, default=[128, 256, 512])
+    parser.add_argument("--ef-search", type=integers, default=[64, 128, 256, 512])
+    parser.add_argument("--threads", type=int, default=1, help="FAISS threads for building")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    if args.vectors:
+        vectors = load_vectors(args.vectors, OpenSearchServerlessConfig.VECTOR_FIELD_NAME)
+    else:
+        vectors = synthetic_vectors(args.synthetic, args.dimension, max(10, args.synthetic // 1000), args.seed)
+    # Titan embeddings are normalized, so inner product ranks like cosine similarity
+    vectors = normalize(vectors)
+    if args.queries:
+        base, queries = vectors, normalize(load_vectors(args.queries, OpenSearchServerlessConfig.VECTOR_FIELD_NAME))
+    else:
+        order = np.random.default_rng(args.seed).permutation(len(vectors))
+        queries, base = vectors[order[:args.num_queries]], vectors[order[args.num_queries:]]
+    base, queries = np.ascontiguousarray(base), np.ascontiguousarray(queries)
+
+    current = {"m": OpenSearchServerlessConfig.HNSW_M, "ef_construction": OpenSearchServerlessConfig.HNSW_EF_CONSTRUCTION,
+               "ef_search": OpenSearchServerlessConfig.HNSW_EF_SEARCH}
+    print(f"{len(base)} vectors of dimension {base.shape[1]}, {len(queries)} queries, current settings {current}", file=sys.stderr)
+    results = sweep(base, queries, args)
+    report = {"vectors": len(base), "dimension": int(base.shape[1]), "queries": len(queries), "k": args.k,
+              "current": current, "results": results, "pareto": pareto(results, args.k),
+              "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Offline load test of kbquery_handler.handler against stubbed Bedrock clients.
+
+Requests are scheduled open-loop at the target rate and run on a bounded pool
+of workers. Latency is measured from the scheduled start, so queueing behind a
+saturated pool shows up in the tail instead of being hidden.
+
+    python3 benchmarks/loadtest.py --rps 20 --duration 30 --concurrency 16 \\
+        --latency lognormal:1500:0.4 --throttle-rate 0.02 --output run.json
+    python3 benchmarks/loadtest.py ... --compare run.json --max-regression-pct 10
+
+Requires boto3 to be importable, as in the Lambda runtime.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import platform
+import resource
+import threading
+import contextlib
+import statistics
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "..", "src"))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from stub_bedrock import StubBedrockAgentRuntime, StubBedrockRuntime
+
+COMPARED = ["latency_ms.p50", "latency_ms.p95", "latency_ms.p99"]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def summarize(values):
+    return {"p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99),
+            "max": max(values) if values else None, "mean": statistics.fmean(values) if values else None}
+
+
+def load_handler(args):
+    os.environ.setdefault("AWS_REGION", "us-gov-west-1")
+    os.environ.setdefault("KNOWLEDGE_BASE_ID", "BENCHMARK")
+    os.environ.setdefault("MODEL_ARN", "arn:aws:bedrock:us-gov-west-1::foundation-model/amazon.nova-micro-v1:0")
+    os.environ["PIPELINE_MODE"] = args.pipeline
+    os.environ["CACHE_ENABLED"] = "true" if args.cache else "false"
+    os.environ["LOG_SAMPLE_RATE"] = "0"
+    if args.hedge:
+        os.environ.update({"HEDGE_ENABLED": "true", "HEDGE_PERCENTILE": str(args.hedge_percentile),
+                           "HEDGE_MAX_RATE": str(args.hedge_max_rate), "HEDGE_MAX_WORKERS": str(2 * args.concurrency)})
+    import awsclients
+    import kbquery_handler
+    agent_runtime = StubBedrockAgentRuntime(latency=args.latency, throttle_rate=args.throttle_rate,
+                                            answer_bytes=args.answer_bytes, chunks=args.chunks,
+                                            chunk_bytes=args.chunk_bytes, seed=args.seed)
+    # Clients are looked up through awsclients, so registering the stubs replaces Bedrock everywhere
+    awsclients._clients["bedrock-agent-runtime"] = agent_runtime
+    awsclients._clients["bedrock-runtime"] = StubBedrockRuntime(agent_runtime)
+    return kbquery_handler, agent_runtime
+
+
+def make_questions(args):
+    if args.questions:
+        with open(args.questions) as f:
+            return [line.strip() for line in f if line.strip()]
+    return [f"What is the guidance for topic {i}?" for i in range(args.unique_questions)]
+
+
+def run(args):
+    handler_module, agent_runtime = load_handler(args)
+    handler = handler_module.handler
+    questions = make_questions(args)
+    rng = random.Random(args.seed)
+    total = int(args.rps * args.duration)
+    latencies, service_times, statuses = [], [], {}
+    lock = threading.Lock()
+
+    def invoke(scheduled_at, question):
+        started = time.perf_counter()
+        event = {"requestContext": {"resourcePath": "/question"}, "body": json.dumps({"question": question})}
+        status = handler(event, None)["statusCode"]
+        finished = time.perf_counter()
+        with lock:
+            latencies.append((finished - scheduled_at) * 1000)
+            service_times.append((finished - started) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    tracemalloc.start()
+    # EMF lines would flood the terminal, so handler output is discarded during the run
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for i in range(total):
+                scheduled_at = start + i / args.rps
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(invoke, scheduled_at, rng.choice(questions))
+        elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": {
+            "requests": len(latencies),
+            "elapsed_s": elapsed,
+            "throughput_rps": len(latencies) / elapsed,
+            "statuses": {str(status): count for status, count in sorted(statuses.items())},
+            "error_rate": sum(count for status, count in statuses.items() if status >= 400) / max(1, len(latencies)),
+            "latency_ms": summarize(latencies),
+            "service_ms": summarize(service_times),
+            "stub_calls": agent_runtime.calls,
+            "stub_throttled": agent_runtime.throttled,
+            "hedge": dict(handler_module.hedger.stats) if handler_module.hedger is not None else None,
+            "python_heap_peak_mb": peak / 1024 / 1024,
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        },
+    }
+
+
+def lookup(results, path):
+    value = results
+    for key in path.split("."):
+        value = value[key]
+    return value
+
+
+def compare(current, baseline, max_regression_pct):
+    """
+    Print the change of each compared metric and return the regressions beyond the threshold
+    """
+    regressions = []
+    for path in COMPARED + ["throughput_rps"]:
+        now, before = lookup(current["results"], path), lookup(baseline["results"], path)
+        if not before:
+            continue
+        change = (now - before) / before * 100
+        # Lower is better for latency, higher is better for throughput
+        worse = -change if path == "throughput_rps" else change
+        print(f"{path:20} {before:10.1f} -> {now:10.1f} ({change:+.1f}%)", file=sys.stderr)
+        if max_regression_pct is not None and worse > max_regression_pct:
+            regressions.append(path)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=float, default=10, help="Target request rate")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of load")
+    parser.add_argument("--concurrency", type=int, default=16, help="Maximum requests in flight")
+    parser.add_argument("--latency", default="lognormal:1500:0.4",
+                        help="Stub latency: fixed:MS, uniform:LOW:HIGH, normal:MEAN:SD or lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of stub calls that are throttled")
+    parser.add_argument("--answer-bytes", type=int, default=800)
+    parser.add_argument("--chunks", type=int, default=5, help="Chunks returned by Retrieve")
+    parser.add_argument("--chunk-bytes", type=int, default=1500)
+    parser.add_argument("--pipeline", default="retrieve_and_generate", choices=["retrieve_and_generate", "retrieve_then_generate"])
+    parser.add_argument("--cache", action="store_true", help="Enable the in-container answer cache")
+    parser.add_argument("--hedge", action="store_true", help="Enable hedged Bedrock calls")
+    parser.add_argument("--hedge-percentile", type=float, default=95, help="Latency percentile after which a call is hedged")
+    parser.add_argument("--hedge-max-rate", type=float, default=0.05, help="Largest fraction of calls that are hedged")
+    parser.add_argument("--questions", help="File with one question per line")
+    parser.add_argument("--unique-questions", type=int, default=1000, help="Synthetic questions to draw from")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument("--max-regression-pct", type=float, help="Fail when a compared metric regresses by more than this")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.max_regression_pct)
+        if regressions:
+            print(f"Regressed beyond {args.max_regression_pct}%: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Recommend a memory size and architecture for the query Lambda from its CPU-bound work.
+
+The handler runs locally against stubbed Bedrock clients that answer instantly, so
+each request only spends CPU time on the work done inside the function: parsing
+the event, prompt building, answer cache lookups, reranking and serializing the
+response. That CPU time is then scaled to the CPU share Lambda allocates at each
+memory size (one vCPU at 1769 MB, up to 6 vCPUs), and --io-ms of Bedrock wait,
+which memory does not speed up, is added to get the billed duration.
+
+    python3 benchmarks/power_tuning.py --pipeline retrieve_then_generate --rerank bm25 \\
+        --memory 128,256,512,1024,1769,2048 --architectures x86_64,arm64 --io-ms 1500
+    python3 benchmarks/power_tuning.py --rerank cross_encoder --model-dir ./model \\
+        --parallel-fraction 0.9 --memory 1024,1769,2048,3008,4096 --output power.json
+
+The recommendation is the cheapest configuration whose p95 duration is within
+--tolerance-pct of the fastest one. Prices default to the commercial us-east-1
+rates, so pass the rates of your region. Requires boto3 to be importable, as in the Lambda runtime.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import resource
+import contextlib
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "..", "src"))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from stub_bedrock import StubBedrockAgentRuntime, StubBedrockRuntime
+from loadtest import percentile
+
+# Lambda allocates one vCPU at 1769 MB and CPU in proportion to memory, up to 6 vCPUs at 10240 MB
+MB_PER_VCPU = 1769
+MAX_VCPUS = 6
+PRICE_GB_SECOND = {"x86_64": 0.0000166667, "arm64": 0.0000133334}
+PRICE_PER_MILLION_REQUESTS = 0.20
+
+
+def load_handler(args):
+    os.environ.setdefault("AWS_REGION", "us-gov-west-1")
+    os.environ.setdefault("KNOWLEDGE_BASE_ID", "BENCHMARK")
+    os.environ.setdefault("MODEL_ARN", "arn:aws:bedrock:us-gov-west-1::foundation-model/amazon.nova-micro-v1:0")
+    os.environ["PIPELINE_MODE"] = args.pipeline
+    os.environ["CACHE_ENABLED"] = "true" if args.cache else "false"
+    os.environ["LOG_SAMPLE_RATE"] = "0"
+    if args.rerank != "none":
+        os.environ.update({"RERANK_ENABLED": "true", "RERANK_SCORER": args.rerank, "RERANK_MODEL_DIR": args.model_dir,
+                           "RERANK_CANDIDATES": str(args.chunks), "RERANK_THREADS": "1"})
+    import awsclients
+    import kbquery_handler
+    # Stubs without latency, so requests only take the CPU time of the handler
+    agent_runtime = StubBedrockAgentRuntime(latency="fixed:0", answer_bytes=args.answer_bytes, chunks=args.chunks,
+                                            chunk_bytes=args.chunk_bytes, seed=args.seed)
+    awsclients._clients["bedrock-agent-runtime"] = agent_runtime
+    awsclients._clients["bedrock-runtime"] = StubBedrockRuntime(agent_runtime)
+    return kbquery_handler
+
+
+def measure(args):
+    """
+    CPU milliseconds of each request, run one at a time on this machine
+    """
+    handler = load_handler(args).handler
+    rng = random.Random(args.seed)
+    questions = [f"What is the guidance for topic {i}?" for i in range(args.unique_questions)]
+    cpu_ms = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for i in range(args.warmup + args.requests):
+            event = {"requestContext": {"resourcePath": "/question"}, "body": json.dumps({"question": rng.choice(questions)})}
+            start = time.process_time()
+            status = handler(event, None)["statusCode"]
+            if status != 200:
+                raise RuntimeError(f"Handler returned {status}")
+            if i >= args.warmup:
+                cpu_ms.append((time.process_time() - start) * 1000)
+    return cpu_ms
+
+
+def simulated_ms(cpu_ms, memory_mb, parallel_fraction, speed):
+    """
+    Duration of cpu_ms of local CPU time at the CPU share of memory_mb. Below one vCPU the
+    function is throttled, above it only the parallel fraction of the work gets faster.
+    """
+    vcpus = min(MAX_VCPUS, memory_mb / MB_PER_VCPU)
+    work = cpu_ms / speed
+    return work * ((1 - parallel_fraction) / min(1.0, vcpus) + parallel_fraction / vcpus)
+
+
+def evaluate(cpu_ms, max_rss_mb, args):
+    rows = []
+    for architecture in args.architectures:
+        speed = args.arm64_speed if architecture == "arm64" else 1.0
+        price = args.price_arm64 if architecture == "arm64" else args.price_x86_64
+        for memory_mb in args.memory:
+            durations = [args.io_ms + simulated_ms(ms, memory_mb, args.parallel_fraction, speed) for ms in cpu_ms]
+            # Lambda bills duration rounded up to the millisecond
+            billed_s = sum(math.ceil(duration) for duration in durations) / len(durations) / 1000
+            rows.append({"architecture": architecture, "memory_mb": memory_mb,
+                         "cpu_ms_p50": percentile([duration - args.io_ms for duration in durations], 50),
+                         "duration_ms_p50": percentile(durations, 50), "duration_ms_p95": percentile(durations, 95),
+                         "cost_per_million": memory_mb / 1024 * billed_s * price * 1e6 + args.price_requests,
+                         # The runtime needs some memory of its own next to the handler
+                         "fits": memory_mb >= max_rss_mb * 1.2})
+    fitting = [row for row in rows if row["fits"]] or rows
+    fastest = min(row["duration_ms_p95"] for row in fitting)
+    candidates = [row for row in fitting if row["duration_ms_p95"] <= fastest * (1 + args.tolerance_pct / 100)]
+    return rows, min(candidates, key=lambda row: (row["cost_per_million"], row["duration_ms_p95"]))
+
+
+def integers(value):
+    return [int(item) for item in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipeline", default="retrieve_then_generate", choices=["retrieve_and_generate", "retrieve_then_generate"])
+    parser.add_argument("--cache", action="store_true", help="Enable the in-memory answer cache")
+    parser.add_argument("--rerank", default="none", choices=["none", "bm25", "cross_encoder"])
+    parser.add_argument("--model-dir", default="/opt/model", help="Cross encoder model directory of the rerank layer")
+    parser.add_argument("--chunks", type=int, default=5, help="Chunks retrieved per question")
+    parser.add_argument("--chunk-bytes", type=int, default=1500)
+    parser.add_argument("--answer-bytes", type=int, default=800)
+    parser.add_argument("--unique-questions", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--memory", type=integers, default=[128, 256, 512, 1024, 1536, 1769, 2048, 3008])
+    parser.add_argument("--architectures", type=lambda value: value.split(","), default=["x86_64", "arm64"])
+    parser.add_argument("--arm64-speed", type=float, default=1.0,
+                        help="Speed of arm64 relative to x86_64 for this work, e.g. from running the benchmark on both")
+    parser.add_argument("--parallel-fraction", type=float, default=0.0,
+                        help="Share of the CPU time that uses every vCPU, such as cross encoder inference")
+    parser.add_argument("--io-ms", type=float, default=1500, help="Time spent waiting on Bedrock per request")
+    parser.add_argument("--tolerance-pct", type=float, default=10)
+    parser.add_argument("--price-x86-64", type=float, default=PRICE_GB_SECOND["x86_64"], help="Price per GB-second")
+    parser.add_argument("--price-arm64", type=float, default=PRICE_GB_SECOND["arm64"], help="Price per GB-second")
+    parser.add_argument("--price-requests", type=float, default=PRICE_PER_MILLION_REQUESTS, help="Price per million requests")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    cpu_ms = measure(args)
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    rows, best = evaluate(cpu_ms, max_rss_mb, args)
+    for row in rows:
+        marker = "  <- recommended" if row is best else "" if row["fits"] else "  (too small)"
+        print(f"{row['architecture']:<7} {row['memory_mb']:>5} MB  cpu p50={row['cpu_ms_p50']:8.1f}ms  "
+              f"duration p50={row['duration_ms_p50']:8.1f}ms p95={row['duration_ms_p95']:8.1f}ms  "
+              f"${row['cost_per_million']:8.2f} per 1M requests{marker}", file=sys.stderr)
+    report = {"config": {key: value for key, value in vars(args).items() if key != "output"},
+              "local_cpu_ms": {"p50": percentile(cpu_ms, 50), "p95": percentile(cpu_ms, 95)},
+              "max_rss_mb": max_rss_mb,
+              "results": rows,
+              "recommended": {"architecture": best["architecture"], "memory_mb": best["memory_mb"]}}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
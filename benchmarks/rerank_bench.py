@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Measure rerank latency of src/reranker.py for each candidate count and batch size.
+
+Each iteration reranks a set of candidate chunks for one question, as the query
+function does after over-fetching. The cross encoder needs the model directory
+of the rerank layer (model.onnx and tokenizer.json) and onnxruntime, tokenizers
+and numpy; the BM25 scorer needs nothing.
+
+    python3 benchmarks/rerank_bench.py --scorer bm25 --candidates 20,50
+    python3 benchmarks/rerank_bench.py --scorer cross_encoder --model-dir ./model \\
+        --candidates 20,50 --batch-sizes 1,4,8,16,32 --threads 2 --output rerank.json
+
+Chunks come from --chunks, a JSONL file with a "text" per line, or are generated.
+Run with --threads set to the vCPUs of the function memory size being considered
+(about one vCPU per 1769 MB) to estimate Lambda latency.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import reranker
+from config import RerankConfig
+
+WORDS = ("policy travel budget contract award clause security control audit report network access "
+         "identity record retention request approval form office program deadline review").split()
+
+
+def synthetic_chunks(count, words, seed):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(words)) for _ in range(count)]
+
+
+def read_chunks(path):
+    with open(path) as f:
+        return [json.loads(line)["text"] for line in f if line.strip()]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def integers(value):
+    return [int(item) for item in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scorer", default=RerankConfig.SCORER, choices=[reranker.SCORER_BM25, reranker.SCORER_CROSS_ENCODER])
+    parser.add_argument("--model-dir", default="/opt/model")
+    parser.add_argument("--max-length", type=int, default=RerankConfig.MAX_LENGTH)
+    parser.add_argument("--threads", type=int, default=1, help="ONNX Runtime threads, 0 for all cores")
+    parser.add_argument("--candidates", type=integers, default=[RerankConfig.CANDIDATES])
+    parser.add_argument("--batch-sizes", type=integers, default=[1, 4, 8, 16, 32])
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--chunks", help="JSONL file with a \"text\" per line")
+    parser.add_argument("--chunk-words", type=int, default=200, help="Words per generated chunk")
+    parser.add_argument("--question", default="What is the approval deadline for travel policy requests?")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    scorer = reranker.scorer_for(args.scorer, args.model_dir, args.max_length, args.threads)
+    load_ms = (time.perf_counter() - start) * 1000
+    texts = read_chunks(args.chunks) if args.chunks else synthetic_chunks(max(args.candidates), args.chunk_words, args.seed)
+    results = []
+    for candidates in args.candidates:
+        chunks = [{"text": text} for text in texts[:candidates]]
+        # BM25 scores all candidates in one pass, so only one batch size is measured
+        for batch_size in args.batch_sizes if args.scorer == reranker.SCORER_CROSS_ENCODER else [len(chunks)]:
+            rerank = reranker.Reranker(scorer, candidates, batch_size)
+            for _ in range(args.warmup):
+                rerank.rerank(args.question, chunks, args.top_k)
+            latencies = []
+            for _ in range(args.iterations):
+                start = time.perf_counter()
+                rerank.rerank(args.question, chunks, args.top_k)
+                latencies.append((time.perf_counter() - start) * 1000)
+            result = {"candidates": len(chunks), "batch_size": batch_size,
+                      "latency_ms_p50": statistics.median(latencies), "latency_ms_p95": percentile(latencies, 95),
+                      "pairs_per_second": len(chunks) / (statistics.mean(latencies) / 1000)}
+            results.append(result)
+            print(f"candidates={len(chunks):<4} batch={batch_size:<4} p50={result['latency_ms_p50']:.1f}ms "
+                  f"p95={result['latency_ms_p95']:.1f}ms pairs/s={result['pairs_per_second']:.0f}", file=sys.stderr)
+
+    report = {"scorer": args.scorer, "threads": args.threads, "max_length": args.max_length, "load_ms": load_ms,
+              "results": results, "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
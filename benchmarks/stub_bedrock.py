@@ -0,0 +1,124 @@
+"""
+Configurable offline stand-ins for the Bedrock clients used by the query handler.
+
+Latency is drawn from a distribution, a fraction of calls can be throttled, and
+the generated answer has a configurable size, so the handler can be exercised
+without calling Bedrock.
+"""
+import io
+import json
+import math
+import time
+import random
+import threading
+
+try:
+    from botocore.exceptions import ClientError
+except ImportError:
+    class ClientError(Exception):
+        def __init__(self, error_response, operation_name):
+            super().__init__(f"An error occurred ({error_response['Error']['Code']}) when calling the {operation_name} operation")
+            self.response = error_response
+            self.operation_name = operation_name
+
+
+class LatencyDistribution:
+    """
+    Latency in milliseconds, parsed from a spec such as:
+    fixed:800, uniform:500:1500, normal:1000:200, lognormal:1000:0.5 (median, sigma)
+    """
+    def __init__(self, spec, rng=None):
+        self.spec = spec
+        self.rng = rng or random.Random()
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(param) for param in params]
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample_ms(self):
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(*self.params)
+        if self.kind == "normal":
+            return max(0.0, self.rng.gauss(*self.params))
+        median, sigma = self.params
+        return self.rng.lognormvariate(math.log(median), sigma)
+
+
+class StubBedrockAgentRuntime:
+    """
+    Stub of the bedrock-agent-runtime client
+    """
+    def __init__(self, latency="lognormal:1500:0.4", throttle_rate=0.0, answer_bytes=800, chunks=5,
+                 chunk_bytes=1500, seed=None):
+        self.rng = random.Random(seed)
+        self.latency = LatencyDistribution(latency, self.rng)
+        self.throttle_rate = throttle_rate
+        self.answer_bytes = answer_bytes
+        self.chunks = chunks
+        self.chunk_bytes = chunk_bytes
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+
+    def _call(self, operation_name):
+        with self.lock:
+            self.calls += 1
+            throttle = self.rng.random() < self.throttle_rate
+            delay = self.latency.sample_ms()
+            if throttle:
+                self.throttled += 1
+        if throttle:
+            # Throttled calls fail fast, like the service does
+            time.sleep(min(delay, 50) / 1000)
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"},
+                               "ResponseMetadata": {"HTTPStatusCode": 429}}, operation_name)
+        time.sleep(delay / 1000)
+
+    def _text(self, size, question):
+        base = f"Answer to {question}. "
+        return (base * (size // len(base) + 1))[:size]
+
+    def retrieve_and_generate(self, input, retrieveAndGenerateConfiguration, **kwargs):
+        self._call("RetrieveAndGenerate")
+        return {"output": {"text": self._text(self.answer_bytes, input["text"])},
+                "citations": [], "sessionId": "stub-session"}
+
+    def retrieve_and_generate_stream(self, input, retrieveAndGenerateConfiguration, **kwargs):
+        self._call("RetrieveAndGenerateStream")
+        text = self._text(self.answer_bytes, input["text"])
+        return {"stream": ({"output": {"text": text[i:i + 64]}} for i in range(0, len(text), 64))}
+
+    def retrieve(self, knowledgeBaseId, retrievalQuery, retrievalConfiguration=None, **kwargs):
+        self._call("Retrieve")
+        count = (retrievalConfiguration or {}).get("vectorSearchConfiguration", {}).get("numberOfResults", self.chunks)
+        return {"retrievalResults": [
+            {"content": {"text": self._text(self.chunk_bytes, f"{retrievalQuery['text']} chunk {i}")},
+             "score": 1.0 - i / (count + 1),
+             "location": {"type": "S3", "s3Location": {"uri": f"s3://stub/doc-{i}.txt"}},
+             "metadata": {}}
+            for i in range(count)]}
+
+
+class StubBedrockRuntime:
+    """
+    Stub of the bedrock-runtime client for Converse and embedding calls
+    """
+    def __init__(self, agent_runtime):
+        # Shares latency, throttling and payload settings with the agent runtime stub
+        self.agent_runtime = agent_runtime
+
+    def converse(self, modelId, messages, **kwargs):
+        self.agent_runtime._call("Converse")
+        prompt = messages[-1]["content"][0]["text"]
+        return {"output": {"message": {"role": "assistant", "content": [
+                    {"text": self.agent_runtime._text(self.agent_runtime.answer_bytes, prompt[-40:])}]}},
+                "usage": {"inputTokens": len(prompt) // 4, "outputTokens": self.agent_runtime.answer_bytes // 4},
+                "stopReason": "end_turn"}
+
+    def invoke_model(self, modelId, body, **kwargs):
+        dimensions = json.loads(body).get("dimensions", 256)
+        vector = [1 / math.sqrt(dimensions)] * dimensions
+        return {"body": io.BytesIO(json.dumps({"embedding": vector}).encode("utf8"))}
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Compare the index memory footprint and recall of each vector dimension and
+encoding option of the vector index.
+
+Every option is built as a local FAISS HNSW index with the configured graph
+parameters, flat float32 for "float32" and 16-bit scalar quantization for
+"fp16", the same encoder the collection uses. Recall@k is measured against
+exact top-k of the full 1024-dimension float32 vectors, so it includes the loss
+from both the smaller dimension and the encoding.
+
+    python3 benchmarks/vector_footprint.py --vectors-1024 v1024.npy --vectors-512 v512.npy \\
+        --vectors-256 v256.npy --corpus-size 2000000 --output footprint.json
+    python3 benchmarks/vector_footprint.py --texts chunks.jsonl --sample 5000
+    python3 benchmarks/vector_footprint.py --vectors-1024 v1024.npy --truncate
+
+Titan Embed v2 computes a separate embedding for each output dimension, so the
+reduced dimensions should come from the model: pass one file per dimension
+(rows in the same order) or --texts to embed a sample with Bedrock. --truncate
+approximates them by cutting the 1024-dimension vectors, which is only a rough
+estimate. Requires numpy and faiss-cpu, and boto3 for --texts.
+"""
+import os
+import sys
+import json
+import argparse
+
+try:
+    import numpy as np
+    import faiss
+except ImportError as e:
+    sys.exit(f"vector_footprint needs numpy and faiss-cpu: pip install numpy faiss-cpu ({e})")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from config import KbConfig, OpenSearchServerlessConfig
+from hnsw_sweep import load_vectors, normalize, ground_truth, recall_at_k, search
+
+DIMENSIONS = (1024, 512, 256)
+ENCODINGS = {"float32": 4, "fp16": 2}
+
+
+def embed_texts(texts, dimensions, region):
+    """
+    Titan Embed v2 vectors of each text for each dimension
+    """
+    import boto3
+    client = boto3.client("bedrock-runtime", region_name=region)
+    vectors = {dimension: [] for dimension in dimensions}
+    for i, text in enumerate(texts):
+        for dimension in dimensions:
+            response = client.invoke_model(modelId=KbConfig.EMBEDDING_MODEL_ID, body=json.dumps(
+                {"inputText": text, "dimensions": dimension, "normalize": True}))
+            vectors[dimension].append(json.loads(response["body"].read())["embedding"])
+        if (i + 1) % 100 == 0:
+            print(f"Embedded {i + 1}/{len(texts)} texts", file=sys.stderr)
+    return {dimension: np.array(rows, dtype=np.float32) for dimension, rows in vectors.items()}
+
+
+def read_texts(path, sample):
+    texts = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                texts.append(row.get("text", row.get("AOSS_KB_TEXT_CHUNK")) if isinstance(row, dict) else row)
+            if len(texts) == sample:
+                break
+    return texts
+
+
+def build(base, encoding, m, ef_construction):
+    if encoding == "fp16":
+        index = faiss.IndexHNSWSQ(base.shape[1], faiss.ScalarQuantizer.QT_fp16, m, faiss.METRIC_INNER_PRODUCT)
+        index.train(base)
+    else:
+        index = faiss.IndexHNSWFlat(base.shape[1], m, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = ef_construction
+    index.add(base)
+    return index, faiss.serialize_index(index).nbytes
+
+
+def estimated_bytes(count, dimension, encoding, m):
+    """
+    Native memory of an HNSW index as sized in the OpenSearch k-NN documentation:
+    1.1 * (bytes per vector + 8 * m) * count
+    """
+    return 1.1 * (ENCODINGS[encoding] * dimension + 8 * m) * count
+
+
+def evaluate(vectors, queries, options, args):
+    reference = max(vectors)
+    truth = ground_truth(vectors[reference], queries[reference], args.k)
+    results = []
+    for dimension, encoding in options:
+        index, index_bytes = build(vectors[dimension], encoding, args.m, args.ef_construction)
+        found, latencies = search(index, queries[dimension], args.k, args.ef_search)
+        result = {"dimension": dimension, "encoding": encoding, f"recall@{args.k}": recall_at_k(found, truth),
+                  "latency_ms_p50": float(np.percentile(latencies, 50)), "index_mb": index_bytes / 1024 / 1024,
+                  "bytes_per_vector": index_bytes / len(vectors[dimension]),
+                  "corpus_estimate_gb": estimated_bytes(args.corpus_size or len(vectors[dimension]), dimension,
+                                                        encoding, args.m) / 1024 ** 3}
+        results.append(result)
+        del index
+    baseline = next((r for r in results if r["dimension"] == reference and r["encoding"] == "float32"), results[0])
+    for result in results:
+        result["recall_loss"] = baseline[f"recall@{args.k}"] - result[f"recall@{args.k}"]
+        result["memory_saving"] = 1 - result["bytes_per_vector"] / baseline["bytes_per_vector"]
+        print(f"dimension={result['dimension']:<5} encoding={result['encoding']:<8} "
+              f"recall@{args.k}={result[f'recall@{args.k}']:.4f} loss={result['recall_loss']:+.4f} "
+              f"index={result['index_mb']:.1f}MB ({result['memory_saving']:.0%} smaller) "
+              f"corpus={result['corpus_estimate_gb']:.2f}GB", file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for dimension in DIMENSIONS:
+        parser.add_argument(f"--vectors-{dimension}", help=f".npy array or JSONL file of {dimension}-dimension embeddings")
+    parser.add_argument("--texts", help="JSONL file of chunks to embed with Bedrock at every dimension")
+    parser.add_argument("--sample", type=int, default=2000, help="Texts to embed from --texts")
+    parser.add_argument("--region", default=os.environ.get("AWS_REGION"))
+    parser.add_argument("--truncate", action="store_true", help="Derive missing dimensions by truncating the largest vectors")
+    parser.add_argument("--encodings", default=",".join(ENCODINGS))
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--m", type=int, default=OpenSearchServerlessConfig.HNSW_M)
+    parser.add_argument("--ef-construction", type=int, default=OpenSearchServerlessConfig.HNSW_EF_CONSTRUCTION)
+    parser.add_argument("--ef-search", type=int, default=OpenSearchServerlessConfig.HNSW_EF_SEARCH)
+    parser.add_argument("--corpus-size", type=int, help="Vectors in the production index, for the memory estimate")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.texts:
+        vectors = embed_texts(read_texts(args.texts, args.sample), DIMENSIONS, args.region)
+    else:
+        vectors = {dimension: load_vectors(path, OpenSearchServerlessConfig.VECTOR_FIELD_NAME)
+                   for dimension in DIMENSIONS if (path := getattr(args, f"vectors_{dimension}"))}
+    if not vectors:
+        parser.error("pass --texts or at least one --vectors-<dimension> file")
+    if args.truncate:
+        largest = vectors[max(vectors)]
+        for dimension in DIMENSIONS:
+            if dimension < largest.shape[1] and dimension not in vectors:
+                vectors[dimension] = largest[:, :dimension]
+    if len({len(rows) for rows in vectors.values()}) > 1:
+        sys.exit("The vector files must hold the same chunks in the same order")
+    vectors = {dimension: normalize(rows) for dimension, rows in vectors.items()}
+
+    # The same chunks are held out as queries for every option
+    order = np.random.default_rng(args.seed).permutation(len(next(iter(vectors.values()))))
+    queries = {d: np.ascontiguousarray(rows[order[:args.num_queries]]) for d, rows in vectors.items()}
+    vectors = {d: np.ascontiguousarray(rows[order[args.num_queries:]]) for d, rows in vectors.items()}
+    options = [(dimension, encoding) for dimension in sorted(vectors, reverse=True)
+               for encoding in args.encodings.split(",")]
+
+    current = {"dimension": OpenSearchServerlessConfig.VECTOR_DIMENSION, "encoding": OpenSearchServerlessConfig.VECTOR_ENCODING}
+    print(f"{len(vectors[max(vectors)])} vectors, {args.num_queries} queries, current settings {current}", file=sys.stderr)
+    report = {"vectors": len(vectors[max(vectors)]), "queries": args.num_queries, "k": args.k,
+              "hnsw": {"m": args.m, "ef_construction": args.ef_construction, "ef_search": args.ef_search},
+              "reference_dimension": max(vectors), "current": current, "results": evaluate(vectors, queries, options, args)}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 EMBEDDING_MODEL_IDs = ["amazon.titan-embed-text-v2:0"]
 CHUNKING_STRATEGIES = {0:"Default",1:"Fixed-size", 2:"No"}
-QUERY_MODEL_IDs = ["amazon.nova-micro-v1:0","amazon.titan-text-express-v1"]
+QUERY_MODEL_IDs = ["amazon.nova-micro-v1:0","amazon.titan-text-express-v1","amazon.nova-lite-v1:0","amazon.nova-pro-v1:0"]
 
 class EnvSettings:
     # General params
@@ -19,6 +19,14 @@ class KbConfig:
 class DsConfig:
     S3_BUCKET_NAME = f"" # TODO: Change this to the S3 bucket where your data is stored.New bucket will be created if you leave this field empty
 
+class IngestionConfig:
+    ENABLED = True # Start an ingestion job when objects in the data source bucket change
+    DEBOUNCE_SECONDS = 120 # Uploads within this window start a single job. Max 300
+    MAX_BATCH_SIZE = 1000 # Object events handled per job
+    KEY_PREFIX = "" # Only objects under this prefix trigger a sync
+    RETRY_AFTER_SECONDS = 300 # Wait before retrying a burst that arrived while a job was running
+    MAX_RECEIVE_COUNT = 24 # Retries before the events go to the dead letter queue
+
 class OpenSearchServerlessConfig:
     COLLECTION_NAME = f"{EnvSettings.PROJ_NAME}-collection"
     INDEX_NAME = f"{EnvSettings.PROJ_NAME}-kb-index"
@@ -28,6 +36,16 @@ class OpenSearchServerlessConfig:
     ALLOW_FROM_PUBLIC = True  # This is for dashboards. Still needs SAML or IAM integration to access
     VPC_ENDPOINT = "" # VPC Endpoint ID. Currently can only be created from AWS console
     VECTOR_FIELD_NAME = "vector-field"
+    VECTOR_DIMENSION = 1024 # Titan Embed v2 supports 256, 512 or 1024. Compare with benchmarks/vector_footprint.py
+    VECTOR_ENCODING = "float32" # "float32" or "fp16" (FAISS scalar quantization, half the vector memory)
+    # Metadata attributes from the S3 .metadata.json sidecars that are indexed for filtering, as name: type.
+    # Types are keyword, long, double or boolean. Store dates as numbers such as 20240131 to filter them by range
+    FILTERABLE_FIELDS = {"doc_type": "keyword", "owner": "keyword", "tenant": "keyword", "published": "long"}
+    # HNSW graph parameters of the FAISS engine. Measure candidates with benchmarks/hnsw_sweep.py.
+    # Changing them creates a new index version (see README)
+    HNSW_M = 16 # Links per node: higher improves recall at the cost of memory and build time
+    HNSW_EF_CONSTRUCTION = 512
+    HNSW_EF_SEARCH = 512 # Candidate list size at query time: higher improves recall at the cost of latency
 
 class APIConfig:
     API_NAME=f"{EnvSettings.PROJ_NAME}-api"
@@ -37,4 +55,163 @@ class APIConfig:
     API_QUOTA_LIMIT=1000
     API_QUOTA_PERIOD="DAY"  # DAY WEEK MONTH
     API_KEY_NAME=f"{EnvSettings.PROJ_NAME}-api-key"
+    MINIMUM_COMPRESSION_SIZE=1024 # Bytes from which API Gateway gzips responses for clients that send Accept-Encoding. None disables compression
+
+class ResponseConfig:
+    INCLUDE = [] # Sources returned when a request does not set "include": "citations" and/or "references"
+    SNIPPET_LENGTH = 200 # Characters of the chunk text kept in each reference. 0 leaves snippets out
+    MAX_SNIPPET_LENGTH = 1000 # Largest "snippetLength" a request can ask for
+
+
+class CacheConfig:
+    ENABLED = True
+    L1_MAX_ENTRIES = 256 # Answers kept per Lambda container
+    L1_TTL_SECONDS = 900
+    L2_ENABLED = True # Shared semantic cache backed by DynamoDB
+    L2_TTL_SECONDS = 86400
+    L2_MAX_CANDIDATES = 500 # Cached questions compared per lookup. Further entries of the same ingestion generation only match exactly
+    SIMILARITY_THRESHOLD = 0.92 # TODO: Raise this value if paraphrase hits return wrong answers
+    EMBEDDING_MODEL_ID = EMBEDDING_MODEL_IDs[0]
+    EMBEDDING_DIMENSIONS = 256
+    GENERATION_REFRESH_SECONDS = 60 # How often the latest ingestion job is checked to invalidate the cache
+
+class StreamConfig:
+    ENABLED = False # Streams answers through a Lambda function URL behind the Lambda Web Adapter
+    # TODO: Set the Lambda Web Adapter layer ARN published for your region and the architecture of the stream function
+    WEB_ADAPTER_LAYER_ARN = ""
+    FUNCTION_URL_AUTH = "AWS_IAM" # AWS_IAM NONE
+
+class BatchConfig:
+    MAX_QUESTIONS = 50 # Questions accepted per /questions:batch request
+    MAX_WORKERS = 8 # Concurrent Bedrock calls per batch. Keep this within your Bedrock quota
+    DEADLINE_SECONDS = 25 # Must stay below the 29 second API Gateway integration timeout
+
+class PipelineConfig:
+    # "retrieve_and_generate": single RetrieveAndGenerate call
+    # "retrieve_then_generate": Retrieve, cache the chunks, then generate with Converse
+    MODE = "retrieve_and_generate" # TODO: Choose the query pipeline
+    NUMBER_OF_RESULTS = 5 # Chunks retrieved per question in the two-stage pipeline, and by RetrieveAndGenerate with TokenBudgetConfig.ENABLED
+    RETRIEVAL_CACHE_MAX_ENTRIES = 256 # Set to 0 to disable the retrieval cache
+    RETRIEVAL_CACHE_TTL_SECONDS = 900
+    SYSTEM_PROMPT = "" # Leave empty to use the default prompt of the two-stage pipeline
+
+class TokenBudgetConfig:
+    ENABLED = False # Caps the retrieved context per model and sets the output limit and prompt template of every answer
+    CONTEXT_BUDGETS = {"amazon.nova-micro": 8000, "amazon.titan-text-express": 4000, "amazon.nova-lite": 16000, "amazon.nova-pro": 16000} # Tokens of retrieved context, by model id prefix
+    DEFAULT_CONTEXT_BUDGET = 8000 # For models without an entry in CONTEXT_BUDGETS
+    MIN_CHUNK_TOKENS = 100 # The two-stage pipeline trims a chunk that only partly fits if at least this many tokens fit, and drops it otherwise
+    MAX_OUTPUT_TOKENS = 1024
+    MAX_OUTPUT_TOKENS_LIMIT = 4096 # Largest "maxOutputTokens" a request can ask for
+    PROMPT_TEMPLATE = "" # Prompt with $search_results$ and optionally $query$, for both pipelines. Empty keeps the default prompt
+    ALLOW_REQUEST_OVERRIDE = True # Accepts "numberOfResults", "maxOutputTokens" and "promptTemplate" per request
+    CHARS_PER_TOKEN = 4 # Token estimate of English text, since no tokenizer is loaded
+
+class SearchConfig:
+    # SEMANTIC: kNN search only. HYBRID: the knowledge base combines keyword and kNN search.
+    # HYBRID_RRF: the query function runs BM25 and kNN queries on the collection in parallel and fuses them
+    # with reciprocal rank fusion. Needs the retrieve_then_generate pipeline, and adds a collection VPC endpoint
+    SEARCH_TYPE = "SEMANTIC" # SEMANTIC HYBRID HYBRID_RRF
+    ALLOW_REQUEST_OVERRIDE = True # Accepts "searchType" in /question and /questions:batch
+    HYBRID_RRF_ENABLED = False # Deploys HYBRID_RRF support even when it is not the default SEARCH_TYPE
+    CANDIDATES = 20 # Hits taken from each query before fusion
+    RRF_K = 60 # Higher values flatten the rank contribution of the top hits
+
+class RerankConfig:
+    # Over-fetches CANDIDATES chunks, rescores them in the query function and keeps PipelineConfig.NUMBER_OF_RESULTS.
+    # Needs the retrieve_then_generate pipeline
+    ENABLED = False
+    SCORER = "bm25" # "bm25" (no dependencies) or "cross_encoder" (ONNX model in the rerank layer)
+    CANDIDATES = 20
+    BATCH_SIZE = 16 # Pairs scored per cross encoder run. Compare with benchmarks/rerank_bench.py
+    MAX_LENGTH = 256 # Tokens of each (question, chunk) pair seen by the cross encoder
+    MODEL_REPO = "cross-encoder/ms-marco-MiniLM-L6-v2" # Hugging Face repository the rerank layer downloads
+    MODEL_FILE = "onnx/model_quint8_avx2.onnx" # 8-bit quantized export, about a quarter of the fp32 model
+    FUNCTION_MEMORY_MB = 2048 # Query function memory with the cross encoder. Lambda CPU grows with memory
+
+class FederationConfig:
+    # Lets requests retrieve from several knowledge bases at once with "knowledgeBaseIds" or "knowledgeBaseRoute".
+    # Needs the retrieve_then_generate pipeline, and every knowledge base must use KbConfig.EMBEDDING_MODEL_ID
+    ENABLED = False
+    KNOWLEDGE_BASE_IDS = [] # Other knowledge bases requests may name, e.g. ["ABCDEFGHIJ"]
+    ROUTES = {} # Named groups, e.g. {"finance": ["self", "ABCDEFGHIJ"]}. "self" is the knowledge base of this stack
+    DEFAULT_ROUTE = "" # Route of requests that name none. Empty uses only the knowledge base of this stack
+    TIMEOUT_SECONDS = 5 # Knowledge bases that have not answered by then are left out of the answer. Also the read timeout of each federated Retrieve call
+    MAX_WORKERS = 16 # Concurrent Retrieve calls per container
+
+class SessionConfig:
+    ENABLED = True # Accepts "session": true and "sessionId" on /question. Requests with neither do not touch the session store
+    STORE = "dynamodb" # dynamodb memory. "memory" keeps sessions per Lambda container only
+    TTL_SECONDS = 3600 # Idle time before a session expires
+    MAX_TURNS = 4 # Most recent turns kept verbatim. Older turns are folded into a summary
+    SUMMARY_MAX_CHARS = 1500
+    ANSWER_MAX_CHARS = 300 # Length each folded answer is truncated to in the summary
+
+class ClientConfig:
+    # botocore settings of the clients in the query Lambda
+    MAX_POOL_CONNECTIONS = max(10, 2 * BatchConfig.MAX_WORKERS) # Kept-alive connections shared by batch workers and their hedged calls
+    CONNECT_TIMEOUT_SECONDS = 2
+    READ_TIMEOUT_SECONDS = 120 # Generation of long answers can take well over the botocore default of 60 seconds
+    MAX_ATTEMPTS = 3
+    PREWARM_CLIENTS = [] # Services to build during init, e.g. ["bedrock-agent-runtime"]. Empty builds them on first use
+
+class ConcurrencyConfig:
+    # Warm capacity of the query Lambda. With provisioned concurrency, scaling or SnapStart the API invokes the ALIAS_NAME alias
+    ALIAS_NAME = "live"
+    RESERVED_CONCURRENCY = None # Caps the concurrency of the query Lambda. None shares the unreserved account pool
+    PROVISIONED_CONCURRENCY = 0 # Environments kept initialized, with their VPC network interfaces attached. Billed while provisioned
+    AUTOSCALING_MAX = 0 # Above PROVISIONED_CONCURRENCY, target tracking scales provisioned concurrency up to this. 0 disables it
+    UTILIZATION_TARGET = 0.7 # Provisioned concurrency utilization held by target tracking
+    SCHEDULE = [] # Scheduled minimum provisioned concurrency in UTC, e.g. [{"cron": "cron(30 12 ? * MON-FRI *)", "min": 10}, {"cron": "cron(0 23 ? * MON-FRI *)", "min": 1}]
+    SNAPSTART = False # Restores published versions from an init snapshot. Check regional availability. Excludes provisioned concurrency
+
+class FunctionConfig:
+    # Architecture ("x86_64" or "arm64") and memory of each function. arm64 (Graviton) costs about 20% less per GB-second,
+    # and Lambda allocates CPU in proportion to memory. benchmarks/power_tuning.py helps choosing the memory size
+    ARCHITECTURE = {"query": "x86_64", "stream": "x86_64", "index": "x86_64", "ingest": "x86_64"}
+    MEMORY_MB = {"query": 128, "stream": 128, "index": 1024, "ingest": 128} # The cross encoder raises query and stream to RerankConfig.FUNCTION_MEMORY_MB
+
+class LayerConfig:
+    # Functions that load each layer. A layer is built for every architecture of its functions
+    LAYER_FUNCTIONS = {"index": ["index"], "rerank": ["query", "stream"], "hybrid": ["query", "stream"]}
+    # Layers built from layers/<name>/requirements.txt, and optional ones only built when their feature is enabled.
+    # The query and stream functions use the boto3 of the Lambda runtime, so they have no layer of their own
+    FUNCTION_LAYERS = (["index"]
+                       + (["rerank"] if RerankConfig.ENABLED and RerankConfig.SCORER == "cross_encoder" else [])
+                       + (["hybrid"] if SearchConfig.HYBRID_RRF_ENABLED or SearchConfig.SEARCH_TYPE == "HYBRID_RRF" else []))
+
+class ObservabilityConfig:
+    METRICS_NAMESPACE = f"{EnvSettings.PROJ_NAME}/ServerlessRag"
+    LOG_SAMPLE_RATE = 0.01 # Fraction of requests whose summary is logged
+    LATENCY_P99_ALARM_MS = 20000 # End-to-end p99 latency of /question
+    BEDROCK_LATENCY_P99_ALARM_MS = 15000
+    ALARM_PERIOD_MINUTES = 5
+    ALARM_EVALUATION_PERIODS = 3
+    ALARM_EMAIL = "" # TODO: Set an email address to be notified when an alarm fires
+
+class ResilienceConfig:
+    ENABLED = True
+    FALLBACK_MODEL_ID = QUERY_MODEL_IDs[1] # Answers when the circuit of KbConfig.QUERY_MODEL_ID is open. Empty disables failover
+    TOKEN_BUCKET_RATE = 2 # Bedrock requests per second per container. Set to the account quota divided by the expected concurrency
+    TOKEN_BUCKET_BURST = max(5, BatchConfig.MAX_WORKERS) # Lets a batch start all its workers at once
+    TOKEN_WAIT_SECONDS = 2 # Longest wait for a token before returning 429. Batch questions wait until the batch deadline
+    RETRY_MAX_ATTEMPTS = 3 # Attempts per model. botocore retries of the Bedrock clients are turned off while enabled
+    RETRY_BASE_DELAY_SECONDS = 0.25
+    RETRY_MAX_DELAY_SECONDS = 4
+    BREAKER_FAILURE_THRESHOLD = 5 # Consecutive failed requests that open the circuit of a model
+    BREAKER_RECOVERY_SECONDS = 30
+
+class RouterConfig:
+    ENABLED = False # TODO: Enable after granting access to every model in MODEL_IDS
+    MODEL_IDS = [QUERY_MODEL_IDs[0], QUERY_MODEL_IDs[2], QUERY_MODEL_IDs[3]] # Cheapest first. Simple lookups go to the first
+    POLICY = "tiered" # "tiered" or "fixed" (always the first model, for measuring a baseline)
+    THRESHOLDS = [0.35, 0.7] # Score from which each following model is chosen
 
+class HedgeConfig:
+    ENABLED = False # Sends a second identical Bedrock call when the first is slow, at the cost of extra calls
+    PERCENTILE = 95 # Hedge after this percentile of recent latencies of the same model
+    INITIAL_DELAY_MS = 3000 # Used until MIN_SAMPLES latencies have been seen
+    MIN_DELAY_MS = 500
+    MAX_RATE = 0.05 # Largest fraction of calls that get hedged
+    WINDOW = 200
+    MIN_SAMPLES = 20
+    MAX_WORKERS = 2 * BatchConfig.MAX_WORKERS
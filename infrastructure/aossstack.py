@@ -20,7 +20,7 @@ from aws_cdk.aws_opensearchserverless import (
   CfnCollection,
   CfnSecurityPolicy,
 )
-from config import EnvSettings, OpenSearchServerlessConfig
+from config import EnvSettings, OpenSearchServerlessConfig, FunctionConfig
 
 
 application_name = EnvSettings.PROJ_NAME
@@ -50,7 +50,7 @@ class  OpensearchVectorDbStack(Stack):
         self.regn = dictenv['region']
         self.account_id=dictenv['account_id']
         self.arn_partition='aws-us-gov' if('gov' in self.regn) else 'aws'  
-        self.lambdaLayer = lambda_.LayerVersion.from_layer_version_arn(self,"lambda_layer",layer_version_arn=Util.get_from_parameter_store(self,"lambdalayerArn"))
+        self.lambdaLayer = Util.get_function_layer(self, "index", "index", "lambda_layer")
       
         self.encryptionPolicy = self.create_encryption_policy(collection_name)
         self.networkPolicy = self.create_network_policy(collection_name)
@@ -68,6 +68,7 @@ class  OpensearchVectorDbStack(Stack):
         Util.store_in_parameter_store(self,'collectionArn', self.collection.attr_arn, 'collectionArn','Collection Arn')
         Util.store_in_parameter_store(self, 'collectionId', self.collection.attr_id, 'collectionId', 'Collection Id')
         Util.store_in_parameter_store(self, 'collectionName', self.collection.name, 'collectionName', 'Collection Name')
+        Util.store_in_parameter_store(self, 'collectionEndpoint', self.collection.attr_collection_endpoint, 'collectionEndpoint', 'Collection Endpoint')
         
         self.create_oss_index(self.lambdaExecutionRole)
 
@@ -128,12 +129,13 @@ class  OpensearchVectorDbStack(Stack):
     def create_oss_index(self,lambdaExecutionRole: iam_.Role):
         index_lambda_function = lambda_.Function(self, "create-index-function",
             function_name=f"{OpenSearchServerlessConfig.INDEX_NAME}-Lambda",
-                code = lambda_.Code.from_asset("src"),
+                code = Util.function_code(["ossindex.py"]),
                 runtime=lambda_.Runtime.PYTHON_3_13,
                 handler="ossindex.handler",
                 role=lambdaExecutionRole,
                 layers=[self.lambdaLayer],
-                memory_size=1024,
+                architecture=Util.architecture("index"),
+                memory_size=FunctionConfig.MEMORY_MB["index"],
                 timeout=_cdk.Duration.minutes(15),
                 description=f'Managed by CDK - {application_name}',
                 environment={ "REGION_NAME": self.region,
@@ -141,44 +143,24 @@ class  OpensearchVectorDbStack(Stack):
                                         "VECTOR_INDEX_NAME": OpenSearchServerlessConfig.INDEX_NAME,
                                         "VECTOR_FIELD_NAME": OpenSearchServerlessConfig.VECTOR_FIELD_NAME,})
 
-        oss_provider_role = iam_.Role(
-                self,
-                "OSSProviderRole",
-                assumed_by=iam_.ServicePrincipal("lambda.amazonaws.com"),
-            )
-        oss_provider_role.add_to_policy(iam_.PolicyStatement(actions=[
-                "aoss:CreateIndex",
-                "aoss:DeleteIndex",
-                "aoss:UpdateIndex",
-                "aoss:DescribeIndex",
-                "aoss:ListIndices",
-                "aoss:BatchGetIndex",
-                "aoss:APIAccessAll",
-        ],
-        resources=[f"arn:{self.arn_partition}:aoss:{self.regn}:{self.account_id}:collection/{self.collection.attr_id}"]))
-
-    # Define the request body for the lambda invoke api call that the custom resource will use
-        aossLambdaParams = {
-                    "FunctionName": index_lambda_function.function_name,
-                    "InvocationType": "RequestResponse"
-                }
-        
-        # On creation of the stack, trigger the Lambda function we just defined 
-        trigger_lambda_cr = cr.AwsCustomResource(self, "IndexCreateCustomResource",
-            on_create=cr.AwsSdkCall(
-                service="Lambda",
-                action="invoke",
-                parameters=aossLambdaParams,
-                physical_resource_id=cr.PhysicalResourceId.of("Parameter.ARN")
-                ),
-                role=oss_provider_role,
-            removal_policy = RemovalPolicy.DESTROY,
-            timeout=Duration.seconds(120)
-            )
-                # Define IAM permission policy for the custom resource    
-        trigger_lambda_cr.grant_principal.add_to_principal_policy(iam_.PolicyStatement(
-            effect=iam_.Effect.ALLOW,
-            actions=["lambda:InvokeFunction", "iam:CreateServiceLinkedRole", "iam:PassRole"],
-            resources=[index_lambda_function.function_arn],
-            ))
-        trigger_lambda_cr.node.add_dependency(self.collection)
\ No newline at end of file
+        # The handler creates the index version of the current schema and polls until it is ready.
+        # A schema change yields a new index name, and the knowledge base stack reads it from Parameter Store.
+        invalid_fields = {name: field_type for name, field_type in OpenSearchServerlessConfig.FILTERABLE_FIELDS.items()
+                          if field_type not in ("keyword", "long", "double", "boolean")}
+        if invalid_fields:
+            raise ValueError(f"Unsupported types of OpenSearchServerlessConfig.FILTERABLE_FIELDS: {invalid_fields}")
+        index_provider = cr.Provider(self, "IndexLifecycleProvider", on_event_handler=index_lambda_function)
+        index_resource = _cdk.CustomResource(self, "IndexLifecycle",
+            service_token=index_provider.service_token,
+            properties={"IndexName": OpenSearchServerlessConfig.INDEX_NAME,
+                        "VectorFieldName": OpenSearchServerlessConfig.VECTOR_FIELD_NAME,
+                        "Dimension": OpenSearchServerlessConfig.VECTOR_DIMENSION,
+                        "Encoding": OpenSearchServerlessConfig.VECTOR_ENCODING,
+                        "FilterableFields": OpenSearchServerlessConfig.FILTERABLE_FIELDS,
+                        "HnswM": OpenSearchServerlessConfig.HNSW_M,
+                        "HnswEfConstruction": OpenSearchServerlessConfig.HNSW_EF_CONSTRUCTION,
+                        "HnswEfSearch": OpenSearchServerlessConfig.HNSW_EF_SEARCH})
+        index_resource.node.add_dependency(self.collection)
+        index_resource.node.add_dependency(self.dataAccessPolicy)
+        Util.store_in_parameter_store(self, "vectorIndexName", index_resource.get_att_string("IndexName"), "vectorIndexName", "Active vector index name")
+        Util.store_in_parameter_store(self, "vectorIndexVersion", index_resource.get_att_string("Version"), "vectorIndexVersion", "Active vector index version")
\ No newline at end of file
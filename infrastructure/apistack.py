@@ -1,4 +1,5 @@
 from infrastructure.util import Util
+import json
 import aws_cdk as _cdk
 from aws_cdk import (
     Stack,
@@ -8,15 +9,26 @@ from aws_cdk import (
     aws_logs,
     aws_iam as iam_,
     aws_ec2 as ec2,
+    aws_dynamodb as dynamodb,
+    aws_cloudwatch as cloudwatch,
+    aws_cloudwatch_actions as cw_actions,
+    aws_sns as sns,
+    aws_sns_subscriptions as sns_subs,
+    aws_opensearchserverless as aoss,
     Tags as Tags,
     RemovalPolicy
 )
 from constructs import Construct
-from config import EnvSettings, APIConfig,KbConfig
+from config import EnvSettings, LayerConfig, APIConfig,KbConfig,CacheConfig,StreamConfig,BatchConfig,PipelineConfig,SessionConfig,ClientConfig,ObservabilityConfig,ResilienceConfig,RouterConfig,HedgeConfig,SearchConfig,OpenSearchServerlessConfig,RerankConfig,FederationConfig,ConcurrencyConfig,FunctionConfig,ResponseConfig,TokenBudgetConfig
 
 application_name = EnvSettings.PROJ_NAME
 api_name = APIConfig.API_NAME
 stage_name=APIConfig.STAGE_NAME
+# Modules from src packaged with the query functions
+query_modules = ["kbquery_handler.py", "kbstream_server.py", "run_stream.sh", "answercache.py", "twostage_pipeline.py",
+                 "sessionstore.py", "awsclients.py", "inittiming.py", "metrics.py", "resilience.py", "modelrouter.py",
+                 "hedging.py", "hybridsearch.py", "ossindex.py", "searchfilter.py", "reranker.py", "federation.py",
+                 "responseshape.py", "tokenbudget.py"]
 
 
 class  APIStack(Stack):
@@ -25,7 +37,6 @@ class  APIStack(Stack):
        
         self.regn = dictenv['region']
         self.acct = dictenv['account_id']
-        self.lambdaLayer = lambda_.LayerVersion.from_layer_version_arn(self,"lambda_layer",layer_version_arn=Util.get_from_parameter_store(self,"lambdalayerArn"))
         self.knowledgebaseId = Util.get_from_parameter_store(self,"knowledgebaseId")
         self.knowledgebaseArn = Util.get_from_parameter_store(self,"knowledgebaseArn")
         self.datasourceId = Util.get_from_parameter_store(self,"datasourceId")
@@ -36,8 +47,15 @@ class  APIStack(Stack):
         Util.store_in_parameter_store(self,'vpcid', self.vpc.vpc_id, 'vpcid','VPC ID')
         self.security_group = self.CreateSecurityGroup()
          
-        self.query_lambda = self. create_query_lambda(self.knowledgebaseId,self.arn_partition,self.lambdaLayer,self.vpc,self.security_group)
+        self.cache_table = self.create_cache_table() if CacheConfig.ENABLED and CacheConfig.L2_ENABLED else None
+        self.session_table = self.create_session_table() if SessionConfig.ENABLED and SessionConfig.STORE == "dynamodb" else None
+        self.query_lambda = self. create_query_lambda(self.knowledgebaseId,self.arn_partition,self.vpc,self.security_group)
         Util.store_in_parameter_store(self,"querylambdaArn",self.query_lambda.function_arn,"querylambdaArn","Query Lambda Arn")
+        # Function or alias invoked by the API
+        self.query_target = self.create_query_alias(self.query_lambda)
+        if StreamConfig.ENABLED:
+            self.stream_lambda, self.stream_url = self.create_stream_lambda(self.query_lambda)
+            Util.store_in_parameter_store(self,"streamUrl",self.stream_url.url,"streamUrl","Streaming Query Function URL")
 
         # Create API Gateway
         self.api_throttle_rate_limit = APIConfig.API_THROTTLE_RATE_LIMIT
@@ -51,13 +69,14 @@ class  APIStack(Stack):
         self.api_quota_settings = {"limit": int(self.api_quota_limit), "period": self.api_quota_period}
         self.api_key_name = APIConfig.API_KEY_NAME
 
-        self.api_gw = self.create_api_gw(self.query_lambda)
-        self.create_api_resources(self.query_lambda,self.api_gw)
+        self.api_gw = self.create_api_gw(self.query_target)
+        self.create_api_resources(self.query_target,self.api_gw)
         Util.store_in_parameter_store(self,"apigateway", self.api_gw.rest_api_id, "apigateway", "API Gateway ID")
         self.api_usage_plan = self.create_usage_plan(self.api_gw,
             self.create_throttle_constructor(self.api_throttle_settings), self.create_quota_constructor(self.api_quota_settings)
         )
         Util.store_in_parameter_store(self,"APIUsagePlanID", self.api_usage_plan.usage_plan_id, "APIUsagePlanID", "API Usage Plan ID")
+        self.create_dashboard_and_alarms(self.query_lambda,self.api_gw)
 
     def CreatePrivateVPC(self):
         # Create a VPC with private subnets
@@ -88,9 +107,52 @@ class  APIStack(Stack):
         security_group.add_ingress_rule(security_group, ec2.Port.HTTPS, "Allow HTTPS inbound traffic from VPC CIDR")
         return security_group
      
+    def create_interface_endpoint(self, name, service):
+        vpce = ec2.InterfaceVpcEndpoint(self,f"{application_name}-{name}",
+            vpc=self.vpc,
+            service=service,
+            subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_ISOLATED),
+            security_groups=[self.security_group],
+            private_dns_enabled=True,
+        )
+        Tags.of(vpce).add("Name", f"{application_name}-{name}")
+        return vpce
+
+    # Shared L2 semantic answer cache, partitioned by knowledge base ingestion generation
+    def create_cache_table(self):
+        table = dynamodb.Table(self, "AnswerCacheTable",
+            table_name=f"{application_name}-answer-cache",
+            partition_key=dynamodb.Attribute(name="pk", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="sk", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            encryption=dynamodb.TableEncryption.AWS_MANAGED,
+            removal_policy=RemovalPolicy.DESTROY)
+        self.add_dynamodb_endpoint()
+        return table
+
+    # Server-side conversation state for multi-turn sessions
+    def create_session_table(self):
+        table = dynamodb.Table(self, "SessionTable",
+            table_name=f"{application_name}-sessions",
+            partition_key=dynamodb.Attribute(name="session_id", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            encryption=dynamodb.TableEncryption.AWS_MANAGED,
+            removal_policy=RemovalPolicy.DESTROY)
+        self.add_dynamodb_endpoint()
+        return table
+
+    def add_dynamodb_endpoint(self):
+        # Isolated subnets have no NAT, so DynamoDB is reached through a gateway endpoint
+        if self.vpc.node.try_find_child("DynamoDbEndpoint") is None:
+            self.vpc.add_gateway_endpoint("DynamoDbEndpoint",
+                service=ec2.GatewayVpcEndpointAwsService.DYNAMODB,
+                subnets=[ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_ISOLATED)])
+
     # { "body": "{\"question\":\"<Question>\"}" }
     # Lambda to query from knowledgebases
-    def create_query_lambda(self, knowledgebaseId,partition,lambdalayer,vpc,securitygroup) -> lambda_:
+    def create_query_lambda(self, knowledgebaseId,partition,vpc,securitygroup) -> lambda_:
         ModelArn = f"arn:{partition}:bedrock:{self.regn}::foundation-model/{KbConfig.QUERY_MODEL_ID}"
         lambdavpce = ec2.InterfaceVpcEndpoint(self,f"{application_name}-bdvpce",   
             vpc=self.vpc,                                     
@@ -100,33 +162,175 @@ class  APIStack(Stack):
             private_dns_enabled=True,
         )
         Tags.of(lambdavpce).add("Name", f"{application_name}-bdvpce")
+        bedrock_vpces = [lambdavpce]
 
         function_name = f"{application_name}-QueryKb"
         role = Util.create_lambda_execution_role(self,function_name)  
+        environment = {"KNOWLEDGE_BASE_ID": knowledgebaseId,
+                       "MODEL_ARN" : ModelArn,
+                       "BATCH_MAX_QUESTIONS": str(BatchConfig.MAX_QUESTIONS),
+                       "BATCH_MAX_WORKERS": str(BatchConfig.MAX_WORKERS),
+                       "BATCH_DEADLINE_SECONDS": str(BatchConfig.DEADLINE_SECONDS),
+                       "CLIENT_MAX_POOL_CONNECTIONS": str(ClientConfig.MAX_POOL_CONNECTIONS),
+                       "CLIENT_CONNECT_TIMEOUT_SECONDS": str(ClientConfig.CONNECT_TIMEOUT_SECONDS),
+                       "CLIENT_READ_TIMEOUT_SECONDS": str(ClientConfig.READ_TIMEOUT_SECONDS),
+                       "CLIENT_MAX_ATTEMPTS": str(ClientConfig.MAX_ATTEMPTS),
+                       "PREWARM_CLIENTS": ",".join(ClientConfig.PREWARM_CLIENTS),
+                       "METRICS_NAMESPACE": ObservabilityConfig.METRICS_NAMESPACE,
+                       "LOG_SAMPLE_RATE": str(ObservabilityConfig.LOG_SAMPLE_RATE),
+                       "SEARCH_TYPE": SearchConfig.SEARCH_TYPE,
+                       "SEARCH_TYPE_OVERRIDE": str(SearchConfig.ALLOW_REQUEST_OVERRIDE).lower(),
+                       "FILTER_FIELDS": ",".join(f"{name}:{field_type}" for name, field_type in OpenSearchServerlessConfig.FILTERABLE_FIELDS.items()),
+                       "RESPONSE_INCLUDE": ",".join(ResponseConfig.INCLUDE),
+                       "RESPONSE_SNIPPET_LENGTH": str(ResponseConfig.SNIPPET_LENGTH),
+                       "RESPONSE_MAX_SNIPPET_LENGTH": str(ResponseConfig.MAX_SNIPPET_LENGTH)}
+        if CacheConfig.ENABLED:
+            # The cache checks the latest ingestion job through the Bedrock Agent endpoint
+            bedrock_vpces.append(self.create_interface_endpoint("bdagentvpce",ec2.InterfaceVpcEndpointAwsService.BEDROCK_AGENT))
+            environment.update({"DATA_SOURCE_ID": self.datasourceId,
+                                "CACHE_ENABLED": "true",
+                                "CACHE_L1_MAX_ENTRIES": str(CacheConfig.L1_MAX_ENTRIES),
+                                "CACHE_L1_TTL_SECONDS": str(CacheConfig.L1_TTL_SECONDS),
+                                "CACHE_GENERATION_REFRESH_SECONDS": str(CacheConfig.GENERATION_REFRESH_SECONDS)})
+        if self.cache_table is not None:
+            environment.update({"CACHE_TABLE_NAME": self.cache_table.table_name,
+                                "CACHE_L2_TTL_SECONDS": str(CacheConfig.L2_TTL_SECONDS),
+                                "CACHE_L2_MAX_CANDIDATES": str(CacheConfig.L2_MAX_CANDIDATES),
+                                "CACHE_SIMILARITY_THRESHOLD": str(CacheConfig.SIMILARITY_THRESHOLD),
+                                "CACHE_EMBEDDING_MODEL_ID": CacheConfig.EMBEDDING_MODEL_ID,
+                                "CACHE_EMBEDDING_DIMENSIONS": str(CacheConfig.EMBEDDING_DIMENSIONS)})
+        if SessionConfig.ENABLED:
+            environment.update({"SESSIONS_ENABLED": "true",
+                                "SESSION_TTL_SECONDS": str(SessionConfig.TTL_SECONDS),
+                                "SESSION_MAX_TURNS": str(SessionConfig.MAX_TURNS),
+                                "SESSION_SUMMARY_MAX_CHARS": str(SessionConfig.SUMMARY_MAX_CHARS),
+                                "SESSION_ANSWER_MAX_CHARS": str(SessionConfig.ANSWER_MAX_CHARS)})
+        if self.session_table is not None:
+            environment["SESSION_TABLE_NAME"] = self.session_table.table_name
+        if PipelineConfig.MODE == "retrieve_then_generate":
+            environment.update({"PIPELINE_MODE": PipelineConfig.MODE,
+                                "RETRIEVAL_NUMBER_OF_RESULTS": str(PipelineConfig.NUMBER_OF_RESULTS),
+                                "RETRIEVAL_CACHE_MAX_ENTRIES": str(PipelineConfig.RETRIEVAL_CACHE_MAX_ENTRIES),
+                                "RETRIEVAL_CACHE_TTL_SECONDS": str(PipelineConfig.RETRIEVAL_CACHE_TTL_SECONDS),
+                                "SYSTEM_PROMPT": PipelineConfig.SYSTEM_PROMPT})
+        if TokenBudgetConfig.ENABLED:
+            if TokenBudgetConfig.PROMPT_TEMPLATE and "$search_results$" not in TokenBudgetConfig.PROMPT_TEMPLATE:
+                raise ValueError("TokenBudgetConfig.PROMPT_TEMPLATE must contain $search_results$")
+            environment.update({"TOKEN_BUDGET_ENABLED": "true",
+                                "RETRIEVAL_NUMBER_OF_RESULTS": str(PipelineConfig.NUMBER_OF_RESULTS),
+                                "CONTEXT_BUDGETS": json.dumps(TokenBudgetConfig.CONTEXT_BUDGETS),
+                                "DEFAULT_CONTEXT_BUDGET": str(TokenBudgetConfig.DEFAULT_CONTEXT_BUDGET),
+                                # Retrieval counts are capped by how many chunks of this size fit the budget. 0 when documents are not chunked
+                                "CHUNK_TOKENS": str({"Fixed-size": KbConfig.MAX_TOKENS, "Default": 300}.get(KbConfig.CHUNKING_STRATEGY, 0)),
+                                "MIN_CHUNK_TOKENS": str(TokenBudgetConfig.MIN_CHUNK_TOKENS),
+                                "MAX_OUTPUT_TOKENS": str(TokenBudgetConfig.MAX_OUTPUT_TOKENS),
+                                "MAX_OUTPUT_TOKENS_LIMIT": str(TokenBudgetConfig.MAX_OUTPUT_TOKENS_LIMIT),
+                                "PROMPT_TEMPLATE": TokenBudgetConfig.PROMPT_TEMPLATE,
+                                "GENERATION_OVERRIDE": str(TokenBudgetConfig.ALLOW_REQUEST_OVERRIDE).lower(),
+                                "CHARS_PER_TOKEN": str(TokenBudgetConfig.CHARS_PER_TOKEN)})
+        if SearchConfig.HYBRID_RRF_ENABLED or SearchConfig.SEARCH_TYPE == "HYBRID_RRF":
+            if PipelineConfig.MODE != "retrieve_then_generate":
+                raise ValueError("HYBRID_RRF search needs PipelineConfig.MODE = \"retrieve_then_generate\"")
+            self.create_search_access(role)
+            environment.update({"HYBRID_RRF_ENABLED": "true",
+                                "COLLECTION_HOST": Util.get_from_parameter_store(self,"collectionEndpoint"),
+                                "VECTOR_INDEX_NAME": Util.get_from_parameter_store(self,"vectorIndexName"),
+                                "VECTOR_FIELD_NAME": OpenSearchServerlessConfig.VECTOR_FIELD_NAME,
+                                "EMBEDDING_MODEL_ID": KbConfig.EMBEDDING_MODEL_ID,
+                                "EMBEDDING_DIMENSIONS": str(OpenSearchServerlessConfig.VECTOR_DIMENSION),
+                                "HYBRID_CANDIDATES": str(SearchConfig.CANDIDATES),
+                                "HYBRID_RRF_K": str(SearchConfig.RRF_K)})
+        if FederationConfig.ENABLED:
+            if PipelineConfig.MODE != "retrieve_then_generate":
+                raise ValueError("Federated retrieval needs PipelineConfig.MODE = \"retrieve_then_generate\"")
+            environment.update({"FEDERATION_ENABLED": "true",
+                                "FEDERATION_KNOWLEDGE_BASE_IDS": ",".join(FederationConfig.KNOWLEDGE_BASE_IDS),
+                                "FEDERATION_ROUTES": json.dumps(FederationConfig.ROUTES),
+                                "FEDERATION_DEFAULT_ROUTE": FederationConfig.DEFAULT_ROUTE,
+                                "FEDERATION_TIMEOUT_SECONDS": str(FederationConfig.TIMEOUT_SECONDS),
+                                "FEDERATION_MAX_WORKERS": str(FederationConfig.MAX_WORKERS)})
+        if ConcurrencyConfig.SNAPSTART:
+            # The runtime hooks in the handler build these clients before the snapshot and rebuild them after restore
+            snapshot_clients = ClientConfig.PREWARM_CLIENTS or ["bedrock-agent-runtime"] + (
+                ["bedrock-runtime"] if self.cache_table is not None or PipelineConfig.MODE == "retrieve_then_generate" else [])
+            environment.update({"SNAPSTART_ENABLED": "true",
+                                "PREWARM_CLIENTS": ",".join(snapshot_clients)})
+        # boto3 comes from the runtime, so the query function only loads the layers of enabled features
+        layers = self.optional_layers("query")
+        memory_size = self.function_memory("query")
+        if RerankConfig.ENABLED:
+            if PipelineConfig.MODE != "retrieve_then_generate":
+                raise ValueError("Reranking needs PipelineConfig.MODE = \"retrieve_then_generate\"")
+            environment.update({"RERANK_ENABLED": "true",
+                                "RERANK_SCORER": RerankConfig.SCORER,
+                                "RERANK_CANDIDATES": str(RerankConfig.CANDIDATES),
+                                "RERANK_BATCH_SIZE": str(RerankConfig.BATCH_SIZE),
+                                "RERANK_MAX_LENGTH": str(RerankConfig.MAX_LENGTH)})
+            if RerankConfig.SCORER == "cross_encoder":
+                environment["RERANK_MODEL_DIR"] = "/opt/model"
+        if ResilienceConfig.ENABLED:
+            environment.update({"RESILIENCE_ENABLED": "true",
+                                "FALLBACK_MODEL_ARN": f"arn:{partition}:bedrock:{self.regn}::foundation-model/{ResilienceConfig.FALLBACK_MODEL_ID}" if ResilienceConfig.FALLBACK_MODEL_ID else "",
+                                "TOKEN_BUCKET_RATE": str(ResilienceConfig.TOKEN_BUCKET_RATE),
+                                "TOKEN_BUCKET_BURST": str(ResilienceConfig.TOKEN_BUCKET_BURST),
+                                "TOKEN_WAIT_SECONDS": str(ResilienceConfig.TOKEN_WAIT_SECONDS),
+                                "RETRY_MAX_ATTEMPTS": str(ResilienceConfig.RETRY_MAX_ATTEMPTS),
+                                "RETRY_BASE_DELAY_SECONDS": str(ResilienceConfig.RETRY_BASE_DELAY_SECONDS),
+                                "RETRY_MAX_DELAY_SECONDS": str(ResilienceConfig.RETRY_MAX_DELAY_SECONDS),
+                                "BREAKER_FAILURE_THRESHOLD": str(ResilienceConfig.BREAKER_FAILURE_THRESHOLD),
+                                "BREAKER_RECOVERY_SECONDS": str(ResilienceConfig.BREAKER_RECOVERY_SECONDS),
+                                # Only model calls go through the invoker, so Retrieve keeps the botocore retries
+                                "CLIENT_NO_RETRY_SERVICES": "bedrock-runtime" if PipelineConfig.MODE == "retrieve_then_generate" else "bedrock-agent-runtime"})
+        if HedgeConfig.ENABLED:
+            environment.update({"HEDGE_ENABLED": "true",
+                                "HEDGE_PERCENTILE": str(HedgeConfig.PERCENTILE),
+                                "HEDGE_INITIAL_DELAY_MS": str(HedgeConfig.INITIAL_DELAY_MS),
+                                "HEDGE_MIN_DELAY_MS": str(HedgeConfig.MIN_DELAY_MS),
+                                "HEDGE_MAX_RATE": str(HedgeConfig.MAX_RATE),
+                                "HEDGE_WINDOW": str(HedgeConfig.WINDOW),
+                                "HEDGE_MIN_SAMPLES": str(HedgeConfig.MIN_SAMPLES),
+                                "HEDGE_MAX_WORKERS": str(HedgeConfig.MAX_WORKERS)})
+        if RouterConfig.ENABLED:
+            environment.update({"ROUTER_ENABLED": "true",
+                                "ROUTER_MODEL_ARNS": ",".join(f"arn:{partition}:bedrock:{self.regn}::foundation-model/{model_id}" for model_id in RouterConfig.MODEL_IDS),
+                                "ROUTER_POLICY": RouterConfig.POLICY,
+                                "ROUTER_THRESHOLDS": ",".join(str(threshold) for threshold in RouterConfig.THRESHOLDS)})
+        if self.cache_table is not None or PipelineConfig.MODE == "retrieve_then_generate":
+            # Question embeddings and Converse calls go through the Bedrock Runtime endpoint
+            bedrock_vpces.append(self.create_interface_endpoint("bdruntimevpce",ec2.InterfaceVpcEndpointAwsService.BEDROCK_RUNTIME))
                 
         query_lambda = Util.create_lambda_function(self, function_name,
                 function_name=function_name,
                 description="Lambda to query from knowledgebases",
                 handler="kbquery_handler.handler",
-                code= lambda_.Code.from_asset("src"),
-                layers=[lambdalayer],
+                code= Util.function_code(query_modules),
+                layers=layers,
                 role=role,
+                architecture=Util.architecture("query"),
+                memory_size=memory_size,
                 vpc=vpc,
                 security_groups=[securitygroup],
                 timeout=_cdk.Duration.minutes(5),
-                environment={"KNOWLEDGE_BASE_ID": knowledgebaseId,
-                             "MODEL_ARN" : ModelArn})
+                reserved_concurrent_executions=ConcurrencyConfig.RESERVED_CONCURRENCY,
+                snap_start=ConcurrencyConfig.SNAPSTART,
+                environment=environment)
+        # The stream function copies this environment and is invoked unqualified, so SnapStart does not apply to it
+        self.query_environment = {name: value for name, value in environment.items() if name != "SNAPSTART_ENABLED"}
 
         # Add permissions for Bedrock Models in GovCloud
         query_lambda.add_to_role_policy(
             iam_.PolicyStatement(
             effect=iam_.Effect.ALLOW,
-            actions=["bedrock:RetrieveAndGenerate", "bedrock:Retrieve", "bedrock:InvokeModel"],
+            actions=["bedrock:RetrieveAndGenerate", "bedrock:Retrieve", "bedrock:InvokeModel", "bedrock:ListIngestionJobs"],
             resources=["*"], # Configurable from environment parameters. Need to allow all enabled bedrock models.
             conditions={
                 "ForAllValues:StringEquals": {
-                "aws:SourceVpce": f"{lambdavpce.vpc_endpoint_id}"
+                "aws:SourceVpce": [vpce.vpc_endpoint_id for vpce in bedrock_vpces]
             }}))
+        if self.cache_table is not None:
+            self.cache_table.grant_read_write_data(query_lambda)
+        if self.session_table is not None:
+            self.session_table.grant_read_write_data(query_lambda)
 
         query_lambda.add_to_role_policy(
             iam_.PolicyStatement(
@@ -160,6 +364,105 @@ class  APIStack(Stack):
                 ]}}))                          
         return query_lambda
     
+    # The model and ONNX Runtime of the cross encoder come from their own layer, mounted at /opt/model and /opt/python
+    # Layers of optional features, attached only when the feature is enabled so other deployments do not load them
+    def optional_layers(self, function):
+        layers = []
+        if "rerank" in LayerConfig.FUNCTION_LAYERS:
+            layers.append(Util.get_function_layer(self, "rerank", function, "rerank_layer"))
+        if "hybrid" in LayerConfig.FUNCTION_LAYERS:
+            layers.append(Util.get_function_layer(self, "hybrid", function, "hybrid_layer"))
+        return layers
+
+    # Lambda allocates CPU in proportion to memory, which the cross encoder needs
+    def function_memory(self, function):
+        if RerankConfig.ENABLED and RerankConfig.SCORER == "cross_encoder":
+            return max(FunctionConfig.MEMORY_MB[function], RerankConfig.FUNCTION_MEMORY_MB)
+        return FunctionConfig.MEMORY_MB[function]
+
+    # Alias with provisioned concurrency, its scaling and SnapStart, which only apply to published versions.
+    # Without any of them the API keeps invoking the function itself.
+    def create_query_alias(self, querylambda):
+        provisioned = ConcurrencyConfig.PROVISIONED_CONCURRENCY
+        if not (provisioned or ConcurrencyConfig.AUTOSCALING_MAX or ConcurrencyConfig.SCHEDULE or ConcurrencyConfig.SNAPSTART):
+            return querylambda
+        if ConcurrencyConfig.SNAPSTART and provisioned:
+            raise ValueError("ConcurrencyConfig.SNAPSTART can't be combined with PROVISIONED_CONCURRENCY")
+        if (ConcurrencyConfig.AUTOSCALING_MAX or ConcurrencyConfig.SCHEDULE) and not provisioned:
+            raise ValueError("ConcurrencyConfig.AUTOSCALING_MAX and SCHEDULE scale PROVISIONED_CONCURRENCY, which must be at least 1")
+        if ConcurrencyConfig.AUTOSCALING_MAX and ConcurrencyConfig.AUTOSCALING_MAX < provisioned:
+            raise ValueError("ConcurrencyConfig.AUTOSCALING_MAX must be at least PROVISIONED_CONCURRENCY")
+        if not 0 < ConcurrencyConfig.UTILIZATION_TARGET < 1:
+            raise ValueError("ConcurrencyConfig.UTILIZATION_TARGET must be between 0 and 1")
+        peak = max([provisioned, ConcurrencyConfig.AUTOSCALING_MAX] + [schedule["min"] for schedule in ConcurrencyConfig.SCHEDULE])
+        if ConcurrencyConfig.RESERVED_CONCURRENCY is not None and peak > ConcurrencyConfig.RESERVED_CONCURRENCY:
+            raise ValueError("ConcurrencyConfig.RESERVED_CONCURRENCY must cover the largest provisioned concurrency")
+        return Util.create_lambda_alias(self, querylambda, ConcurrencyConfig.ALIAS_NAME,
+            provisioned_concurrency=provisioned,
+            max_capacity=ConcurrencyConfig.AUTOSCALING_MAX,
+            utilization_target=ConcurrencyConfig.UTILIZATION_TARGET,
+            schedules=ConcurrencyConfig.SCHEDULE)
+
+    # Read access to the vector index for HYBRID_RRF search, through a collection endpoint in the VPC
+    def create_search_access(self, role):
+        collection_name = OpenSearchServerlessConfig.COLLECTION_NAME
+        vpce = aoss.CfnVpcEndpoint(self, "CollectionVpcEndpoint",
+            name=f"{application_name}-aoss-vpce",
+            vpc_id=self.vpc.vpc_id,
+            subnet_ids=[subnet.subnet_id for subnet in self.vpc.isolated_subnets],
+            security_group_ids=[self.security_group.security_group_id])
+        # Network policies add up, so this one opens the collection to the VPC next to the one of the aoss stack
+        aoss.CfnSecurityPolicy(self, "QueryNetworkPolicy",
+            name=f"{collection_name}-query",
+            type="network",
+            policy=_cdk.Fn.sub(json.dumps([{
+                "Rules": [{"ResourceType": "collection", "Resource": [f"collection/{collection_name}"]}],
+                "SourceVPCEs": ["${VpceId}"]}]), {"VpceId": vpce.attr_id}))
+        aoss.CfnAccessPolicy(self, "QueryDataAccessPolicy",
+            name=f"{collection_name}-query",
+            type="data",
+            policy=_cdk.Fn.sub(json.dumps([{
+                "Rules": [{"ResourceType": "index", "Resource": [f"index/{collection_name}/*"],
+                           "Permission": ["aoss:ReadDocument", "aoss:DescribeIndex"]}],
+                "Principal": ["${RoleArn}"]}]), {"RoleArn": role.role_arn}))
+        role.add_to_policy(iam_.PolicyStatement(effect=iam_.Effect.ALLOW, actions=["aoss:APIAccessAll"],
+            resources=[Util.get_from_parameter_store(self,"collectionArn")]))
+
+    # POST <function url>/question {"question":"<Question>"} streams newline delimited JSON
+    # Lambda to stream answers through the Lambda Web Adapter and a response streaming function URL
+    def create_stream_lambda(self, querylambda):
+        if not StreamConfig.WEB_ADAPTER_LAYER_ARN:
+            raise ValueError("StreamConfig.WEB_ADAPTER_LAYER_ARN is required when streaming is enabled")
+        if PipelineConfig.MODE != "retrieve_and_generate":
+            # Answers are streamed by RetrieveAndGenerateStream, so they would not match the two-stage pipeline
+            raise ValueError("Streaming needs PipelineConfig.MODE = \"retrieve_and_generate\"")
+        adapter_layer = lambda_.LayerVersion.from_layer_version_arn(self,"web_adapter_layer",layer_version_arn=StreamConfig.WEB_ADAPTER_LAYER_ARN)
+        function_name = f"{application_name}-StreamKb"
+        # Share the query role so both functions keep the same Bedrock and VPC permissions
+        Util.create_log_group(self, function_name, querylambda.role)
+        stream_lambda = Util.create_lambda_function(self, function_name,
+                function_name=function_name,
+                description="Lambda to stream answers from knowledgebases",
+                handler="run_stream.sh",
+                code= Util.function_code(query_modules),
+                # Same layers as the query function, since the stream server imports its handler module
+                layers=[*self.optional_layers("stream"), adapter_layer],
+                role=querylambda.role,
+                architecture=Util.architecture("stream"),
+                memory_size=self.function_memory("stream"),
+                vpc=self.vpc,
+                security_groups=[self.security_group],
+                timeout=_cdk.Duration.minutes(5),
+                environment={**self.query_environment,
+                             "AWS_LAMBDA_EXEC_WRAPPER": "/opt/bootstrap",
+                             "AWS_LWA_INVOKE_MODE": "response_stream",
+                             "AWS_LWA_READINESS_CHECK_PATH": "/health",
+                             "PORT": "8080"})
+        stream_url = stream_lambda.add_function_url(
+            auth_type=lambda_.FunctionUrlAuthType(StreamConfig.FUNCTION_URL_AUTH),
+            invoke_mode=lambda_.InvokeMode.RESPONSE_STREAM)
+        return stream_lambda, stream_url
+
 # {"question":"<Question>"}
     # Method to create REST API
     def create_api_gw(self,querylambda):  
@@ -207,6 +510,8 @@ class  APIStack(Stack):
         ),
        
             cloud_watch_role=False,
+            # API Gateway compresses larger responses when the client accepts gzip or deflate
+            min_compression_size=_cdk.Size.bytes(APIConfig.MINIMUM_COMPRESSION_SIZE) if APIConfig.MINIMUM_COMPRESSION_SIZE is not None else None,
             default_cors_preflight_options={
                 "allow_origins": apigw_.Cors.ALL_ORIGINS,
                 "allow_methods": apigw_.Cors.ALL_METHODS,
@@ -249,12 +554,112 @@ class  APIStack(Stack):
                 required=["question"],
                 properties={
                     "question": apigw_.JsonSchema(type=apigw_.JsonSchemaType.STRING, min_length=1, max_length=500),
+                    "sessionId": apigw_.JsonSchema(type=apigw_.JsonSchemaType.STRING, min_length=36, max_length=36),
+                    "session": apigw_.JsonSchema(type=apigw_.JsonSchemaType.BOOLEAN),
+                    "include": apigw_.JsonSchema(type=apigw_.JsonSchemaType.ARRAY, max_items=2,
+                        items=apigw_.JsonSchema(type=apigw_.JsonSchemaType.STRING, enum=["citations", "references"])),
+                    "snippetLength": apigw_.JsonSchema(type=apigw_.JsonSchemaType.INTEGER, minimum=0, maximum=ResponseConfig.MAX_SNIPPET_LENGTH),
+                    "numberOfResults": apigw_.JsonSchema(type=apigw_.JsonSchemaType.INTEGER, minimum=1, maximum=100),
+                    "maxOutputTokens": apigw_.JsonSchema(type=apigw_.JsonSchemaType.INTEGER, minimum=1, maximum=TokenBudgetConfig.MAX_OUTPUT_TOKENS_LIMIT),
+                    "promptTemplate": apigw_.JsonSchema(type=apigw_.JsonSchemaType.STRING, min_length=1, max_length=10000),
                 }
             )
         )
         kb = apigw.root.add_resource("question")
         kb.add_method("POST",apigw_.LambdaIntegration(querylambda),api_key_required=True,request_models={"application/json": request_model})
+
+        batch_model = apigw.add_model("BrBatchRequestValidatorModel",
+            content_type="application/json",
+            model_name="BrBatchRequestValidatorModel",
+            description="This is the request validator model for the Bedrock API Gateway batch endpoint.",
+            schema=apigw_.JsonSchema(
+                schema=apigw_.JsonSchemaVersion.DRAFT4,
+                title="postBatchRequestValidatorModel",
+                type=apigw_.JsonSchemaType.OBJECT,
+                required=["questions"],
+                properties={
+                    "questions": apigw_.JsonSchema(type=apigw_.JsonSchemaType.ARRAY, min_items=1, max_items=BatchConfig.MAX_QUESTIONS,
+                        items=apigw_.JsonSchema(type=apigw_.JsonSchemaType.STRING, min_length=1, max_length=500)),
+                }
+            )
+        )
+        batch = apigw.root.add_resource("questions:batch")
+        batch.add_method("POST",apigw_.LambdaIntegration(querylambda),api_key_required=True,request_models={"application/json": batch_model})
         
+    # Method to create the query metric, emitted by src/metrics.py in Embedded Metric Format
+    def query_metric(self, function_name, metric_name, statistic, route="/question"):
+        return cloudwatch.Metric(namespace=ObservabilityConfig.METRICS_NAMESPACE, metric_name=metric_name,
+            dimensions_map={"Service": function_name, "Route": route},
+            statistic=statistic, period=_cdk.Duration.minutes(ObservabilityConfig.ALARM_PERIOD_MINUTES))
+
+    def model_metric(self, function_name, model_id, metric_name, statistic):
+        return cloudwatch.Metric(namespace=ObservabilityConfig.METRICS_NAMESPACE, metric_name=metric_name,
+            dimensions_map={"Service": function_name, "Model": model_id}, label=model_id,
+            statistic=statistic, period=_cdk.Duration.minutes(ObservabilityConfig.ALARM_PERIOD_MINUTES))
+
+    # Method to create the operations dashboard and p99 latency alarms
+    def create_dashboard_and_alarms(self, querylambda, apigw):
+        function_name = f"{application_name}-QueryKb"
+        latency = [self.query_metric(function_name, "Latency", stat) for stat in ("p50", "p90", "p99")]
+        bedrock_latency = [self.query_metric(function_name, "BedrockLatency", stat) for stat in ("p50", "p90", "p99")]
+        dashboard = cloudwatch.Dashboard(self, "QueryDashboard", dashboard_name=f"{application_name}-query")
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(title="End-to-end latency (ms)", left=latency, width=12),
+            cloudwatch.GraphWidget(title="Bedrock latency (ms)", left=bedrock_latency, width=12))
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(title="Tokens", left=[self.query_metric(function_name, "InputTokens", "Sum"),
+                                                         self.query_metric(function_name, "OutputTokens", "Sum")], width=8),
+            cloudwatch.GraphWidget(title="Questions and cache hits", left=[self.query_metric(function_name, "Questions", "Sum"),
+                                                                           self.query_metric(function_name, "CacheHit", "Sum")], width=8),
+            cloudwatch.GraphWidget(title="Answer size (bytes)", left=[self.query_metric(function_name, "AnswerSize", "p50"),
+                                                                      self.query_metric(function_name, "AnswerSize", "p99")], width=8))
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(title="Lambda errors, throttles and concurrency", left=[querylambda.metric_errors(), querylambda.metric_throttles()],
+                                   right=[querylambda.metric("ConcurrentExecutions", statistic="Maximum")], width=12),
+            cloudwatch.GraphWidget(title="API Gateway latency (ms)", left=[apigw.metric_latency(statistic="p99"), apigw.metric_integration_latency(statistic="p99")],
+                                   right=[apigw.metric_client_error(), apigw.metric_server_error()], width=12))
+        if ConcurrencyConfig.PROVISIONED_CONCURRENCY:
+            alias = self.query_target
+            dashboard.add_widgets(
+                cloudwatch.GraphWidget(title="Provisioned concurrency utilization and spillover",
+                                       left=[alias.metric("ProvisionedConcurrencyUtilization", statistic="Maximum")],
+                                       right=[alias.metric("ProvisionedConcurrencySpilloverInvocations", statistic="Sum")], width=12))
+
+        models = RouterConfig.MODEL_IDS if RouterConfig.ENABLED else [KbConfig.QUERY_MODEL_ID]
+        if ResilienceConfig.ENABLED and ResilienceConfig.FALLBACK_MODEL_ID not in models:
+            models = models + [ResilienceConfig.FALLBACK_MODEL_ID]
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(title="p95 Bedrock latency by model (ms)",
+                                   left=[self.model_metric(function_name, model_id, "BedrockLatency", "p95") for model_id in models], width=8),
+            cloudwatch.GraphWidget(title="Output tokens by model",
+                                   left=[self.model_metric(function_name, model_id, "OutputTokens", "Sum") for model_id in models], width=8),
+            cloudwatch.GraphWidget(title="Throttles, fallbacks and hedges",
+                                   left=[self.query_metric(function_name, "Throttled", "Sum"),
+                                         self.query_metric(function_name, "ModelFallback", "Sum"),
+                                         self.query_metric(function_name, "Hedged", "Sum"),
+                                         self.query_metric(function_name, "HedgeWon", "Sum")], width=8))
+
+        alarms = [
+            cloudwatch.Alarm(self, "QueryLatencyP99Alarm", metric=latency[2],
+                alarm_description="p99 end-to-end latency of /question is above the configured threshold",
+                threshold=ObservabilityConfig.LATENCY_P99_ALARM_MS,
+                evaluation_periods=ObservabilityConfig.ALARM_EVALUATION_PERIODS,
+                comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING),
+            cloudwatch.Alarm(self, "BedrockLatencyP99Alarm", metric=bedrock_latency[2],
+                alarm_description="p99 Bedrock latency of /question is above the configured threshold",
+                threshold=ObservabilityConfig.BEDROCK_LATENCY_P99_ALARM_MS,
+                evaluation_periods=ObservabilityConfig.ALARM_EVALUATION_PERIODS,
+                comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+                treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING),
+        ]
+        if ObservabilityConfig.ALARM_EMAIL:
+            topic = sns.Topic(self, "QueryAlarmTopic", topic_name=f"{application_name}-query-alarms", enforce_ssl=True)
+            topic.add_subscription(sns_subs.EmailSubscription(ObservabilityConfig.ALARM_EMAIL))
+            for alarm in alarms:
+                alarm.add_alarm_action(cw_actions.SnsAction(topic))
+        return dashboard
+
     # Method to create API throttle settings
     def create_throttle_constructor(self, config: dict):
         return apigw_.ThrottleSettings(
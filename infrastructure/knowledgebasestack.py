@@ -8,6 +8,13 @@ from aws_cdk import (
     aws_bedrock as bedrock,
     Fn as Fn,
     aws_s3 as s3,
+    aws_s3_notifications as s3n,
+    aws_sqs as sqs,
+    aws_dynamodb as dynamodb,
+    aws_lambda_event_sources as event_sources,
+    Duration,
+    CfnDeletionPolicy,
+    custom_resources as cr,
     RemovalPolicy
 )
 from aws_cdk.aws_bedrock import (
@@ -19,7 +26,7 @@ from aws_cdk.aws_opensearchserverless import (
 )
 from constructs import Construct
 import cdk_nag as _cdk_nag
-from config import EnvSettings, KbConfig,DsConfig,OpenSearchServerlessConfig
+from config import EnvSettings, KbConfig,DsConfig,OpenSearchServerlessConfig,IngestionConfig,FunctionConfig
 
 application_name = EnvSettings.PROJ_NAME
 kb_name = KbConfig.KB_NAME
@@ -33,6 +40,9 @@ class  KnowledgeBaseStack(Stack):
         account_id = dictenv['account_id']
         self.collectionArn = Util.get_from_parameter_store(self,"collectionArn")
         self.collectionName = Util.get_from_parameter_store(self,"collectionName")
+        # Versioned index managed by the index lifecycle custom resource in the aoss stack
+        self.vectorIndexName = Util.get_from_parameter_store(self,"vectorIndexName")
+        self.vectorIndexVersion = Util.get_from_parameter_store(self,"vectorIndexVersion")
         self.arn_partition='aws-us-gov' if('gov' in region) else 'aws'  
         self.embedding_model_arn = f"arn:{self.arn_partition}:bedrock:{region}::foundation-model/{KbConfig.EMBEDDING_MODEL_ID}"
         self.data_bucket_arn=self.get_bucket_arn(DsConfig.S3_BUCKET_NAME)
@@ -42,6 +52,9 @@ class  KnowledgeBaseStack(Stack):
         self.dataccesspolicy = self. create_data_access_policy_aoss(self.collectionName,self.kbRole)
         self.knowledge_base = self.create_knowledge_base(self.kbRole)
         self.data_source = self.create_data_source(self.knowledge_base)
+        self.start_initial_ingestion()
+        if IngestionConfig.ENABLED:
+            self.create_ingestion_orchestrator()
         # create an SSM parameters which store export values
         Util.store_in_parameter_store(self, "knowledgebaseId", self.knowledge_base.attr_knowledge_base_id, "knowledgebaseId", "Knowledge Base Id")
         Util.store_in_parameter_store(self, "knowledgebaseArn", self.knowledge_base.attr_knowledge_base_arn, "knowledgebaseArn", "Knowledge Base Arn")
@@ -74,9 +87,11 @@ class  KnowledgeBaseStack(Stack):
                 encryption=s3.BucketEncryption.S3_MANAGED,
                 server_access_logs_bucket=logs_bucket,
                 server_access_logs_prefix="kb-bucket-logs/")
+            self.data_bucket = kb_bucket
       
             return kb_bucket.bucket_arn
         else:
+            self.data_bucket = s3.Bucket.from_bucket_name(self, "KnowledgebaseBucketRef", bucket)
             return f"arn:{self.arn_partition}:s3:::{bucket}"
 
     def create_kb_execution_role(self) -> iam_.Role:
@@ -127,12 +142,20 @@ class  KnowledgeBaseStack(Stack):
             knowledgebase =  bedrock.CfnKnowledgeBase(
             self,"aossKB",
             role_arn=kb_role.role_arn,
-            name=kb_name,
+            # A new index version replaces the knowledge base, which needs a new name
+            name=f"{kb_name}-{self.vectorIndexVersion}",
             description=f'Managed by CDK - {application_name}',
             knowledge_base_configuration=bedrock.CfnKnowledgeBase.KnowledgeBaseConfigurationProperty(
                 type="VECTOR",
                 vector_knowledge_base_configuration=bedrock.CfnKnowledgeBase.VectorKnowledgeBaseConfigurationProperty(
-                    embedding_model_arn=self.embedding_model_arn
+                    embedding_model_arn=self.embedding_model_arn,
+                    # Must match the dimension of the index mapping created by the aoss stack
+                    embedding_model_configuration=bedrock.CfnKnowledgeBase.EmbeddingModelConfigurationProperty(
+                        bedrock_embedding_model_configuration=bedrock.CfnKnowledgeBase.BedrockEmbeddingModelConfigurationProperty(
+                            dimensions=OpenSearchServerlessConfig.VECTOR_DIMENSION,
+                            embedding_data_type="FLOAT32"
+                        )
+                    )
                 ),
             ),
             storage_configuration=CfnKnowledgeBase.StorageConfigurationProperty(
@@ -144,10 +167,13 @@ class  KnowledgeBaseStack(Stack):
                         text_field=text_field,
                         vector_field=OpenSearchServerlessConfig.VECTOR_FIELD_NAME
                     ),
-                    vector_index_name=OpenSearchServerlessConfig.INDEX_NAME
+                    vector_index_name=self.vectorIndexName
                 ),
             ),
         )
+            # The replaced knowledge base and its index are kept, so queries keep working until the API stack
+            # points at the new one. Delete the old knowledge base once the switch is done.
+            knowledgebase.cfn_options.update_replace_policy = CfnDeletionPolicy.RETAIN
             return knowledgebase
     
        
@@ -181,7 +207,7 @@ class  KnowledgeBaseStack(Stack):
                     chunking_strategy="NONE"
                 )
             )
-        return bedrock.CfnDataSource(
+        data_source = bedrock.CfnDataSource(
             self,
             "RagDataSource",
             knowledge_base_id=kbid,
@@ -196,5 +222,72 @@ class  KnowledgeBaseStack(Stack):
             ),
             vector_ingestion_configuration=vector_ingestion_configuration
         )
-      
-    
\ No newline at end of file
+        data_source.cfn_options.update_replace_policy = CfnDeletionPolicy.RETAIN
+        return data_source
+
+    # Sync a new data source once, which fills a new index version from the bucket
+    def start_initial_ingestion(self):
+        sync = cr.AwsSdkCall(
+            service="BedrockAgent",
+            action="startIngestionJob",
+            parameters={"knowledgeBaseId": self.knowledge_base.attr_knowledge_base_id,
+                        "dataSourceId": self.data_source.attr_data_source_id},
+            physical_resource_id=cr.PhysicalResourceId.of(self.data_source.attr_data_source_id))
+        # A new index version replaces the knowledge base and data source, which changes the parameters
+        # and makes CloudFormation update this resource, so the replacement is synced as well
+        start_ingestion = cr.AwsCustomResource(self, "InitialIngestion",
+            on_create=sync,
+            on_update=sync,
+            policy=cr.AwsCustomResourcePolicy.from_statements([iam_.PolicyStatement(effect=iam_.Effect.ALLOW,
+                actions=["bedrock:StartIngestionJob"],
+                resources=[self.knowledge_base.attr_knowledge_base_arn])]),
+            removal_policy=RemovalPolicy.DESTROY,
+            timeout=Duration.seconds(120))
+        start_ingestion.node.add_dependency(self.data_source)
+        return start_ingestion
+
+    # S3 events -> SQS (debounce window) -> Lambda that starts one ingestion job per burst of changed objects
+    def create_ingestion_orchestrator(self):
+        function_name = f"{application_name}-IngestOrchestrator"
+        manifest_table = dynamodb.Table(self, "IngestionManifest",
+            table_name=f"{application_name}-ingestion-manifest",
+            partition_key=dynamodb.Attribute(name="object_key", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=RemovalPolicy.DESTROY)
+        dead_letter_queue = sqs.Queue(self, "IngestionEventsDLQ",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            retention_period=Duration.days(14))
+        # A batch that hits a running ingestion job becomes visible again after this timeout and is retried
+        events_queue = sqs.Queue(self, "IngestionEvents",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            visibility_timeout=Duration.seconds(IngestionConfig.RETRY_AFTER_SECONDS),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=IngestionConfig.MAX_RECEIVE_COUNT, queue=dead_letter_queue))
+        filters = [s3.NotificationKeyFilter(prefix=IngestionConfig.KEY_PREFIX)] if IngestionConfig.KEY_PREFIX else []
+        for event_type in (s3.EventType.OBJECT_CREATED, s3.EventType.OBJECT_REMOVED):
+            self.data_bucket.add_event_notification(event_type, s3n.SqsDestination(events_queue), *filters)
+
+        role = Util.create_lambda_execution_role(self, function_name)
+        orchestrator = Util.create_lambda_function(self, function_name,
+            function_name=function_name,
+            description="Starts knowledge base ingestion jobs for changed objects",
+            handler="ingest_orchestrator.handler",
+            code=Util.function_code(["ingest_orchestrator.py"]),
+            role=role,
+            architecture=Util.architecture("ingest"),
+            memory_size=FunctionConfig.MEMORY_MB["ingest"],
+            timeout=Duration.minutes(1),
+            environment={"KNOWLEDGE_BASE_ID": self.knowledge_base.attr_knowledge_base_id,
+                         "DATA_SOURCE_ID": self.data_source.attr_data_source_id,
+                         "MANIFEST_TABLE_NAME": manifest_table.table_name,
+                         "KEY_PREFIX": IngestionConfig.KEY_PREFIX})
+        orchestrator.add_event_source(event_sources.SqsEventSource(events_queue,
+            batch_size=IngestionConfig.MAX_BATCH_SIZE,
+            max_batching_window=Duration.seconds(IngestionConfig.DEBOUNCE_SECONDS),
+            max_concurrency=2))
+        manifest_table.grant_read_write_data(orchestrator)
+        orchestrator.add_to_role_policy(iam_.PolicyStatement(effect=iam_.Effect.ALLOW,
+            actions=["bedrock:StartIngestionJob"],
+            resources=[self.knowledge_base.attr_knowledge_base_arn]))
+        return orchestrator
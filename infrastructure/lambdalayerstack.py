@@ -6,46 +6,73 @@ from aws_cdk import (
     Tags as Tags
 )
 from constructs import Construct
-from config import EnvSettings
+from config import EnvSettings, LayerConfig, RerankConfig, FunctionConfig, StreamConfig
 application_name = EnvSettings.PROJ_NAME
 
 class  LambdaLayerStack(Stack):
     def __init__(self, scope: Construct, construct_id: str,**kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
-        self.lambdalayer = self.BuildLambdaLayer()
-        Util.store_in_parameter_store(self,'lambdalayerArn', self.lambdalayer.layer_version_arn, 'lambdalayerArn','Lambda Layer Arn')
+        # One slim layer per function and architecture, built from layers/<function>/requirements.txt
+        self.lambdalayers = {}
+        for function in LayerConfig.FUNCTION_LAYERS:
+            for architecture in self.getArchitectures(function):
+                lambdalayer = self.BuildLambdaLayer(function, architecture)
+                self.lambdalayers[(function, architecture)] = lambdalayer
+                Util.store_in_parameter_store(self,Util.layer_parameter_name(function, architecture), lambdalayer.layer_version_arn,
+                                              Util.layer_parameter_name(function, architecture),f'Lambda Layer Arn for the {function} function on {architecture}')
 
-    #   
-   
-    def BuildLambdaLayer(self):
+    # Architectures of the deployed functions that load the layer
+    def getArchitectures(self, function):
+        functions = [name for name in LayerConfig.LAYER_FUNCTIONS.get(function, [function]) if name != "stream" or StreamConfig.ENABLED]
+        return sorted({FunctionConfig.ARCHITECTURE.get(name, "x86_64") for name in functions})
+
+    def BuildLambdaLayer(self, function, architecture="x86_64"):
+        # x86_64 layers keep their construct ids and names, so existing deployments update them in place
+        suffix = "" if architecture == "x86_64" else f"_{architecture}"
         lambdalayer =  lambda_.LayerVersion(
             scope=self,
-            id="LayerVersion_opensearch-py_latest",
-            layer_version_name=f"{application_name}-lambda-layer",
-            description="opensearch-py-python-layer",
-            compatible_architectures=[lambda_.Architecture.X86_64],
+            id=f"LayerVersion_{function}{suffix}",
+            layer_version_name=f"{application_name}-{function}-lambda-layer{suffix.replace('_', '-')}",
+            description=f"{function}-python-layer",
+            compatible_architectures=[lambda_.Architecture.ARM_64 if architecture == "arm64" else lambda_.Architecture.X86_64],
             compatible_runtimes=[lambda_.Runtime.PYTHON_3_13],
             code=lambda_.Code.from_asset(
-                path="./src",
+                path=f"./layers/{function}",
                 bundling=BundlingOptions(
                     image=lambda_.Runtime.PYTHON_3_13.bundling_image,
-                    command=self.getBundlingCommand(),
+                    command=self.getBundlingCommand(function, architecture),
+                    environment=self.getBundlingEnvironment(function),
                        ),
             ),
         )
         return lambdalayer
-            
-    def getBundlingCommand(self):
+
+    def getBundlingCommand(self, function, architecture="x86_64"):
+        # arm64 wheels are downloaded for the target platform, so the build needs no arm64 emulation
+        platform = " --platform manylinux2014_aarch64 --implementation cp --python-version 3.13 --only-binary=:all:" if architecture == "arm64" else ""
         return [
                 "bash","-c"," && ".join(
                     [
                         "mkdir /asset-output/python",
-                        (f'pip3 install --no-cache -t /asset-output/python -r requirements.txt'),
-                        "cp -au . /asset-output/python",
+                        (f'pip3 install --no-cache --no-compile -t /asset-output/python -r requirements.txt{platform}'),
+                        # Strip files that are never imported at runtime
+                        "find /asset-output/python -depth -type d \\( -name tests -o -name test -o -name __pycache__ \\) -exec rm -rf {} +",
+                        "rm -rf /asset-output/python/bin /asset-output/python/*.dist-info",
+                        # Layers can add files that are not Python packages, such as model weights
+                        "if [ -f build.py ]; then python3 build.py /asset-output; fi",
+                        # /opt is read-only, so ship bytecode instead of compiling it on every cold start.
+                        # Hash based pycs stay valid even though the zip does not keep exact source mtimes.
+                        "python3 -m compileall -q -j 0 --invalidation-mode unchecked-hash /asset-output/python",
+                        f'echo "Layer {function} ({architecture}) size: $(du -sh /asset-output | cut -f1), files: $(find /asset-output -type f | wc -l)"',
                     ]
                 ),
             ]
 
- 
-   
-     
\ No newline at end of file
+    def getBundlingEnvironment(self, function):
+        if function == "rerank":
+            return {"MODEL_REPO": RerankConfig.MODEL_REPO, "MODEL_FILE": RerankConfig.MODEL_FILE}
+        return {}
+
+
+
+
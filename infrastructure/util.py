@@ -5,12 +5,14 @@ from aws_cdk import (
     CfnOutput as _output,
     aws_lambda as _lambda,
     Duration,
+    aws_applicationautoscaling as appscaling,
     aws_iam as _iam,
     aws_ec2 as ec2,
     Tags as Tags
 )
 
 from aws_cdk.aws_logs import RetentionDays, LogGroup
+from config import FunctionConfig
 
 class Util:
     
@@ -26,6 +28,34 @@ class Util:
     def get_from_parameter_store(self,key):
         return ssm.StringParameter.from_string_parameter_attributes(self,id=key,parameter_name=f"/serverlessrag/{key}").string_value
 
+    # Name of the Parameter Store entry holding the layer ARN of a function.
+    # x86_64 layers keep the names they had before layers were built per architecture.
+    @staticmethod
+    def layer_parameter_name(function, architecture="x86_64"):
+        return f"lambdalayerArn-{function}" if architecture == "x86_64" else f"lambdalayerArn-{function}-{architecture}"
+
+    # Lambda architecture of a function in FunctionConfig
+    @staticmethod
+    def architecture(function):
+        return _lambda.Architecture.ARM_64 if FunctionConfig.ARCHITECTURE.get(function, "x86_64") == "arm64" else _lambda.Architecture.X86_64
+
+    # Method to import a layer built for the architecture of a function
+    def get_function_layer(self, layer, function, construct_id):
+        architecture = FunctionConfig.ARCHITECTURE.get(function, "x86_64")
+        if architecture != "x86_64":
+            construct_id = f"{construct_id}_{architecture}"
+        # Functions of the same architecture share the imported layer
+        existing = self.node.try_find_child(construct_id)
+        if existing is not None:
+            return existing
+        return _lambda.LayerVersion.from_layer_version_arn(self, construct_id,
+            layer_version_arn=Util.get_from_parameter_store(self, Util.layer_parameter_name(layer, architecture)))
+
+    # Method to package only the modules a function imports from src
+    @staticmethod
+    def function_code(modules):
+        return _lambda.Code.from_asset("src", exclude=["*"] + [f"!{module}" for module in modules])
+
     def create_lambda_function(self, func_id: str, **kwargs):
         # Set default values if not provided in kwargs
         if "runtime" not in kwargs:
@@ -36,6 +66,9 @@ class Util:
             kwargs["environment"] = {}
         if "timeout" not in kwargs:
             kwargs["timeout"] = Duration.seconds(29)
+        # SnapStart snapshots the initialized environment of each published version
+        if kwargs.pop("snap_start", False):
+            kwargs["snap_start"] = _lambda.SnapStartConf.ON_PUBLISHED_VERSIONS
             
         # Handle VPC configuration if provided
         if "vpc" in kwargs:
@@ -52,6 +85,26 @@ class Util:
             **kwargs
         )
 
+    # Method to publish the current version of a function behind an alias, with optional provisioned concurrency.
+    # max_capacity above provisioned_concurrency adds utilization target tracking, and schedules
+    # ({"cron": ..., "min": ...}) set the minimum provisioned concurrency at given times.
+    def create_lambda_alias(self, function, alias_name, provisioned_concurrency=0, max_capacity=0, utilization_target=0.7, schedules=None):
+        alias = _lambda.Alias(self, f"{function.node.id}-{alias_name}",
+            alias_name=alias_name,
+            version=function.current_version,
+            provisioned_concurrent_executions=provisioned_concurrency or None)
+        schedules = schedules or []
+        if max_capacity or schedules:
+            scaling = alias.add_auto_scaling(min_capacity=provisioned_concurrency,
+                max_capacity=max([max_capacity, provisioned_concurrency] + [schedule["min"] for schedule in schedules]))
+            if max_capacity > provisioned_concurrency:
+                scaling.scale_on_utilization(utilization_target=utilization_target)
+            for i, schedule in enumerate(schedules):
+                scaling.scale_on_schedule(f"{alias_name}-schedule-{i+1}",
+                    schedule=appscaling.Schedule.expression(schedule["cron"]),
+                    min_capacity=schedule["min"])
+        return alias
+
     def add_permissions_to_lambda(self, lambda_function, effect,actions, resources, conditions=None):
         policy_statement_props = {
             "effect": _iam.Effect.ALLOW if effect else _iam.Effect.DENY,
@@ -73,8 +126,15 @@ class Util:
             description=f'Managed by CDK - {function_name}',
         )
         
+        Util.create_log_group(self, function_name, role)
+        return role
+
+    # Method to create the log group of a function and let the role write to it
+    def create_log_group(self, function_name, role) -> LogGroup:
+        # The first log group in a stack keeps its original construct id
+        log_group_id = "LambdaLogGroup" if self.node.try_find_child("LambdaLogGroup") is None else f"{function_name}-LambdaLogGroup"
         # Create the log group explicitly
-        log_group = LogGroup(self, "LambdaLogGroup",
+        log_group = LogGroup(self, log_group_id,
             log_group_name=f"/aws/lambda/{function_name}",
             retention=RetentionDays.ONE_WEEK,
             removal_policy=_cdk.RemovalPolicy.DESTROY
@@ -87,5 +147,5 @@ class Util:
             "logs:PutLogEvents"
         ],
         resources=[log_group.log_group_arn]))
-        return role
+        return log_group
  
\ No newline at end of file
@@ -0,0 +1,28 @@
+"""
+Download the cross encoder into <output>/model, which the function sees as /opt/model.
+Run by the layer build after the requirements are installed.
+"""
+import os
+import sys
+import urllib.request
+
+BASE_URL = os.environ.get("MODEL_BASE_URL", "https://huggingface.co")
+
+
+def download(repo, path, target):
+    url = f"{BASE_URL}/{repo}/resolve/main/{path}"
+    print(f"Downloading {url}")
+    with urllib.request.urlopen(url, timeout=300) as response, open(target, "wb") as f:
+        while chunk := response.read(1 << 20):
+            f.write(chunk)
+
+
+def main():
+    model_dir = os.path.join(sys.argv[1], "model")
+    os.makedirs(model_dir, exist_ok=True)
+    download(os.environ["MODEL_REPO"], os.environ["MODEL_FILE"], os.path.join(model_dir, "model.onnx"))
+    download(os.environ["MODEL_REPO"], "tokenizer.json", os.path.join(model_dir, "tokenizer.json"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+CACHE_MISS = "MISS"
+CACHE_HIT_L1 = "HIT-L1"
+CACHE_HIT_L2 = "HIT-L2"
+
+
+def normalize_question(question):
+    """
+    Lower-case the question, collapse whitespace and drop trailing punctuation
+    so trivially different spellings of the same question share a cache key
+    """
+    normalized = re.sub(r"\s+", " ", question.strip().lower())
+    return normalized.rstrip("?!. ")
+
+
+class LRUCache:
+    """
+    In-container cache with LRU eviction and a per-entry TTL.
+    Safe to share between the threads of a batch request.
+    """
+    def __init__(self, max_entries, ttl_seconds, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < self.clock():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl_seconds, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SemanticCache:
+    """
+    Shared L2 cache in DynamoDB. Items are partitioned by ingestion generation,
+    so a re-ingestion makes every older entry unreachable. Paraphrases are
+    matched by the dot product of normalized question embeddings.
+
+    Only the first max_candidates items of a generation, in sort key (question hash)
+    order, are compared for paraphrases. Beyond that, cached questions are only
+    found by an exact match, until the entries expire or the next ingestion.
+    """
+    def __init__(self, dynamodb_client, table_name, embed, threshold, ttl_seconds, max_candidates):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+        self.embed = embed
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_candidates = max_candidates
+        # Embeddings of recently missed questions, so storing their answer does not embed them again
+        self.embeddings = LRUCache(256, 300)
+
+    @staticmethod
+    def key_for(normalized):
+        return hashlib.sha256(normalized.encode("utf8")).hexdigest()
+
+    def embedding(self, normalized):
+        vector = self.embeddings.get(normalized)
+        if vector is None:
+            vector = array("f", self.embed(normalized))
+            self.embeddings.put(normalized, vector)
+        return vector
+
+    def get(self, generation, normalized):
+        """
+        Return (answer, similarity) for the closest cached question, or None
+        """
+        now = int(time.time())
+        item = self.dynamodb_client.get_item(
+            TableName=self.table_name,
+            Key={"pk": {"S": generation}, "sk": {"S": self.key_for(normalized)}},
+        ).get("Item")
+        if item and int(item["expires_at"]["N"]) > now:
+            return item["answer"]["S"], 1.0
+
+        query_vector = self.embedding(normalized)
+        best_answer, best_score = None, self.threshold
+        kwargs = {
+            "TableName": self.table_name,
+            "KeyConditionExpression": "pk = :pk",
+            "ExpressionAttributeValues": {":pk": {"S": generation}},
+            "ProjectionExpression": "answer, embedding, expires_at",
+        }
+        seen = 0
+        while seen < self.max_candidates:
+            page = self.dynamodb_client.query(Limit=self.max_candidates - seen, **kwargs)
+            for candidate in page.get("Items", []):
+                if int(candidate["expires_at"]["N"]) <= now:
+                    continue
+                vector = array("f")
+                vector.frombytes(candidate["embedding"]["B"])
+                score = sum(a * b for a, b in zip(query_vector, vector))
+                if score >= best_score:
+                    best_answer, best_score = candidate["answer"]["S"], score
+            seen += page.get("Count", 0)
+            if "LastEvaluatedKey" not in page:
+                break
+            if seen >= self.max_candidates:
+                logger.info("L2 cache lookup stopped at %d candidates", seen)
+            kwargs["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+        if best_answer is None:
+            return None
+        return best_answer, best_score
+
+    def put(self, generation, normalized, answer):
+        vector = self.embedding(normalized)
+        self.dynamodb_client.put_item(
+            TableName=self.table_name,
+            Item={
+                "pk": {"S": generation},
+                "sk": {"S": self.key_for(normalized)},
+                "question": {"S": normalized},
+                "answer": {"S": answer},
+                "embedding": {"B": vector.tobytes()},
+                "expires_at": {"N": str(int(time.time()) + self.ttl_seconds)},
+            },
+        )
+
+
+class IngestionGeneration:
+    """
+    Tracks the latest completed ingestion job of the knowledge base data source.
+    The job id is used as the cache generation, so a re-ingestion invalidates
+    both cache tiers without any explicit purge.
+    """
+    def __init__(self, bedrock_agent_client, knowledge_base_id, data_source_id, refresh_seconds,
+                 on_change=None, clock=time.monotonic):
+        self.bedrock_agent_client = bedrock_agent_client
+        self.knowledge_base_id = knowledge_base_id
+        self.data_source_id = data_source_id
+        self.refresh_seconds = refresh_seconds
+        self.on_change = on_change
+        self.clock = clock
+        self.generation = "initial"
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def current(self):
+        if not self.data_source_id:
+            return self.generation
+        with self.lock:
+            now = self.clock()
+            if self.checked_at is not None and now - self.checked_at < self.refresh_seconds:
+                return self.generation
+            self.checked_at = now
+        return self.refresh()
+
+    def refresh(self):
+        try:
+            jobs = self.bedrock_agent_client.list_ingestion_jobs(
+                knowledgeBaseId=self.knowledge_base_id,
+                dataSourceId=self.data_source_id,
+                filters=[{"attribute": "STATUS", "operator": "EQ", "values": ["COMPLETE"]}],
+                sortBy={"attribute": "STARTED_AT", "order": "DESCENDING"},
+                maxResults=1,
+            ).get("ingestionJobSummaries", [])
+        except Exception as e:
+            # Keep serving the previous generation rather than failing the request
+            logger.warning("Unable to refresh ingestion generation: %s", e)
+            return self.generation
+        generation = jobs[0]["ingestionJobId"] if jobs else "initial"
+        if generation != self.generation:
+            logger.info("Ingestion generation changed from %s to %s", self.generation, generation)
+            self.generation = generation
+            if self.on_change:
+                self.on_change()
+        return self.generation
+
+
+class AnswerCache:
+    """
+    Tiered answer cache: L1 in-container LRU/TTL, L2 shared semantic cache
+    """
+    def __init__(self, l1, generation, l2=None):
+        self.l1 = l1
+        self.generation = generation
+        self.l2 = l2
+        self.generation.on_change = self.l1.clear
+
+    def lookup(self, question):
+        """
+        Return (answer, status) where status is one of the CACHE_* constants
+        """
+        generation = self.generation.current()
+        normalized = normalize_question(question)
+        answer = self.l1.get((generation, normalized))
+        if answer is not None:
+            return answer, CACHE_HIT_L1
+        if self.l2 is not None:
+            try:
+                hit = self.l2.get(generation, normalized)
+            except Exception as e:
+                logger.warning("L2 cache lookup failed: %s", e)
+                hit = None
+            if hit is not None:
+                answer, similarity = hit
+                logger.info("L2 cache hit with similarity %.3f", similarity)
+                self.l1.put((generation, normalized), answer)
+                return answer, CACHE_HIT_L2
+        return None, CACHE_MISS
+
+    def store(self, question, answer):
+        generation = self.generation.current()
+        normalized = normalize_question(question)
+        self.l1.put((generation, normalized), answer)
+        if self.l2 is not None:
+            try:
+                self.l2.put(generation, normalized, answer)
+            except Exception as e:
+                logger.warning("L2 cache store failed: %s", e)
+
+
+def titan_embedder(bedrock_runtime_client, model_id, dimensions):
+    def embed(text):
+        response = bedrock_runtime_client.invoke_model(
+            modelId=model_id,
+            contentType="application/json",
+            accept="application/json",
+            body=json.dumps({"inputText": text, "dimensions": dimensions, "normalize": True}),
+        )
+        return json.loads(response["body"].read())["embedding"]
+    return embed
+
+
+def from_environment(client_factory):
+    """
+    Build the answer cache from the Lambda environment, or None when disabled.
+    client_factory(service_name) returns a boto3 client for the service.
+    """
+    if os.environ.get("CACHE_ENABLED", "false").lower() != "true":
+        return None
+    l1 = LRUCache(int(os.environ.get("CACHE_L1_MAX_ENTRIES", "256")),
+                  int(os.environ.get("CACHE_L1_TTL_SECONDS", "900")))
+    generation = IngestionGeneration(client_factory("bedrock-agent"),
+                                     os.environ.get("KNOWLEDGE_BASE_ID"),
+                                     os.environ.get("DATA_SOURCE_ID"),
+                                     int(os.environ.get("CACHE_GENERATION_REFRESH_SECONDS", "60")))
+    l2 = None
+    table_name = os.environ.get("CACHE_TABLE_NAME")
+    if table_name:
+        embed = titan_embedder(client_factory("bedrock-runtime"),
+                               os.environ["CACHE_EMBEDDING_MODEL_ID"],
+                               int(os.environ.get("CACHE_EMBEDDING_DIMENSIONS", "256")))
+        l2 = SemanticCache(client_factory("dynamodb"), table_name, embed,
+                           float(os.environ.get("CACHE_SIMILARITY_THRESHOLD", "0.92")),
+                           int(os.environ.get("CACHE_L2_TTL_SECONDS", "86400")),
+                           int(os.environ.get("CACHE_L2_MAX_CANDIDATES", "500")))
+    return AnswerCache(l1, generation, l2)
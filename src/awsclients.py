@@ -0,0 +1,89 @@
+import os
+import time
+import threading
+import inittiming
+
+# boto3 and botocore take a large share of cold start time, so they are only
+# imported when the first client is actually needed.
+
+_session = None
+_clients = {}
+_lock = threading.Lock()
+
+
+def client_config(service_name=None, read_timeout=None, max_attempts=None):
+    from botocore.config import Config
+    # Services whose calls go through resilience.ResilientInvoker retry there, so botocore makes a single attempt
+    no_retry_services = os.environ.get("CLIENT_NO_RETRY_SERVICES", "").split(",")
+    if max_attempts is None:
+        max_attempts = 1 if service_name in no_retry_services else int(os.environ.get("CLIENT_MAX_ATTEMPTS", "3"))
+    return Config(
+        tcp_keepalive=True,
+        max_pool_connections=int(os.environ.get("CLIENT_MAX_POOL_CONNECTIONS", "10")),
+        connect_timeout=float(os.environ.get("CLIENT_CONNECT_TIMEOUT_SECONDS", "2")),
+        read_timeout=read_timeout or float(os.environ.get("CLIENT_READ_TIMEOUT_SECONDS", "120")),
+        retries={"mode": "standard", "max_attempts": max_attempts},
+    )
+
+
+def client_key(service_name, read_timeout=None, max_attempts=None):
+    # Clients with the default settings are keyed by service name alone
+    if read_timeout is None and max_attempts is None:
+        return service_name
+    return service_name, read_timeout, max_attempts
+
+
+def get_client(service_name, read_timeout=None, max_attempts=None):
+    """
+    Return the container-wide client for the service, building it on first use.
+    Clients are thread safe, so batch workers share one client and its connection pool.
+    read_timeout and max_attempts override the settings of client_config, in a client of their own.
+    """
+    global _session
+    key = client_key(service_name, read_timeout, max_attempts)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        if key not in _clients:
+            start = time.perf_counter()
+            if _session is None:
+                _session = inittiming.timed_import("boto3").session.Session()
+            _clients[key] = _session.client(
+                service_name, region_name=os.environ["AWS_REGION"],
+                config=client_config(service_name, read_timeout, max_attempts))
+            inittiming.record_client(service_name, time.perf_counter() - start)
+        return _clients[key]
+
+
+class LazyClient:
+    """
+    Stand-in that builds the real client on first attribute access
+    """
+    def __init__(self, service_name, read_timeout=None, max_attempts=None):
+        self.service_name = service_name
+        self.read_timeout = read_timeout
+        self.max_attempts = max_attempts
+
+    def __getattr__(self, name):
+        return getattr(get_client(self.service_name, self.read_timeout, self.max_attempts), name)
+
+
+def prewarm(service_names):
+    for service_name in service_names:
+        get_client(service_name)
+
+
+def refresh():
+    """
+    Rebuild the clients built so far, with new connection pools. The session keeps
+    the loaded service models, so this is much faster than building them the first time.
+    """
+    with _lock:
+        keys = list(_clients)
+        _clients.clear()
+    for key in keys:
+        if isinstance(key, tuple):
+            get_client(*key)
+        else:
+            get_client(key)
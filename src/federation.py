@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+import threading
+
+STATUS_OK = "ok"
+STATUS_TIMEOUT = "timeout"
+STATUS_ERROR = "error"
+
+
+def chunk_key(chunk):
+    """
+    Identity of a chunk across knowledge bases: its source and text, since the same
+    document is often ingested into more than one program office's knowledge base
+    """
+    uri = ((chunk.get("location") or {}).get("s3Location") or {}).get("uri", "")
+    return uri, hashlib.sha256(" ".join(chunk["text"].split()).encode("utf8")).hexdigest()
+
+
+def merge(results, number_of_results):
+    """
+    Merge the chunks retrieved from each knowledge base into the number_of_results best by score,
+    keeping the best scored copy of duplicates. Every knowledge base uses the same embedding model,
+    so their scores are comparable.
+    """
+    best = {}
+    for knowledge_base_id, chunks in results.items():
+        for chunk in chunks:
+            key = chunk_key(chunk)
+            if key not in best or (chunk.get("score") or 0) > (best[key].get("score") or 0):
+                best[key] = dict(chunk, knowledge_base_id=knowledge_base_id)
+    return sorted(best.values(), key=lambda chunk: chunk.get("score") or 0, reverse=True)[:number_of_results]
+
+
+class Federation:
+    """
+    Fans retrieval out to several knowledge bases concurrently. A knowledge base that
+    has not answered within the timeout, or fails, is left out of the merged result
+    instead of holding up or failing the answer.
+    """
+    def __init__(self, own_knowledge_base_id, knowledge_base_ids, routes, default_route, timeout, max_workers):
+        self.own_knowledge_base_id = own_knowledge_base_id
+        # "self" in a route stands for the knowledge base of this stack, whose id is only known after deployment
+        self.routes = {name: [own_knowledge_base_id if kb == "self" else kb for kb in ids] for name, ids in routes.items()}
+        self.default_route = default_route
+        self.allowed = {own_knowledge_base_id, *knowledge_base_ids, *(kb for ids in self.routes.values() for kb in ids)}
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def resolve(self, knowledge_base_ids=None, route=None):
+        """
+        Knowledge base ids of a request, from an explicit list or a route name.
+        Raises ValueError for unknown routes or knowledge bases that are not allowed.
+        """
+        if knowledge_base_ids is not None:
+            if not isinstance(knowledge_base_ids, list) or not knowledge_base_ids:
+                raise ValueError("knowledgeBaseIds must be a non-empty list")
+            unknown = sorted(set(knowledge_base_ids) - self.allowed)
+            if unknown:
+                raise ValueError(f"knowledgeBaseIds not allowed: {', '.join(map(str, unknown))}")
+            return list(dict.fromkeys(knowledge_base_ids))
+        route = route or self.default_route
+        if not route:
+            return [self.own_knowledge_base_id]
+        if route not in self.routes:
+            raise ValueError(f"knowledgeBaseRoute must be one of {', '.join(sorted(self.routes))}")
+        return list(self.routes[route])
+
+    def retrieve(self, knowledge_base_ids, retrieve_one, number_of_results, request_metrics=None):
+        """
+        Run retrieve_one(knowledge_base_id) for every knowledge base and merge the chunks.
+        Returns (chunks, {knowledge_base_id: status}).
+        """
+        # Imported here like in the batch handler, to keep it out of the cold start
+        from concurrent.futures import ThreadPoolExecutor, wait
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="federation")
+        futures = {knowledge_base_id: self.executor.submit(retrieve_one, knowledge_base_id)
+                   for knowledge_base_id in knowledge_base_ids}
+        wait(futures.values(), timeout=self.timeout)
+        results, statuses = {}, {}
+        for knowledge_base_id, future in futures.items():
+            if not future.done():
+                # The call keeps running on its worker, but the answer no longer waits for it
+                future.cancel()
+                statuses[knowledge_base_id] = STATUS_TIMEOUT
+            elif future.exception() is not None:
+                statuses[knowledge_base_id] = STATUS_ERROR
+            else:
+                results[knowledge_base_id] = future.result()
+                statuses[knowledge_base_id] = STATUS_OK
+        if request_metrics is not None:
+            request_metrics.add("FederatedKnowledgeBases", len(knowledge_base_ids))
+            request_metrics.add("KnowledgeBasesDegraded", len(knowledge_base_ids) - len(results))
+        if not results:
+            if all(status == STATUS_ERROR for status in statuses.values()):
+                raise next(iter(futures.values())).exception()
+            raise TimeoutError(f"No knowledge base answered within {self.timeout} seconds")
+        return merge(results, number_of_results), statuses
+
+
+def from_environment():
+    """
+    Build the federation from the Lambda environment, or None when federated retrieval is disabled
+    """
+    if os.environ.get("FEDERATION_ENABLED", "false").lower() != "true":
+        return None
+    return Federation(os.environ["KNOWLEDGE_BASE_ID"],
+                      list(filter(None, os.environ.get("FEDERATION_KNOWLEDGE_BASE_IDS", "").split(","))),
+                      json.loads(os.environ.get("FEDERATION_ROUTES") or "{}"),
+                      os.environ.get("FEDERATION_DEFAULT_ROUTE", ""),
+                      float(os.environ.get("FEDERATION_TIMEOUT_SECONDS", "5")),
+                      int(os.environ.get("FEDERATION_MAX_WORKERS", "16")))
@@ -0,0 +1,171 @@
+import os
+import time
+import math
+import threading
+from collections import deque
+import metrics
+
+
+class LatencyTracker:
+    """
+    Sliding window of recent call latencies in seconds
+    """
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, pct):
+        with self.lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class HedgeBudget:
+    """
+    Caps hedges to a fraction of requests: every request earns max_rate of a
+    hedge, and a hedge is only sent when a whole one has been earned
+    """
+    def __init__(self, max_rate, burst=2.0):
+        self.max_rate = max_rate
+        self.burst = burst
+        self.credits = 1.0
+        self.lock = threading.Lock()
+
+    def on_request(self):
+        with self.lock:
+            self.credits = min(self.burst, self.credits + self.max_rate)
+
+    def try_spend(self):
+        with self.lock:
+            if self.credits >= 1:
+                self.credits -= 1
+                return True
+            return False
+
+    def refund(self):
+        with self.lock:
+            self.credits = min(self.burst, self.credits + 1)
+
+
+class Hedger:
+    """
+    Sends a second identical call when the first has not returned after the
+    configured percentile of recent latencies, and returns whichever succeeds first.
+    The slower call is left to finish in the background since boto3 calls cannot be cancelled.
+    Only first calls feed the latencies, whether or not a hedge beats them, since the hedges
+    that win are the fast tail and would pull the delay down over time.
+    """
+    def __init__(self, percentile, initial_delay, min_delay, max_rate, window, min_samples, max_workers,
+                 clock=time.perf_counter):
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.window = window
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+        self.clock = clock
+        self.budget = HedgeBudget(max_rate)
+        self.trackers = {}
+        self.executor = None
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "hedged": 0, "hedge_won": 0, "skipped_by_budget": 0, "skipped_by_rate_limit": 0}
+
+    def tracker(self, name):
+        with self.lock:
+            if name not in self.trackers:
+                self.trackers[name] = LatencyTracker(self.window)
+            return self.trackers[name]
+
+    def delay(self, name):
+        """
+        Seconds to wait before hedging calls of this name
+        """
+        tracker = self.tracker(name)
+        if len(tracker) < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, tracker.percentile(self.percentile))
+
+    def count(self, stat, request_metrics=None, metric_name=None):
+        with self.lock:
+            self.stats[stat] += 1
+        if request_metrics is not None and metric_name:
+            request_metrics.add(metric_name, 1)
+
+    def call(self, name, fn, request_metrics=None, acquire=None):
+        """
+        Return fn(), hedged with a second fn() call when the first is slow.
+        acquire() takes a rate limit token for the hedge without waiting, and returns False when none is left.
+        Both calls run with the metrics of the calling thread bound, so batch workers keep their request metrics.
+        """
+        # Imported here like in the batch handler, to keep it out of the cold start
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        with self.lock:
+            if self.executor is None:
+                # Built on first use so containers with hedging disabled do not start threads
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hedge")
+        self.count("requests")
+        self.budget.on_request()
+        tracker = self.tracker(name)
+        caller_metrics = metrics.current()
+
+        def run():
+            metrics.bind(caller_metrics)
+            try:
+                return fn()
+            finally:
+                metrics.bind(None)
+        start = self.clock()
+        primary = self.executor.submit(run)
+
+        def record(future):
+            if future.exception() is None:
+                tracker.add(self.clock() - start)
+        primary.add_done_callback(record)
+        wait([primary], timeout=self.delay(name))
+        if primary.done():
+            return primary.result()
+        if not self.budget.try_spend():
+            self.count("skipped_by_budget", request_metrics, "HedgeSkipped")
+            return primary.result()
+        if acquire is not None and not acquire():
+            self.budget.refund()
+            self.count("skipped_by_rate_limit", request_metrics, "HedgeSkipped")
+            return primary.result()
+
+        hedge = self.executor.submit(run)
+        self.count("hedged", request_metrics, "Hedged")
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self.count("hedge_won", request_metrics, "HedgeWon")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+
+def from_environment():
+    """
+    Build the hedger from the Lambda environment, or None when hedging is disabled
+    """
+    if os.environ.get("HEDGE_ENABLED", "false").lower() != "true":
+        return None
+    return Hedger(float(os.environ.get("HEDGE_PERCENTILE", "95")),
+                  float(os.environ.get("HEDGE_INITIAL_DELAY_MS", "3000")) / 1000,
+                  float(os.environ.get("HEDGE_MIN_DELAY_MS", "500")) / 1000,
+                  float(os.environ.get("HEDGE_MAX_RATE", "0.05")),
+                  int(os.environ.get("HEDGE_WINDOW", "200")),
+                  int(os.environ.get("HEDGE_MIN_SAMPLES", "20")),
+                  int(os.environ.get("HEDGE_MAX_WORKERS", "16")))
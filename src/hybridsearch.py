@@ -0,0 +1,124 @@
+import os
+import json
+import threading
+import answercache
+import searchfilter
+
+# Field names of the Bedrock knowledge base field mapping, as in ossindex
+TEXT_FIELD = "AOSS_KB_TEXT_CHUNK"
+METADATA_FIELD = "AOSS_KB_METADATA"
+SOURCE_URI_KEY = "x-amz-bedrock-kb-source-uri"
+
+SEARCH_SEMANTIC = "SEMANTIC"
+SEARCH_HYBRID = "HYBRID"
+# Lexical and kNN queries run by this module and fused with reciprocal rank fusion
+SEARCH_HYBRID_RRF = "HYBRID_RRF"
+SEARCH_TYPES = (SEARCH_SEMANTIC, SEARCH_HYBRID, SEARCH_HYBRID_RRF)
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuse ranked lists of ids into [(id, score)], best first.
+    Each list adds 1 / (k + rank) to the score of every id it contains, so ids
+    ranked well by both queries win without comparing BM25 and vector scores.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def to_chunk(hit, score):
+    """
+    A search hit in the chunk format of the Bedrock Retrieve results
+    """
+    source = hit["_source"]
+    metadata = source.get(METADATA_FIELD) or {}
+    if isinstance(metadata, str):
+        metadata = json.loads(metadata)
+    uri = metadata.get(SOURCE_URI_KEY)
+    return {"text": source.get(TEXT_FIELD, ""),
+            "score": score,
+            "location": {"type": "S3", "s3Location": {"uri": uri}} if uri else None,
+            "metadata": metadata}
+
+
+class HybridRetriever:
+    """
+    Runs a BM25 match query on the chunk text and a kNN query on the vector field
+    of the collection in parallel, and fuses both rankings with RRF.
+    """
+    def __init__(self, search_client, embed, index_name, vector_field_name, candidates=20, rrf_k=60, max_workers=8):
+        self.search_client = search_client
+        self.embed = embed
+        self.index_name = index_name
+        self.vector_field_name = vector_field_name
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.max_workers = max_workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def lexical_query(self, question, size, filters=None):
+        query = {"match": {TEXT_FIELD: question}}
+        if filters:
+            query = {"bool": {"must": [query], "filter": searchfilter.to_opensearch(filters)["bool"]["filter"]}}
+        return {"size": size, "_source": {"excludes": [self.vector_field_name]}, "query": query}
+
+    def knn_query(self, vector, size, filters=None):
+        knn = {"vector": vector, "k": size}
+        if filters:
+            # Filtering inside the kNN query lets FAISS skip non-matching vectors instead of post-filtering the top k
+            knn["filter"] = searchfilter.to_opensearch(filters)
+        return {"size": size, "_source": {"excludes": [self.vector_field_name]},
+                "query": {"knn": {self.vector_field_name: knn}}}
+
+    def search(self, body):
+        return self.search_client.search(index=self.index_name, body=body)["hits"]["hits"]
+
+    def retrieve(self, question, number_of_results, request_metrics=None, filters=None):
+        """
+        Return the number_of_results best chunks for the question
+        """
+        # Imported here like in the batch handler, to keep it out of the cold start
+        from concurrent.futures import ThreadPoolExecutor
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="lexical")
+        size = max(self.candidates, number_of_results)
+        lexical = self.executor.submit(self.search, self.lexical_query(question, size, filters))
+        # The kNN query runs on the calling thread, after embedding the question
+        knn_hits = self.search(self.knn_query(self.embed(question), size, filters))
+        lexical_hits = lexical.result()
+
+        hits = {hit["_id"]: hit for hit in knn_hits + lexical_hits}
+        fused = reciprocal_rank_fusion([[hit["_id"] for hit in lexical_hits], [hit["_id"] for hit in knn_hits]],
+                                       self.rrf_k)[:number_of_results]
+        if request_metrics is not None:
+            knn_ids = {hit["_id"] for hit in knn_hits}
+            # Chunks the vector search alone would have missed
+            request_metrics.add("LexicalOnlyChunks", sum(1 for doc_id, _ in fused if doc_id not in knn_ids))
+        return [to_chunk(hits[doc_id], score) for doc_id, score in fused]
+
+
+def from_environment(client_factory):
+    """
+    Build the hybrid retriever from the Lambda environment, or None when HYBRID_RRF search is not enabled.
+    client_factory(service_name) returns a boto3 client for the service.
+    """
+    if os.environ.get("HYBRID_RRF_ENABLED", "false").lower() != "true":
+        return None
+    # ossindex imports the OpenSearch client, which only the layer of hybrid deployments needs to load
+    import ossindex
+    search_client = ossindex.aoss_client(os.environ["COLLECTION_HOST"].split("//")[-1], os.environ["AWS_REGION"],
+                                         pool_maxsize=int(os.environ.get("CLIENT_MAX_POOL_CONNECTIONS", "10")))
+    embed = answercache.titan_embedder(client_factory("bedrock-runtime"),
+                                       os.environ["EMBEDDING_MODEL_ID"],
+                                       int(os.environ.get("EMBEDDING_DIMENSIONS", "1024")))
+    return HybridRetriever(search_client, embed,
+                           os.environ["VECTOR_INDEX_NAME"],
+                           os.environ["VECTOR_FIELD_NAME"],
+                           int(os.environ.get("HYBRID_CANDIDATES", "20")),
+                           int(os.environ.get("HYBRID_RRF_K", "60")),
+                           int(os.environ.get("BATCH_MAX_WORKERS", "8")))
@@ -0,0 +1,99 @@
+import os
+import json
+import hashlib
+import logging
+import urllib.parse
+import boto3
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+KNOWLEDGE_BASE_ID = os.environ.get("KNOWLEDGE_BASE_ID")
+DATA_SOURCE_ID = os.environ.get("DATA_SOURCE_ID")
+MANIFEST_TABLE_NAME = os.environ.get("MANIFEST_TABLE_NAME")
+KEY_PREFIX = os.environ.get("KEY_PREFIX", "")
+
+bedrock_agent_client = boto3.client("bedrock-agent")
+dynamodb_client = boto3.client("dynamodb")
+
+# S3 object events reach this function through an SQS queue whose batching
+# window is the debounce window: a burst of uploads arrives as one batch and
+# starts at most one ingestion job. The manifest maps each object key to its
+# ETag, the content hash S3 reports in the event, so re-uploads of unchanged
+# content do not start a sync.
+
+
+def handler(event, context):
+    changes = object_changes(event["Records"])
+    deltas = manifest_deltas(changes)
+    summary = {"events": len(changes), "changed": len(deltas), "unchanged": len(changes) - len(deltas)}
+    if deltas:
+        # The manifest is only updated once the job has started, so a failed start is retried from SQS in full
+        summary["ingestionJobId"] = start_ingestion_job(event["Records"])
+        update_manifest(deltas)
+    logger.info(json.dumps(summary))
+    return summary
+
+
+def object_changes(records):
+    """
+    Latest event per object key from the SQS records, as {key: etag or None for deletions}
+    """
+    changes = {}
+    for record in records:
+        body = json.loads(record["body"])
+        # S3 sends a test event when the notification is first configured
+        for s3_record in body.get("Records", []):
+            key = urllib.parse.unquote_plus(s3_record["s3"]["object"]["key"])
+            if not key.startswith(KEY_PREFIX) or key.endswith("/"):
+                continue
+            if s3_record["eventName"].startswith("ObjectRemoved"):
+                changes[key] = None
+            else:
+                changes[key] = s3_record["s3"]["object"].get("eTag")
+    return changes
+
+
+def manifest_deltas(changes):
+    """
+    The subset of changes whose content differs from the manifest
+    """
+    known = {}
+    keys = list(changes)
+    for start in range(0, len(keys), 100):
+        request = {MANIFEST_TABLE_NAME: {"Keys": [{"object_key": {"S": key}} for key in keys[start:start + 100]],
+                                         "ProjectionExpression": "object_key, etag"}}
+        while request:
+            response = dynamodb_client.batch_get_item(RequestItems=request)
+            for item in response["Responses"].get(MANIFEST_TABLE_NAME, []):
+                known[item["object_key"]["S"]] = item["etag"]["S"]
+            request = response.get("UnprocessedKeys")
+    # Deletions always count, since objects uploaded before the manifest existed are not in it
+    return {key: etag for key, etag in changes.items() if etag is None or known.get(key) != etag}
+
+
+def start_ingestion_job(records):
+    # The client token makes a redelivered batch reuse the job it already started
+    token = hashlib.sha256("".join(sorted(record["messageId"] for record in records)).encode("utf8")).hexdigest()[:64]
+    try:
+        response = bedrock_agent_client.start_ingestion_job(
+            knowledgeBaseId=KNOWLEDGE_BASE_ID,
+            dataSourceId=DATA_SOURCE_ID,
+            clientToken=token,
+            description=f"Incremental sync of {len(records)} object events",
+        )
+    except bedrock_agent_client.exceptions.ConflictException:
+        # A job is already running; raising returns the batch to the queue and it is retried after the visibility timeout
+        logger.warning("An ingestion job is already running, retrying the batch later")
+        raise
+    return response["ingestionJob"]["ingestionJobId"]
+
+
+def update_manifest(deltas):
+    requests = [{"DeleteRequest": {"Key": {"object_key": {"S": key}}}} if etag is None else
+                {"PutRequest": {"Item": {"object_key": {"S": key}, "etag": {"S": etag}}}}
+                for key, etag in deltas.items()]
+    for start in range(0, len(requests), 25):
+        request = {MANIFEST_TABLE_NAME: requests[start:start + 25]}
+        while request:
+            request = dynamodb_client.batch_write_item(RequestItems=request).get("UnprocessedItems")
@@ -0,0 +1,45 @@
+import json
+import time
+import importlib
+
+# Init-phase timings of the query function, reported once per container so cold
+# starts can be measured from CloudWatch Logs:
+# {"init_timing": {"imports_ms": {...}, "clients_ms": {...}, "init_ms": ...}}
+
+_started = time.perf_counter()
+_imports = {}
+_clients = {}
+_init_ms = None
+_reported = False
+
+
+def timed_import(module_name):
+    if module_name in _imports:
+        return importlib.import_module(module_name)
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    _imports[module_name] = round((time.perf_counter() - start) * 1000, 2)
+    return module
+
+
+def record_client(service_name, seconds):
+    _clients[service_name] = round(seconds * 1000, 2)
+
+
+def init_done():
+    global _init_ms
+    _init_ms = round((time.perf_counter() - _started) * 1000, 2)
+
+
+def report():
+    """
+    Print the timing report on the first invocation of the container.
+    Clients built lazily during that invocation are included.
+    """
+    global _reported
+    if _reported:
+        return None
+    _reported = True
+    timing = {"imports_ms": _imports, "clients_ms": _clients, "init_ms": _init_ms}
+    print(json.dumps({"init_timing": timing}))
+    return timing
@@ -1,47 +1,482 @@
+import inittiming
 import os
-from boto3 import client
+import time
 import json
+import random
+import functools
+from awsclients import LazyClient, prewarm, refresh
+import metrics
 
-bedrock_agent_runtime_client = client("bedrock-agent-runtime", region_name=os.environ["AWS_REGION"])
+def feature_enabled(flag):
+    return os.environ.get(flag, "false").lower() == "true"
 
-def return_message(statuscode,message):
+def feature(module_name, enabled):
+    """
+    Import a feature module only when its feature is enabled, so init loads and times
+    just the modules this deployment uses. Returns None for disabled features.
+    """
+    return inittiming.timed_import(module_name) if enabled else None
+
+answercache = feature("answercache", feature_enabled("CACHE_ENABLED"))
+twostage_pipeline = feature("twostage_pipeline", os.environ.get("PIPELINE_MODE") == "retrieve_then_generate")
+sessionstore = feature("sessionstore", feature_enabled("SESSIONS_ENABLED"))
+resilience = feature("resilience", feature_enabled("RESILIENCE_ENABLED"))
+modelrouter = feature("modelrouter", feature_enabled("ROUTER_ENABLED"))
+hedging = feature("hedging", feature_enabled("HEDGE_ENABLED"))
+hybridsearch = feature("hybridsearch", feature_enabled("HYBRID_RRF_ENABLED"))
+searchfilter = feature("searchfilter", bool(os.environ.get("FILTER_FIELDS")))
+reranker = feature("reranker", feature_enabled("RERANK_ENABLED"))
+federation = feature("federation", feature_enabled("FEDERATION_ENABLED"))
+tokenbudget = feature("tokenbudget", feature_enabled("TOKEN_BUDGET_ENABLED"))
+
+# Search types of hybridsearch.SEARCH_TYPES, which is only imported with HYBRID_RRF enabled
+SEARCH_SEMANTIC, SEARCH_HYBRID, SEARCH_HYBRID_RRF = "SEMANTIC", "HYBRID", "HYBRID_RRF"
+SEARCH_TYPES = (SEARCH_SEMANTIC, SEARCH_HYBRID, SEARCH_HYBRID_RRF)
+# answercache.CACHE_MISS, reported without the answer cache too
+CACHE_MISS = "MISS"
+# tokenbudget.REQUEST_KEYS, rejected when token budgeting is disabled
+TOKEN_BUDGET_REQUEST_KEYS = ("numberOfResults", "maxOutputTokens", "promptTemplate")
+
+BATCH_MAX_QUESTIONS = int(os.environ.get("BATCH_MAX_QUESTIONS", "50"))
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", "8"))
+BATCH_DEADLINE_SECONDS = float(os.environ.get("BATCH_DEADLINE_SECONDS", "25"))
+BATCH_RESPONSE_SECONDS = 1 # Kept from the remaining invocation time to return the batch response
+SEARCH_TYPE = os.environ.get("SEARCH_TYPE", SEARCH_SEMANTIC)
+SEARCH_TYPE_OVERRIDE = os.environ.get("SEARCH_TYPE_OVERRIDE", "true").lower() == "true"
+# Indexed metadata fields that requests can filter on, with their types
+FILTER_FIELDS = searchfilter.fields_from_environment() if searchfilter is not None else {}
+
+# Clients are built on first use with the tuned settings in awsclients.client_config.
+# Batch workers share them, so CLIENT_MAX_POOL_CONNECTIONS is sized for all of them.
+bedrock_agent_runtime_client = LazyClient("bedrock-agent-runtime")
+answer_cache = answercache.from_environment(LazyClient) if answercache is not None else None
+sessions = sessionstore.from_environment(LazyClient) if sessionstore is not None else None
+token_budget = tokenbudget.from_environment() if tokenbudget is not None else None
+pipeline = None
+if twostage_pipeline is not None:
+    pipeline = twostage_pipeline.from_environment(bedrock_agent_runtime_client,
+                                                  LazyClient,
+                                                  answer_cache.generation.current if answer_cache is not None else None,
+                                                  hybridsearch.from_environment(LazyClient) if hybridsearch is not None else None,
+                                                  reranker.from_environment() if reranker is not None else None,
+                                                  federation.from_environment() if federation is not None else None,
+                                                  token_budget)
+invoker = resilience.from_environment() if resilience is not None else None
+router = modelrouter.from_environment() if modelrouter is not None else None
+hedger = hedging.from_environment() if hedging is not None else None
+# Comma separated services to build during init instead of on the first request
+PREWARM_CLIENTS = list(filter(None, os.environ.get("PREWARM_CLIENTS", "").split(",")))
+prewarm(PREWARM_CLIENTS)
+
+# With SnapStart this init runs once per published version, and environments resume from its snapshot
+if os.environ.get("SNAPSTART_ENABLED", "false").lower() == "true":
+    from snapshot_restore_py import register_before_snapshot, register_after_restore
+
+    @register_before_snapshot
+    def before_snapshot():
+        # Loading the service models is the slow part of building a client, so it goes into the snapshot
+        prewarm(PREWARM_CLIENTS)
+
+    @register_after_restore
+    def after_restore():
+        # Connections pooled before the snapshot are dead after restore
+        refresh()
+        # Every restored environment starts from the same random state, so log sampling and retry jitter are reseeded
+        random.seed()
+        if invoker is not None:
+            invoker.rng.seed()
+inittiming.init_done()
+
+def return_message(statuscode,message,headers=None):
      return {
             "isBase64Encoded": False,
             "statusCode": statuscode,
-            "headers": {"Content-Type": "application/json"},
+            "headers": {"Content-Type": "application/json", **(headers or {})},
             "body": message
         }
-     
+
 def handler(event, context):
-    print(event)
+    metrics.log_request(event, context)
+    request_metrics = metrics.begin(event.get('requestContext', {}).get('resourcePath') or '/question')
+    try:
+        return route(event, context)
+    finally:
+        request_metrics.flush()
+        # Reported after the first request so lazily built clients are included
+        inittiming.report()
+
+def route(event, context):
     request_context = event.get('requestContext', {})
     if request_context.get('http', {}).get('method') == 'OPTIONS':
         return return_message(200,'OK')
     if request_context.get('resourcePath') == '/health':
         return return_message(200,'Looks Good!')
+    if request_context.get('resourcePath') == '/questions:batch':
+        return batch_handler(event, context)
     try:
     # parse the input for the question
-        question = json.loads(event["body"])["question"]
-        response = retrieve_and_generate(question)
-    
-        response_body = {"answer": response['output']['text']}
-        return return_message(200,json.dumps(response_body))
+        body = json.loads(event["body"])
+        question = body["question"]
+        try:
+            filters = request_filters(body)
+            knowledge_base_ids = request_knowledge_bases(body)
+            search_type = request_search_type(body, knowledge_base_ids)
+            include, snippet_length = request_sources(body)
+            options = request_generation_options(body)
+            session_id, session_state = request_session(body)
+        except ValueError as e:
+            return return_message(400, json.dumps({"error": str(e)}))
+        if session_id is not None:
+            result = answer_question(question, session_state, search_type, filters, knowledge_base_ids, bool(include), options)
+            sessions.record(session_id, session_state, question, result["answer"])
+            response_body = {"answer": result["answer"], "sessionId": session_id}
+        else:
+            result = answer_question(question, search_type=search_type, filters=filters,
+                                     knowledge_base_ids=knowledge_base_ids, sources=bool(include), options=options)
+            response_body = {"answer": result["answer"]}
+        if include:
+            response_body.update(inittiming.timed_import("responseshape").shape(result, include, snippet_length))
+        return return_message(200,json.dumps(response_body),result_headers(result))
     except Exception as e:
+        metrics.current().error(e)
+        if throttled(e):
+            metrics.current().add("Throttled", 1 if e.status_code == 429 else 0)
+            return return_message(e.status_code, json.dumps({"error": str(e)}), {"Retry-After": str(e.retry_after)})
         return return_message(500, json.dumps({"error": str(e)}))
-    
+
+def throttled(error):
+    """
+    Whether the error is a resilience.ThrottledError, which only the invoker raises
+    """
+    return resilience is not None and isinstance(error, resilience.ThrottledError)
+
+def request_session(body):
+    """
+    (session_id, state) of the session the request continues with "sessionId" or starts with
+    "session": true, or (None, None). Sessions are opt-in, so other requests do not touch the
+    session store. Raises ValueError for unknown session ids.
+    """
+    if "sessionId" not in body and "session" not in body:
+        return None, None
+    if sessions is None:
+        raise ValueError("Sessions are not enabled")
+    if "sessionId" in body:
+        return sessions.load(body["sessionId"])
+    if body["session"] is True:
+        return sessions.start()
+    return None, None
+
+def request_filters(body):
+    """
+    Conditions of "filters" in the request body from searchfilter.parse, or None.
+    Raises ValueError for invalid filters.
+    """
+    if "filters" not in body:
+        return None
+    if searchfilter is None:
+        raise ValueError("Metadata filters are not enabled")
+    return searchfilter.parse(body["filters"], FILTER_FIELDS)
+
+def request_sources(body):
+    """
+    The ("include", "snippetLength") of the request body from responseshape.options. responseshape
+    is imported on first use, so deployments and requests without sources do not load it.
+    """
+    if "include" not in body and "snippetLength" not in body and not os.environ.get("RESPONSE_INCLUDE"):
+        return set(), 0
+    responseshape = inittiming.timed_import("responseshape")
+    return responseshape.options(body, *responseshape.defaults_from_environment())
+
+def request_search_type(body, knowledge_base_ids=None):
+    """
+    The search type asked for with "searchType" in the request body, or the configured one.
+    Raises ValueError for unknown search types, and for search types that are not available
+    for the knowledge bases of the request.
+    """
+    search_type = body.get("searchType")
+    if search_type is None:
+        search_type = SEARCH_TYPE
+    elif not SEARCH_TYPE_OVERRIDE:
+        raise ValueError("searchType cannot be set per request")
+    elif search_type not in SEARCH_TYPES:
+        raise ValueError(f"searchType must be one of {', '.join(SEARCH_TYPES)}")
+    if search_type == SEARCH_HYBRID_RRF:
+        if pipeline is None or pipeline.hybrid_retriever is None:
+            raise ValueError(f"searchType {search_type} is not enabled")
+        # The hybrid retriever only queries the collection of this stack
+        if knowledge_base_ids and knowledge_base_ids != [pipeline.knowledge_base_id]:
+            raise ValueError(f"searchType {search_type} cannot be used with other knowledge bases")
+    return search_type
+
+def request_knowledge_bases(body):
+    """
+    Knowledge base ids from "knowledgeBaseIds" or "knowledgeBaseRoute" in the request body,
+    or None for the knowledge base of this stack. Raises ValueError for invalid values.
+    """
+    federated = pipeline is not None and pipeline.federation is not None
+    if not federated:
+        if "knowledgeBaseIds" in body or "knowledgeBaseRoute" in body:
+            raise ValueError("Federated retrieval is not enabled")
+        return None
+    return pipeline.federation.resolve(body.get("knowledgeBaseIds"), body.get("knowledgeBaseRoute"))
+
+def request_generation_options(body):
+    """
+    tokenbudget.GenerationOptions of the request, or None when token budgeting is disabled.
+    Raises ValueError for invalid overrides.
+    """
+    if token_budget is None:
+        overrides = [key for key in TOKEN_BUDGET_REQUEST_KEYS if key in body]
+        if overrides:
+            raise ValueError(f"{', '.join(overrides)} need token budgeting to be enabled")
+        return None
+    return token_budget.options(body)
+
+#  { "body": "{\"questions\":[\"<Question 1>\",\"<Question 2>\"]}" }
+def batch_handler(event, context=None):
+    try:
+        body = json.loads(event["body"])
+        questions = body["questions"]
+        filters = request_filters(body)
+        knowledge_base_ids = request_knowledge_bases(body)
+        search_type = request_search_type(body, knowledge_base_ids)
+        options = request_generation_options(body)
+    except Exception as e:
+        return return_message(400, json.dumps({"error": str(e)}))
+    if not isinstance(questions, list) or not questions or len(questions) > BATCH_MAX_QUESTIONS:
+        return return_message(400, json.dumps({"error": f"questions must be a list of 1 to {BATCH_MAX_QUESTIONS} items"}))
+    deadline = BATCH_DEADLINE_SECONDS
+    if context is not None:
+        # Leave time to build the response before the invocation times out
+        deadline = min(deadline, context.get_remaining_time_in_millis() / 1000 - BATCH_RESPONSE_SECONDS)
+    return return_message(200, json.dumps({"results": answer_batch(questions, search_type, filters, knowledge_base_ids, options,
+                                                                   deadline)}))
+
+def answer_batch(questions, search_type=None, filters=None, knowledge_base_ids=None, options=None, deadline=None):
+    """
+    Answer the questions concurrently on a bounded thread pool.
+    Each result carries either an answer or an error, in request order.
+    Questions still running when the batch deadline passes are reported as errors.
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait
+    request_metrics = metrics.current()
+    timeout = BATCH_DEADLINE_SECONDS if deadline is None else max(0, deadline)
+    deadline_at = time.monotonic() + timeout
+    executor = ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(questions)))
+    futures = [executor.submit(answer_batch_item, request_metrics, deadline_at, question, search_type, filters,
+                               knowledge_base_ids, options)
+               for question in questions]
+    wait(futures, timeout=timeout)
+    # Questions still running finish in the background, bound to the metrics of this request,
+    # and their late results are dropped
+    executor.shutdown(wait=False, cancel_futures=True)
+    results = []
+    for index, future in enumerate(futures):
+        if not future.done() or future.cancelled():
+            results.append({"index": index, "error": "Batch deadline exceeded"})
+        elif future.exception() is not None:
+            metrics.current().error(future.exception())
+            error = {"index": index, "error": str(future.exception())}
+            if throttled(future.exception()):
+                error["retryAfter"] = future.exception().retry_after
+            results.append(error)
+        else:
+            result = future.result()
+            results.append({"index": index, "answer": result["answer"], "cache": result["cache"],
+                            **({"model": result["model"]} if "model" in result else {})})
+    return results
+
+def answer_batch_item(request_metrics, deadline_at, question, search_type, filters, knowledge_base_ids, options):
+    metrics.bind(request_metrics)
+    try:
+        return answer_question(question, None, search_type, filters, knowledge_base_ids, False, options, deadline_at)
+    finally:
+        metrics.bind(None)
+
+def answer_question(question, session_state=None, search_type=None, filters=None, knowledge_base_ids=None, sources=False,
+                    options=None, deadline_at=None):
+    """
+    Answer from the cache or the configured pipeline.
+    Returns a dict with the answer, cache status and per-stage timings in milliseconds.
+    With sources, the answer is generated so its citations and references are part of the result.
+    options are the tokenbudget.GenerationOptions of the request.
+    deadline_at is the time.monotonic() time until which a batch question may wait for a rate limit token.
+    """
+    # Follow-up answers depend on the conversation, so only opening questions use the answer cache
+    follow_up = bool(session_state and (session_state["turns"] or session_state["summary"]))
+    # Filtered answers only cover part of the corpus, and federated ones other knowledge bases, so they are not cached either.
+    # Neither are answers to requests that override the search type, retrieval count, output limit or prompt,
+    # since the cache key is the question alone.
+    cacheable = (not follow_up and not filters and knowledge_base_ids in (None, [os.environ["KNOWLEDGE_BASE_ID"]])
+                 and search_type in (None, SEARCH_TYPE) and not (options is not None and options.overridden))
+    # The answer cache keeps only the answer text, so requests for its sources skip the lookup
+    answer, cache_status = answer_from_cache(question) if cacheable and not sources else (None, CACHE_MISS)
+    if answer is not None:
+        result = {"answer": answer, "cache": cache_status, "timings": {}}
+        metrics.current().record_result(result)
+        return result
+    call = call_model if deadline_at is None else functools.partial(call_model, deadline_at=deadline_at)
+    if pipeline is not None:
+        result = pipeline.answer(question, session_state, choose_model, call, search_type, filters, knowledge_base_ids,
+                                 options)
+    else:
+        def generate(model_arn):
+            start = time.perf_counter()
+            generation, tokens_saved = generation_configuration(model_arn, options)
+            response = retrieve_and_generate(sessions.contextual_question(session_state, question) if follow_up else question,
+                                             model_arn, search_type, filters, **generation)
+            result = {"answer": response['output']['text'],
+                      "citations": response.get('citations', []),
+                      "timings": {"retrieve_and_generate": (time.perf_counter() - start) * 1000}}
+            if tokens_saved is not None:
+                result["tokens_saved"] = tokens_saved
+            return result
+        # RetrieveAndGenerate retrieves and generates in one call, so the context size is not known when routing
+        result = call(generate, [choose_model(question)])
+    if answer_cache is not None and cacheable:
+        answer_cache.store(question, result["answer"])
+    result["cache"] = cache_status
+    metrics.current().record_result(result)
+    return result
+
+def choose_model(question, chunks=()):
+    if router is None:
+        return os.environ["MODEL_ARN"]
+    return router.route(question, sum(len(chunk["text"]) for chunk in chunks), metrics.current())
+
+def call_model(operation, models, deadline_at=None, hedge=True):
+    """
+    Run operation(model_arn) on the chosen model. The invoker retries, rate limits and fails over
+    to the fallback model; without it the model is called once. Each attempt is hedged when enabled and hedge is set.
+    Batch questions wait for a rate limit token until deadline_at instead of failing after TOKEN_WAIT_SECONDS.
+    """
+    if hedger is not None and hedge:
+        unhedged = operation
+        # The hedge is a second Bedrock call, so it needs a token of its own
+        acquire = (lambda: invoker.bucket.try_acquire() == 0.0) if invoker is not None else None
+        operation = lambda model_arn: hedger.call(model_arn, lambda: unhedged(model_arn), metrics.current(), acquire)
+    if invoker is not None:
+        token_wait = None if deadline_at is None else max(invoker.token_wait, deadline_at - time.monotonic())
+        return invoker.call(operation, models + [model for model in invoker.models[1:] if model not in models], token_wait)
+    result = operation(models[0])
+    result["model"] = models[0]
+    return result
+
+def result_headers(result):
+    headers = {"X-Cache": result["cache"]}
+    if "model" in result:
+        headers["X-Model"] = result["model"]
+    if "retrieval_cache" in result:
+        headers["X-Retrieval-Cache"] = result["retrieval_cache"]
+    if "tokens_saved" in result:
+        headers["X-Tokens-Saved"] = str(result["tokens_saved"])
+    if "knowledge_bases" in result:
+        headers["X-Knowledge-Bases"] = ",".join(f"{kb}={status}" for kb, status in result["knowledge_bases"].items())
+    if result["timings"]:
+        headers["Server-Timing"] = ", ".join(f"{stage};dur={duration:.1f}" for stage, duration in result["timings"].items())
+    return headers
+
+def answer_from_cache(question):
+    if answer_cache is None:
+        return None, CACHE_MISS
+    return answer_cache.lookup(question)
+
+def generation_configuration(model_arn, options=None):
+    """
+    Return (keyword arguments of retrieve_and_generate_configuration, estimated tokens saved) for the
+    options of a request, or ({}, None) when token budgeting is disabled. RetrieveAndGenerate builds the
+    prompt itself, so the context is kept within budget by the number of chunks it retrieves.
+    """
+    if token_budget is None:
+        return {}, None
+    options = options or token_budget.defaults()
+    number_of_results, tokens_saved = token_budget.retrieval_count(model_arn or os.environ["MODEL_ARN"], options.number_of_results)
+    return {"number_of_results": number_of_results,
+            "max_output_tokens": options.max_output_tokens,
+            "prompt_template": options.prompt_template}, tokens_saved
+
+def retrieve_and_generate_configuration(model_arn=None, search_type=None, filters=None, number_of_results=None,
+                                        max_output_tokens=None, prompt_template=None):
+    configuration = {
+        'type': 'KNOWLEDGE_BASE',
+        'knowledgeBaseConfiguration': {
+            'knowledgeBaseId': os.environ["KNOWLEDGE_BASE_ID"],
+            'modelArn': model_arn or os.environ["MODEL_ARN"]
+        }
+    }
+    vector_search = {}
+    if search_type:
+        # HYBRID runs the knowledge base's own combination of keyword and semantic search
+        vector_search['overrideSearchType'] = search_type
+    if filters:
+        vector_search['filter'] = searchfilter.to_bedrock(filters)
+    if number_of_results:
+        vector_search['numberOfResults'] = number_of_results
+    if vector_search:
+        configuration['knowledgeBaseConfiguration']['retrievalConfiguration'] = {'vectorSearchConfiguration': vector_search}
+    generation = {}
+    if max_output_tokens:
+        generation['inferenceConfig'] = {'textInferenceConfig': {'maxTokens': max_output_tokens}}
+    if prompt_template:
+        generation['promptTemplate'] = {'textPromptTemplate': prompt_template}
+    if generation:
+        configuration['knowledgeBaseConfiguration']['generationConfiguration'] = generation
+    return configuration
+
 #  { "body": "{\"question\":\"What are the best practices with building a RAG sulution using Amazon Bedrock?\"}" }
-def retrieve_and_generate(input):
+def retrieve_and_generate(input, model_arn=None, search_type=None, filters=None, **generation):
         return bedrock_agent_runtime_client.retrieve_and_generate(
             input={
                 'text': input
             },
-            retrieveAndGenerateConfiguration={
-                'type': 'KNOWLEDGE_BASE',
-                'knowledgeBaseConfiguration': {
-                    'knowledgeBaseId': os.environ["KNOWLEDGE_BASE_ID"],
-                    'modelArn': os.environ["MODEL_ARN"]
-                }
-            }
+            retrieveAndGenerateConfiguration=retrieve_and_generate_configuration(model_arn, search_type, filters, **generation)
+        )
+
+def retrieve_and_generate_stream(input, model_arn=None, search_type=None, filters=None):
+        return bedrock_agent_runtime_client.retrieve_and_generate_stream(
+            input={
+                'text': input
+            },
+            retrieveAndGenerateConfiguration=retrieve_and_generate_configuration(
+                model_arn, search_type, filters, **generation_configuration(model_arn)[0])
         )
 
-    
\ No newline at end of file
+# Request keys the stream endpoint answers; sessions, sources, federation and generation overrides are buffered only
+STREAM_REQUEST_KEYS = ("question", "searchType", "filters")
+
+def request_stream(body):
+    """
+    (search_type, filters) of a stream request. Raises ValueError for keys the stream endpoint
+    does not support and for invalid values, instead of answering without them.
+    """
+    unsupported = [key for key in body if key not in STREAM_REQUEST_KEYS]
+    if unsupported:
+        raise ValueError(f"{', '.join(unsupported)} not supported by the stream endpoint")
+    search_type = request_search_type(body)
+    if search_type == SEARCH_HYBRID_RRF:
+        raise ValueError(f"searchType {search_type} is not supported by the stream endpoint")
+    filters = request_filters(body)
+    return search_type, filters
+
+def stream_answer(question, search_type=None, filters=None):
+    """
+    Yield the answer text incrementally as the model generates it.
+    Cached answers are yielded in one piece; generated answers are cached once complete.
+    The stream is opened through the invoker, so it is rate limited and fails over like buffered answers.
+    """
+    cacheable = not filters and search_type in (None, SEARCH_TYPE)
+    answer, cache_status = answer_from_cache(question) if cacheable else (None, CACHE_MISS)
+    if answer is not None:
+        yield answer
+        return
+    open_stream = lambda model_arn: retrieve_and_generate_stream(question, model_arn, search_type or SEARCH_TYPE, filters)
+    # A hedge would leave a second stream open, so stream calls are not hedged
+    response = call_model(open_stream, [choose_model(question)], hedge=False)
+    parts = []
+    for event in response['stream']:
+        text = event.get('output', {}).get('text')
+        if text:
+            parts.append(text)
+            yield text
+    if answer_cache is not None and cacheable:
+        answer_cache.store(question, "".join(parts))
@@ -0,0 +1,104 @@
+import os
+import json
+import logging
+import itertools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import kbquery_handler
+import metrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# The managed Python runtime buffers the whole handler response, so streaming
+# runs behind the Lambda Web Adapter in response_stream mode. The adapter
+# forwards every chunk written here to the function URL client as it arrives.
+#
+# POST /question {"question": "<Question>"}
+# Response: newline delimited JSON, {"text": "..."} per chunk then {"done": true}
+
+class StreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_body(200, "Looks Good!")
+        else:
+            self.send_body(404, json.dumps({"error": "Not found"}))
+
+    def do_POST(self):
+        if self.path != "/question":
+            self.send_body(404, json.dumps({"error": "Not found"}))
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length))
+            question = body["question"]
+            search_type, filters = kbquery_handler.request_stream(body)
+        except Exception as e:
+            self.send_body(400, json.dumps({"error": str(e)}))
+            return
+
+        request_metrics = metrics.begin("/stream")
+        # Requests are served on their own threads, so each binds its metrics
+        metrics.bind(request_metrics)
+        chunks = kbquery_handler.stream_answer(question, search_type, filters)
+        try:
+            # The stream is opened before the status line, so rate limits are answered with 429
+            first = next(chunks, None)
+        except Exception as e:
+            request_metrics.error(e)
+            if kbquery_handler.throttled(e):
+                request_metrics.add("Throttled", 1 if e.status_code == 429 else 0)
+                self.send_body(e.status_code, json.dumps({"error": str(e)}), {"Retry-After": str(e.retry_after)})
+                self.end_request(request_metrics)
+                return
+            logger.error("Exception: %s" % e, exc_info=True)
+            self.send_body(500, json.dumps({"error": str(e)}))
+            self.end_request(request_metrics)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        size = 0
+        try:
+            for text in (chunks if first is None else itertools.chain([first], chunks)):
+                if not size:
+                    request_metrics.add("TimeToFirstChunk", (request_metrics.clock() - request_metrics.started) * 1000)
+                size += len(text.encode("utf8"))
+                self.write_chunk({"text": text})
+            self.write_chunk({"done": True})
+        except Exception as e:
+            logger.error("Exception: %s" % e, exc_info=True)
+            request_metrics.error(e)
+            self.write_chunk({"error": str(e)})
+        self.wfile.write(b"0\r\n\r\n")
+        request_metrics.add("AnswerSize", size)
+        self.end_request(request_metrics)
+
+    def end_request(self, request_metrics):
+        request_metrics.flush()
+        metrics.bind(None)
+
+    def write_chunk(self, message):
+        data = (json.dumps(message) + "\n").encode("utf8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def send_body(self, statuscode, message, headers=None):
+        data = message.encode("utf8")
+        self.send_response(statuscode)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.info(format, *args)
+
+
+if __name__ == "__main__":
+    port = int(os.environ.get("PORT", "8080"))
+    ThreadingHTTPServer(("127.0.0.1", port), StreamHandler).serve_forever()
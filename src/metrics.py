@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+
+# Per-request metrics written as CloudWatch Embedded Metric Format log lines.
+# CloudWatch extracts the metrics from the log line, so no PutMetricData calls
+# are made on the request path.
+
+NAMESPACE = os.environ.get("METRICS_NAMESPACE", "ServerlessRag")
+SERVICE = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "kbquery")
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+
+UNITS = {
+    "Latency": "Milliseconds",
+    "BedrockLatency": "Milliseconds",
+    "TimeToFirstChunk": "Milliseconds",
+    "InputTokens": "Count",
+    "OutputTokens": "Count",
+    "AnswerSize": "Bytes",
+    "CacheHit": "Count",
+    "Questions": "Count",
+    "Throttled": "Count",
+    "ModelFallback": "Count",
+    "RouteComplexity": "None",
+    "Hedged": "Count",
+    "HedgeWon": "Count",
+    "HedgeSkipped": "Count",
+    "RerankLatency": "Milliseconds",
+    "TokensSaved": "Count",
+}
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+_current = None
+# Metrics bound to a worker thread, which win over _current in that thread
+_local = threading.local()
+
+
+class RequestMetrics:
+    def __init__(self, route, clock=time.perf_counter):
+        self.route = route
+        self.clock = clock
+        self.started = clock()
+        self.values = {}
+        self.properties = {}
+        self.error_class = None
+        self.lock = threading.Lock()
+
+    def add(self, name, value):
+        """
+        Accumulate a metric value, so batch requests report totals
+        """
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + value
+
+    def set_property(self, name, value):
+        with self.lock:
+            self.properties[name] = value
+
+    def error(self, exception):
+        self.error_class = type(exception).__name__
+
+    def record_result(self, result):
+        """
+        Record the metrics of one answered question
+        """
+        self.add("Questions", 1)
+        self.add("CacheHit", 0 if result["cache"] == "MISS" else 1)
+        self.add("AnswerSize", len(result["answer"].encode("utf8")))
+        if "model" in result:
+            self.set_property("Model", result["model"].split("/")[-1])
+            self.add("ModelFallback", 1 if result.get("fallback") else 0)
+        if result["timings"]:
+            # Reranking runs locally, so it is reported on its own
+            self.add("BedrockLatency", sum(duration for stage, duration in result["timings"].items() if stage != "rerank"))
+            if "rerank" in result["timings"]:
+                self.add("RerankLatency", result["timings"]["rerank"])
+        if "tokens_saved" in result:
+            self.add("TokensSaved", result["tokens_saved"])
+        usage = result.get("usage") or {}
+        if "inputTokens" in usage:
+            self.add("InputTokens", usage["inputTokens"])
+        if "outputTokens" in usage:
+            self.add("OutputTokens", usage["outputTokens"])
+
+    def to_emf(self):
+        values = dict(self.values, Latency=(self.clock() - self.started) * 1000)
+        dimensions = [["Service", "Route"]]
+        if "Model" in self.properties:
+            # Per model latency and tokens, to weigh routing decisions against cost
+            dimensions.append(["Service", "Model"])
+        directives = [{
+            "Namespace": NAMESPACE,
+            "Dimensions": dimensions,
+            # Counters such as RoutedTier<n> are named at runtime
+            "Metrics": [{"Name": name, "Unit": UNITS.get(name, "Count")} for name in values],
+        }]
+        document = {"Service": SERVICE, "Route": self.route, **self.properties, **values}
+        if self.error_class:
+            # Errors get their own dimension set so error classes do not multiply the latency series
+            directives.append({
+                "Namespace": NAMESPACE,
+                "Dimensions": [["Service", "Route", "ErrorClass"]],
+                "Metrics": [{"Name": "Errors", "Unit": "Count"}],
+            })
+            document.update({"ErrorClass": self.error_class, "Errors": 1})
+        document["_aws"] = {"Timestamp": int(time.time() * 1000), "CloudWatchMetrics": directives}
+        return document
+
+    def flush(self):
+        print(json.dumps(self.to_emf()))
+
+
+def begin(route):
+    global _current
+    _current = RequestMetrics(route)
+    return _current
+
+
+def bind(request_metrics):
+    """
+    Make request_metrics the current metrics of this thread, or unbind them with None.
+    Worker threads bind the metrics of the request that started them, so work that
+    outlives the request does not write into the metrics of the next one.
+    """
+    _local.metrics = request_metrics
+
+
+def current():
+    """
+    Metrics of the request being handled, or a detached instance outside a request
+    """
+    bound = getattr(_local, "metrics", None)
+    if bound is not None:
+        return bound
+    return _current if _current is not None else RequestMetrics("none")
+
+
+def log_request(event, context, sample_rate=None):
+    """
+    Log a trimmed summary of a sampled fraction of requests instead of the whole event
+    """
+    sample_rate = LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+    if random.random() >= sample_rate:
+        return
+    request_context = event.get("requestContext", {})
+    logger.info(json.dumps({
+        "requestId": getattr(context, "aws_request_id", None),
+        "apiRequestId": request_context.get("requestId"),
+        "resourcePath": request_context.get("resourcePath"),
+        "httpMethod": event.get("httpMethod"),
+        "bodyBytes": len(event.get("body") or ""),
+    }))
@@ -0,0 +1,110 @@
+import os
+import re
+import logging
+
+logger = logging.getLogger()
+
+# Cues of questions that need reasoning over several facts rather than a lookup
+COMPLEX_CUES = re.compile(r"\b(why|how does|how do|explain|compare|comparison|difference|differences|versus|vs|"
+                          r"trade-?offs?|pros|cons|evaluate|analy[sz]e|recommend|design|impact|implications?|"
+                          r"step[- ]by[- ]step|walk me through|summari[sz]e)\b", re.IGNORECASE)
+LOOKUP_CUES = re.compile(r"^\s*(what is|what are|who|when|where|which|list|define|name)\b", re.IGNORECASE)
+
+
+def complexity(question):
+    """
+    Lightweight complexity score in [0, 1] from lexical cues of the question
+    """
+    score = 0.0
+    cues = len(COMPLEX_CUES.findall(question))
+    score += min(0.6, 0.3 * cues)
+    # Several sub-questions or clauses usually need a longer, structured answer
+    score += min(0.2, 0.1 * max(0, question.count("?") - 1) + 0.05 * question.count(","))
+    score += 0.1 if re.search(r"\b(and|or|but|while|whereas)\b", question, re.IGNORECASE) else 0.0
+    if LOOKUP_CUES.match(question) and not cues:
+        score -= 0.2
+    return max(0.0, min(1.0, score))
+
+
+def features(question, context_chars=0):
+    return {
+        "question_chars": len(question),
+        "question_words": len(question.split()),
+        "context_chars": context_chars,
+        "complexity": complexity(question),
+    }
+
+
+class FixedPolicy:
+    """
+    Always chooses the first model; routing is then only measured, not applied
+    """
+    def __init__(self, thresholds=None):
+        pass
+
+    def tier(self, features, tiers):
+        return 0
+
+
+class TieredPolicy:
+    """
+    Weighs complexity, question length and context size into a score and picks
+    the tier whose threshold the score reaches. Models are ordered cheapest first.
+    """
+    def __init__(self, thresholds=None, max_words=60, max_context_chars=12000):
+        self.thresholds = thresholds or [0.35, 0.7]
+        self.max_words = max_words
+        self.max_context_chars = max_context_chars
+
+    def score(self, features):
+        return (0.6 * features["complexity"]
+                + 0.2 * min(1.0, features["question_words"] / self.max_words)
+                + 0.2 * min(1.0, features["context_chars"] / self.max_context_chars))
+
+    def tier(self, features, tiers):
+        score = self.score(features)
+        return min(tiers - 1, sum(1 for threshold in self.thresholds if score >= threshold))
+
+
+# Policies selectable with ROUTER_POLICY. Others can be added with register_policy.
+POLICIES = {"fixed": FixedPolicy, "tiered": TieredPolicy}
+
+
+def register_policy(name, policy_class):
+    POLICIES[name] = policy_class
+
+
+class ModelRouter:
+    """
+    Chooses the model for each question among models ordered from cheapest to most capable
+    """
+    def __init__(self, models, policy):
+        self.models = models
+        self.policy = policy
+
+    def route(self, question, context_chars=0, request_metrics=None):
+        """
+        Return the chosen model ARN and record the decision in the request metrics
+        """
+        question_features = features(question, context_chars)
+        tier = self.policy.tier(question_features, len(self.models))
+        if request_metrics is not None:
+            request_metrics.set_property("RouteTier", tier)
+            request_metrics.add("RouteComplexity", question_features["complexity"])
+            request_metrics.add(f"RoutedTier{tier}", 1)
+        return self.models[tier]
+
+
+def from_environment():
+    """
+    Build the router from the Lambda environment, or None when routing is disabled
+    """
+    if os.environ.get("ROUTER_ENABLED", "false").lower() != "true":
+        return None
+    models = [arn for arn in os.environ.get("ROUTER_MODEL_ARNS", "").split(",") if arn]
+    if not models:
+        logger.warning("ROUTER_ENABLED is set without ROUTER_MODEL_ARNS, routing disabled")
+        return None
+    thresholds = [float(value) for value in os.environ.get("ROUTER_THRESHOLDS", "").split(",") if value]
+    policy = POLICIES[os.environ.get("ROUTER_POLICY", "tiered")](thresholds or None)
+    return ModelRouter(models, policy)
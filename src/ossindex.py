@@ -1,10 +1,9 @@
-from opensearchpy import OpenSearch, RequestsHttpConnection
 import os
-import boto3
 import json
+import re
+import hashlib
 import logging
 import time
-from requests_aws4auth import AWS4Auth
 LOG = logging.getLogger()
 LOG.setLevel(logging.INFO)
 
@@ -12,86 +11,135 @@ HOST = os.environ.get("COLLECTION_HOST")
 VECTOR_INDEX_NAME = os.environ.get("VECTOR_INDEX_NAME")
 VECTOR_FIELD_NAME = os.environ.get("VECTOR_FIELD_NAME")
 REGION_NAME = os.environ.get("REGION_NAME")
+# Field names of the Bedrock knowledge base field mapping in KnowledgeBaseStack
+TEXT_FIELD = "AOSS_KB_TEXT_CHUNK"
+METADATA_FIELD = "AOSS_KB_METADATA"
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 def log(message):
     logger.info(message)
 
-def handler(event, context):
+def index_body(vector_field_name, dimension=1024, m=16, ef_construction=512, ef_search=512, encoding="float32",
+               filterable_fields=None):
     """
-    Lambda handler to create OpenSearch Index
+    Settings and mappings of the vector index the knowledge base writes to.
+    filterable_fields maps metadata attributes to the field type they are indexed with for filtering.
     """
-    log(f"Event: {json.dumps(event)}")
+    parameters = {
+        "m": m,
+        "ef_construction": ef_construction,
+    }
+    if encoding == "fp16":
+        # Vectors are stored as 16-bit floats, halving their memory; Bedrock still writes float32 embeddings
+        parameters["encoder"] = {"name": "sq", "parameters": {"type": "fp16"}}
+    return {
+        "settings": {
+            "index.knn": True,
+            "index.knn.algo_param.ef_search": ef_search,
+        },
+        "mappings": {
+            "properties": {  
+                vector_field_name: {  
+                    "type": "knn_vector",
+                    "dimension": dimension,
+                    "method": {  
+                        "space_type": "innerproduct",
+                        "engine": "FAISS",
+                        "name": "hnsw",
+                        "parameters": parameters,
+                    },
+                },
+                METADATA_FIELD: {"type": "text", "index": False},
+                TEXT_FIELD: {"type": "text"},
+                "id": {"type": "text"},
+                # The knowledge base writes each metadata attribute of a document to a field of the same name
+                **{name: {"type": field_type} for name, field_type in (filterable_fields or {}).items()},
+            }
+        },
+    }
 
-    session = boto3.Session()
-    region = REGION_NAME
-    service = "aoss"
-    response = {}
-    credentials = session.get_credentials()
-    log(f"HOST: {HOST}")
-    host = HOST.split("//")[1]
-    try:
-        auth = AWS4Auth(credentials.access_key, credentials.secret_key,
-                   region, service, session_token=credentials.token)
+def aoss_client(host, region, session=None, pool_maxsize=20):
+    """
+    OpenSearch client for a collection endpoint, signed with the session credentials
+    """
+    # Imported here so tools that only need the index body, such as bulkload against a local OpenSearch, run without them
+    import boto3
+    from opensearchpy import OpenSearch, RequestsHttpConnection
+    from requests_aws4auth import AWS4Auth
+    credentials = (session or boto3.Session()).get_credentials()
+    auth = AWS4Auth(credentials.access_key, credentials.secret_key,
+               region, "aoss", session_token=credentials.token)
+    return OpenSearch(
+        hosts=[{"host": host, "port": 443}],
+        http_auth=auth,
+        use_ssl=True,
+        verify_certs=True,
+        connection_class=RequestsHttpConnection,
+        pool_maxsize=pool_maxsize,
+    )
 
-        client = OpenSearch(
-            hosts=[{"host": host, "port": 443}],
-            http_auth=auth,
-            use_ssl=True,
-            verify_certs=True,
-            connection_class=RequestsHttpConnection,
-            pool_maxsize=20,
-        )
-        index_name = VECTOR_INDEX_NAME
+def index_version(body):
+    """
+    Short hash of the index body, so a mapping or HNSW change gets a new index name
+    """
+    return hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf8")).hexdigest()[:8]
 
-        
-        if client.indices.exists(index=index_name):
-                log(f"Index {index_name} already exists.")
-                return {
-                    "statusCode": 200,
-                    "body": json.dumps("Index already exists."),
-                }
-        else:
-            log(f"Creating index: {index_name}")
+def wait_until_ready(client, index_name, vector_field_name, timeout=600, clock=time.monotonic, sleep=time.sleep):
+    """
+    Poll with exponential backoff until the index accepts searches with its vector mapping.
+    Raises TimeoutError when it is not ready in time.
+    """
+    deadline = clock() + timeout
+    delay = 1
+    while True:
+        try:
+            mapping = client.indices.get_mapping(index=index_name)
+            if vector_field_name in mapping[index_name]["mappings"]["properties"]:
+                client.count(index=index_name)
+                return
+        except Exception as e:
+            log(f"Index {index_name} not ready yet: {e}")
+        if clock() + delay > deadline:
+            raise TimeoutError(f"Index {index_name} was not ready after {timeout} seconds")
+        sleep(delay)
+        delay = min(delay * 2, 30)
 
-            index_body = {
-                "settings": {
-                    "index.knn": True,
-                    "index.knn.algo_param.ef_search": 512,
-                },
-                "mappings": {
-                    "properties": {  
-                        VECTOR_FIELD_NAME: {  
-                            "type": "knn_vector",
-                            "dimension": 1024,
-                            "method": {  
-                                "space_type": "innerproduct",
-                                "engine": "FAISS",
-                                "name": "hnsw",
-                                "parameters": {
-                                    "m": 16,
-                                    "ef_construction": 512,
-                                },
-                            },
-                        },
-                        "AOSS_KB_METADATA": {"type": "text", "index": False},
-                        "AOSS_KB_TEXT_CHUNK": {"type": "text"},
-                        "id": {"type": "text"},
-                    }
-                },
-            }
+def prune_versions(client, base_name, keep):
+    """
+    Delete versions of the index other than the ones in keep
+    """
+    for name in client.indices.get(index=f"{base_name}-*"):
+        if re.fullmatch(rf"{re.escape(base_name)}-[0-9a-f]{{8}}", name) and name not in keep:
+            log(f"Deleting old index version {name}")
+            client.indices.delete(index=name)
 
-            response = client.indices.create(index=index_name, body=index_body)
+def handler(event, context):
+    """
+    Custom resource handler managing the versioned vector index.
+    Create and Update make sure the index of the current schema exists and is ready,
+    and keep the previous version so the knowledge base reading it keeps working until it is replaced.
+    """
+    log(f"Event: {json.dumps(event)}")
+    properties = event.get("ResourceProperties", {})
+    base_name = properties.get("IndexName", VECTOR_INDEX_NAME)
+    vector_field_name = properties.get("VectorFieldName", VECTOR_FIELD_NAME)
+    if event["RequestType"] == "Delete":
+        # Indexes are removed with the collection; a replaced version stays until pruned by a later update
+        return {"PhysicalResourceId": event["PhysicalResourceId"]}
 
-            log(f"Response: {response}")
-            log("Sleeping for 1 minutes to let index create.")
-            time.sleep(60) 
-    except Exception as e:
-        logging.error("Exception: %s" % e, exc_info=True)
-    finally:
-        LOG.debug(f'method=create_index, index_creation_response={response}')
-    return {
-        "statusCode": 200,
-        "body": json.dumps("Create index lambda ran successfully."),
-    }
+    body = index_body(vector_field_name, int(properties.get("Dimension", 1024)), int(properties.get("HnswM", 16)),
+                      int(properties.get("HnswEfConstruction", 512)), int(properties.get("HnswEfSearch", 512)),
+                      properties.get("Encoding", "float32"), properties.get("FilterableFields"))
+    version = index_version(body)
+    index_name = f"{base_name}-{version}"
+    client = aoss_client(HOST.split("//")[1], REGION_NAME)
+    if client.indices.exists(index=index_name):
+        log(f"Index {index_name} already exists.")
+    else:
+        log(f"Creating index: {index_name}")
+        log(f"Response: {client.indices.create(index=index_name, body=body)}")
+    wait_until_ready(client, index_name, vector_field_name)
+    previous = event.get("PhysicalResourceId") if event["RequestType"] == "Update" else None
+    prune_versions(client, base_name, {index_name, previous})
+    return {"PhysicalResourceId": index_name, "Data": {"IndexName": index_name, "Version": version}}
@@ -0,0 +1,123 @@
+import os
+import re
+import math
+
+SCORER_BM25 = "bm25"
+SCORER_CROSS_ENCODER = "cross_encoder"
+
+TOKEN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+
+
+def tokens(text):
+    return TOKEN.findall(text.lower())
+
+
+class BM25Scorer:
+    """
+    BM25 of the question terms in each candidate, with document frequencies taken
+    from the candidate set. Needs no dependencies and takes well under a millisecond
+    per chunk, but only reorders by term overlap.
+    """
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+
+    def score(self, question, texts, batch_size=None):
+        terms = set(tokens(question))
+        documents = [tokens(text) for text in texts]
+        if not terms or not documents:
+            return [0.0] * len(texts)
+        average_length = sum(len(document) for document in documents) / len(documents) or 1
+        frequencies = []
+        document_frequency = dict.fromkeys(terms, 0)
+        for document in documents:
+            counts = {}
+            for token in document:
+                if token in terms:
+                    counts[token] = counts.get(token, 0) + 1
+            for token in counts:
+                document_frequency[token] += 1
+            frequencies.append(counts)
+        idf = {term: math.log(1 + (len(documents) - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+        scores = []
+        for document, counts in zip(documents, frequencies):
+            norm = self.k1 * (1 - self.b + self.b * len(document) / average_length)
+            scores.append(sum(idf[term] * count * (self.k1 + 1) / (count + norm) for term, count in counts.items()))
+        return scores
+
+
+class CrossEncoderScorer:
+    """
+    Scores (question, chunk) pairs with a small ONNX cross encoder on the CPU.
+    The model directory holds model.onnx and tokenizer.json, as built into the rerank layer.
+    """
+    def __init__(self, model_dir, max_length=256, threads=0):
+        # Imported here so the query function only loads them when the cross encoder is configured
+        import numpy
+        import onnxruntime
+        from tokenizers import Tokenizer
+        self.numpy = numpy
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+        options = onnxruntime.SessionOptions()
+        # 0 lets ONNX Runtime use every vCPU of the function, which grows with its memory size
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, "model.onnx"), options,
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def score(self, question, texts, batch_size=16):
+        np = self.numpy
+        scores = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch([(question, text) for text in texts[start:start + batch_size]])
+            feeds = {"input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                     "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+                     "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)}
+            logits = self.session.run(None, {name: value for name, value in feeds.items() if name in self.input_names})[0]
+            scores.extend(float(row[0]) for row in logits.reshape(len(encodings), -1))
+        return scores
+
+
+class Reranker:
+    """
+    Rescores over-fetched chunks and keeps the best ones, so fewer chunks reach the prompt
+    """
+    def __init__(self, scorer, candidates=20, batch_size=16):
+        self.scorer = scorer
+        self.candidates = candidates
+        self.batch_size = batch_size
+
+    def rerank(self, question, chunks, top_k):
+        """
+        Return the top_k chunks by rerank score, each with its "rerank_score"
+        """
+        if not chunks:
+            return chunks
+        scores = self.scorer.score(question, [chunk["text"] for chunk in chunks], self.batch_size)
+        ranked = sorted(zip(scores, range(len(chunks))), key=lambda item: item[0], reverse=True)[:top_k]
+        return [dict(chunks[index], rerank_score=score) for score, index in ranked]
+
+
+def scorer_for(name, model_dir=None, max_length=256, threads=0):
+    if name == SCORER_BM25:
+        return BM25Scorer()
+    if name == SCORER_CROSS_ENCODER:
+        return CrossEncoderScorer(model_dir, max_length, threads)
+    raise ValueError(f"Unknown rerank scorer {name}")
+
+
+def from_environment():
+    """
+    Build the reranker from the Lambda environment, or None when reranking is disabled
+    """
+    if os.environ.get("RERANK_ENABLED", "false").lower() != "true":
+        return None
+    scorer = scorer_for(os.environ.get("RERANK_SCORER", SCORER_BM25),
+                        os.environ.get("RERANK_MODEL_DIR", "/opt/model"),
+                        int(os.environ.get("RERANK_MAX_LENGTH", "256")),
+                        int(os.environ.get("RERANK_THREADS", "0")))
+    return Reranker(scorer,
+                    int(os.environ.get("RERANK_CANDIDATES", "20")),
+                    int(os.environ.get("RERANK_BATCH_SIZE", "16")))
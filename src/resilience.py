@@ -0,0 +1,256 @@
+import os
+import math
+import time
+import random
+import logging
+import threading
+
+logger = logging.getLogger()
+
+THROTTLING_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException"}
+RETRYABLE_CODES = {"InternalServerException", "ServiceUnavailableException", "ModelTimeoutException",
+                   "ModelNotReadyException", "DependencyFailedException", "BadGatewayException"}
+# botocore connection errors, matched by name so botocore is not imported here
+RETRYABLE_EXCEPTIONS = {"EndpointConnectionError", "ConnectionClosedError", "ReadTimeoutError", "ConnectTimeoutError"}
+
+
+class ThrottledError(Exception):
+    """
+    Raised when a request cannot be served within our Bedrock quota. Maps to HTTP 429.
+    """
+    status_code = 429
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(ThrottledError):
+    """
+    Raised when every configured model has an open circuit. Maps to HTTP 503.
+    """
+    status_code = 503
+
+
+def error_code(exception):
+    return getattr(exception, "response", {}).get("Error", {}).get("Code")
+
+
+def is_throttle(exception):
+    return error_code(exception) in THROTTLING_CODES
+
+
+def is_retryable(exception):
+    return (is_throttle(exception) or error_code(exception) in RETRYABLE_CODES
+            or type(exception).__name__ in RETRYABLE_EXCEPTIONS)
+
+
+class TokenBucket:
+    """
+    Client-side rate limiter sized to our share of the Bedrock quota.
+    The fill rate backs off multiplicatively on throttles and recovers additively
+    on successes, up to the configured rate.
+    """
+    def __init__(self, rate, burst, min_rate=0.1, clock=time.monotonic):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """
+        Take a token, or return the seconds until one is available
+        """
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, max_wait, sleep=time.sleep):
+        deadline = self.clock() + max_wait
+        while True:
+            wait = self.try_acquire()
+            if wait == 0.0:
+                return True
+            if self.clock() + wait > deadline:
+                return False
+            sleep(wait)
+
+    def on_throttle(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * 0.7)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def retry_after(self):
+        with self.lock:
+            self._refill()
+            return max(1, math.ceil(max(0, 1 - self.tokens) / self.rate))
+
+
+class CircuitBreaker:
+    """
+    Opens after consecutive failures and lets a single trial call through once
+    the recovery time has passed
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold, recovery_seconds, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self.opened_at >= self.recovery_seconds:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def release(self):
+        """
+        Give back the trial call of a half open circuit whose outcome says nothing about the model,
+        such as a request error or a client-side throttle, so the next call is let through as the trial
+        """
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+    def retry_after(self):
+        with self.lock:
+            if self.state != self.OPEN:
+                return 1
+            return max(1, int(self.recovery_seconds - (self.clock() - self.opened_at) + 0.999))
+
+
+class ResilientInvoker:
+    """
+    Calls an operation with a model ARN, retrying retryable errors with full
+    jitter backoff, rate limited by a token bucket, and failing over to the next
+    model when the circuit of the current one is open or its retries run out
+    """
+    def __init__(self, models, bucket, breaker_factory, max_attempts, base_delay, max_delay, token_wait,
+                 sleep=time.sleep, rng=None):
+        self.models = models
+        self.bucket = bucket
+        self.breaker_factory = breaker_factory
+        self.breakers = {}
+        self.lock = threading.Lock()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.token_wait = token_wait
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+
+    def breaker(self, model):
+        with self.lock:
+            if model not in self.breakers:
+                self.breakers[model] = self.breaker_factory()
+            return self.breakers[model]
+
+    def call(self, operation, models=None, token_wait=None):
+        """
+        Return the result of operation(model_arn) with "model" set to the model that answered
+        and "fallback" telling whether it was not the first choice.
+        models overrides the configured models, e.g. with the choice of a router.
+        token_wait overrides the longest wait for a rate limit token.
+        """
+        models = list(models or self.models)
+        token_wait = self.token_wait if token_wait is None else token_wait
+        last_error = None
+        for model in models:
+            breaker = self.breaker(model)
+            if not breaker.allow():
+                continue
+            try:
+                result = self._with_retries(operation, model, token_wait)
+            except ThrottledError:
+                # No answer from the model, so a half open circuit must not keep waiting for this trial
+                breaker.release()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    breaker.release()
+                    raise
+                breaker.record_failure()
+                logger.warning("Model %s failed after retries: %s", model, e)
+                last_error = e
+                continue
+            breaker.record_success()
+            result["model"] = model
+            result["fallback"] = model != models[0]
+            return result
+        if last_error is not None and is_throttle(last_error):
+            raise ThrottledError("Bedrock is throttling requests", self.bucket.retry_after())
+        raise CircuitOpenError("No model is currently available",
+                               min(self.breaker(model).retry_after() for model in models))
+
+    def _with_retries(self, operation, model, token_wait):
+        for attempt in range(self.max_attempts):
+            if not self.bucket.acquire(token_wait, self.sleep):
+                raise ThrottledError("Client-side rate limit reached", self.bucket.retry_after())
+            try:
+                result = operation(model)
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.max_attempts - 1:
+                    if is_throttle(e):
+                        self.bucket.on_throttle()
+                    raise
+                if is_throttle(e):
+                    self.bucket.on_throttle()
+                # Full jitter keeps retries from concurrent containers from synchronizing
+                self.sleep(self.rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+                continue
+            self.bucket.on_success()
+            return result
+
+
+def from_environment():
+    """
+    Build the invoker from the Lambda environment, or None when resilience is disabled
+    """
+    if os.environ.get("RESILIENCE_ENABLED", "false").lower() != "true":
+        return None
+    models = [os.environ["MODEL_ARN"]] + [arn for arn in [os.environ.get("FALLBACK_MODEL_ARN")] if arn]
+    failure_threshold = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+    recovery_seconds = float(os.environ.get("BREAKER_RECOVERY_SECONDS", "30"))
+    return ResilientInvoker(models,
+                            TokenBucket(float(os.environ.get("TOKEN_BUCKET_RATE", "2")),
+                                        float(os.environ.get("TOKEN_BUCKET_BURST", "8"))),
+                            lambda: CircuitBreaker(failure_threshold, recovery_seconds),
+                            int(os.environ.get("RETRY_MAX_ATTEMPTS", "3")),
+                            float(os.environ.get("RETRY_BASE_DELAY_SECONDS", "0.25")),
+                            float(os.environ.get("RETRY_MAX_DELAY_SECONDS", "4")),
+                            float(os.environ.get("TOKEN_WAIT_SECONDS", "2")))
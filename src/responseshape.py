@@ -0,0 +1,106 @@
+import os
+import federation
+
+# Sources returned next to the answer when a request asks for them with "include", e.g.
+#   {"question": "...", "include": ["citations"], "snippetLength": 120}
+# returns
+#   {"answer": "...", "citations": [{"start": 0, "end": 85, "references": [1, 2]}],
+#    "references": [{"id": 1, "uri": "s3://bucket/policy.pdf", "page": 3, "snippet": "..."}, ...]}
+# Each retrieved chunk is listed once in "references", and citations point to it by id.
+
+INCLUDE_CITATIONS = "citations"
+INCLUDE_REFERENCES = "references"
+INCLUDES = (INCLUDE_CITATIONS, INCLUDE_REFERENCES)
+PAGE_NUMBER_KEY = "x-amz-bedrock-kb-document-page-number"
+
+
+def options(body, default_include, default_snippet_length, max_snippet_length):
+    """
+    The ("include", "snippetLength") of the request body, or the configured defaults.
+    Raises ValueError for invalid values.
+    """
+    include = body.get("include", default_include)
+    if not isinstance(include, list) or set(include) - set(INCLUDES):
+        raise ValueError(f"include must be a list of {', '.join(INCLUDES)}")
+    snippet_length = body.get("snippetLength", default_snippet_length)
+    if not isinstance(snippet_length, int) or isinstance(snippet_length, bool) or not 0 <= snippet_length <= max_snippet_length:
+        raise ValueError(f"snippetLength must be an integer from 0 to {max_snippet_length}")
+    return set(include), snippet_length
+
+
+def snippet(text, length):
+    """
+    The first length characters of the text with whitespace collapsed, cut at a word boundary
+    """
+    text = " ".join(text.split())
+    if len(text) <= length:
+        return text
+    cut = text[:length]
+    if " " in cut and not text[length].isspace():
+        cut = cut.rsplit(" ", 1)[0]
+    return cut.rstrip() + "…"
+
+
+def source_uri(location):
+    # The location type varies by data source, e.g. s3Location.uri or webLocation.url
+    for value in (location or {}).values():
+        if isinstance(value, dict) and (value.get("uri") or value.get("url")):
+            return value.get("uri") or value.get("url")
+    return None
+
+
+def compact(reference_id, text, reference, snippet_length):
+    compacted = {"id": reference_id, "uri": source_uri(reference.get("location"))}
+    page = (reference.get("metadata") or {}).get(PAGE_NUMBER_KEY)
+    if page is not None:
+        compacted["page"] = int(page)
+    if snippet_length:
+        compacted["snippet"] = snippet(text, snippet_length)
+    if reference.get("score") is not None:
+        compacted["score"] = round(reference["score"], 4)
+    if reference.get("knowledge_base_id"):
+        compacted["knowledgeBaseId"] = reference["knowledge_base_id"]
+    return compacted
+
+
+def shape(result, include, snippet_length):
+    """
+    Citations and references of an answer result in the compact response format.
+    RetrieveAndGenerate results carry "citations" with the spans of the answer they support.
+    The two-stage pipeline has no spans and returns the chunks of its prompt as "references".
+    """
+    references, ids = [], {}
+
+    def reference_id(reference):
+        text = reference.get("text") or (reference.get("content") or {}).get("text", "")
+        key = federation.chunk_key({"text": text, "location": reference.get("location")})
+        if key not in ids:
+            ids[key] = len(references) + 1
+            references.append(compact(ids[key], text, reference, snippet_length))
+        return ids[key]
+
+    citations = []
+    for citation in result.get("citations") or []:
+        span = ((citation.get("generatedResponsePart") or {}).get("textResponsePart") or {}).get("span") or {}
+        cited = list(dict.fromkeys(reference_id(reference) for reference in citation.get("retrievedReferences") or []))
+        if cited:
+            citations.append({"start": span.get("start"), "end": span.get("end"), "references": cited})
+    for reference in result.get("references") or []:
+        reference_id(reference)
+
+    shaped = {}
+    if INCLUDE_CITATIONS in include:
+        shaped["citations"] = citations
+    # Citations point into the references, so they always come together
+    if include:
+        shaped["references"] = references
+    return shaped
+
+
+def defaults_from_environment():
+    """
+    Default include list, snippet length and largest snippet length a request can ask for
+    """
+    return (list(filter(None, os.environ.get("RESPONSE_INCLUDE", "").split(","))),
+            int(os.environ.get("RESPONSE_SNIPPET_LENGTH", "200")),
+            int(os.environ.get("RESPONSE_MAX_SNIPPET_LENGTH", "1000")))
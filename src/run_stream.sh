@@ -0,0 +1,2 @@
+#!/bin/bash
+exec python3 kbstream_server.py
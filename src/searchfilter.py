@@ -0,0 +1,96 @@
+import os
+import json
+
+# Request filters on the indexed metadata fields, e.g.
+#   {"doc_type": "policy", "owner": ["alice", "bob"], "published": {"gte": 20240101}}
+# are validated against the filterable fields of the index mapping and
+# translated to a Bedrock retrieval filter or an OpenSearch filter clause.
+
+FIELD_TYPES = ("keyword", "long", "double", "boolean")
+RANGE_OPERATORS = {"gt": "greaterThan", "gte": "greaterThanOrEquals", "lt": "lessThan", "lte": "lessThanOrEquals"}
+MAX_VALUES = 100
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def check_value(name, field_type, value):
+    valid = {"keyword": lambda v: isinstance(v, str),
+             "long": lambda v: isinstance(v, int) and not isinstance(v, bool),
+             "double": is_number,
+             "boolean": lambda v: isinstance(v, bool)}[field_type]
+    if not valid(value):
+        raise ValueError(f"filter {name} expects {field_type} values")
+
+
+def parse(filters, fields):
+    """
+    Validate the request filters and return them as [(field, operator, value)].
+    fields maps each filterable field to its type. Raises ValueError for invalid filters.
+    """
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object of field names to values")
+    conditions = []
+    for name, value in sorted(filters.items()):
+        if name not in fields:
+            raise ValueError(f"filter field {name} is not filterable. Use one of {', '.join(sorted(fields)) or 'none'}")
+        field_type = fields[name]
+        if isinstance(value, list):
+            if not value or len(value) > MAX_VALUES:
+                raise ValueError(f"filter {name} takes 1 to {MAX_VALUES} values")
+            for item in value:
+                check_value(name, field_type, item)
+            conditions.append((name, "in", value))
+        elif isinstance(value, dict):
+            if field_type not in ("long", "double") or not value or set(value) - set(RANGE_OPERATORS):
+                raise ValueError(f"filter {name} ranges take {', '.join(RANGE_OPERATORS)} on numeric fields")
+            for operator, bound in sorted(value.items()):
+                check_value(name, field_type, bound)
+                conditions.append((name, operator, bound))
+        else:
+            check_value(name, field_type, value)
+            conditions.append((name, "equals", value))
+    return conditions
+
+
+def to_bedrock(conditions):
+    """
+    Bedrock RetrievalFilter of the conditions, or None without conditions
+    """
+    clauses = [{RANGE_OPERATORS.get(operator, operator): {"key": name, "value": value}}
+               for name, operator, value in conditions]
+    if not clauses:
+        return None
+    # andAll takes at least two filters
+    return clauses[0] if len(clauses) == 1 else {"andAll": clauses}
+
+
+def to_opensearch(conditions):
+    """
+    OpenSearch bool filter of the conditions, or None without conditions
+    """
+    clauses = []
+    for name, operator, value in conditions:
+        if operator == "equals":
+            clauses.append({"term": {name: value}})
+        elif operator == "in":
+            clauses.append({"terms": {name: value}})
+        else:
+            clauses.append({"range": {name: {operator: value}}})
+    return {"bool": {"filter": clauses}} if clauses else None
+
+
+def cache_key(conditions):
+    return json.dumps(conditions) if conditions else ""
+
+
+def fields_from_environment():
+    """
+    Filterable fields from FILTER_FIELDS, "name:type,name:type"
+    """
+    fields = {}
+    for item in filter(None, os.environ.get("FILTER_FIELDS", "").split(",")):
+        name, _, field_type = item.partition(":")
+        fields[name] = field_type or "keyword"
+    return fields
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import uuid
+import threading
+
+
+def new_session_id():
+    return str(uuid.uuid4())
+
+
+def is_session_id(session_id):
+    try:
+        return isinstance(session_id, str) and str(uuid.UUID(session_id)) == session_id
+    except ValueError:
+        return False
+
+
+def empty_state():
+    return {"summary": "", "turns": []}
+
+
+class InMemorySessionStore:
+    """
+    Session store held in the Lambda container. Also serves as the local fake
+    of the DynamoDB store, since both expose the same get/put interface.
+    """
+    def __init__(self, ttl_seconds, clock=time.time):
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, session_id):
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None or entry[0] <= self.clock():
+                self.sessions.pop(session_id, None)
+                return None
+            return json.loads(entry[1])
+
+    def put(self, session_id, state):
+        with self.lock:
+            self.sessions[session_id] = (self.clock() + self.ttl_seconds, json.dumps(state))
+
+
+class DynamoDBSessionStore:
+    """
+    Session store shared by every Lambda container. Expired sessions are removed by DynamoDB TTL.
+    """
+    def __init__(self, dynamodb_client, table_name, ttl_seconds):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, session_id):
+        item = self.dynamodb_client.get_item(
+            TableName=self.table_name,
+            Key={"session_id": {"S": session_id}},
+            ConsistentRead=True,
+        ).get("Item")
+        # TTL deletion is lazy, so expired items can still be returned for a while
+        if item is None or int(item["expires_at"]["N"]) <= int(time.time()):
+            return None
+        return json.loads(item["state"]["S"])
+
+    def put(self, session_id, state):
+        self.dynamodb_client.put_item(
+            TableName=self.table_name,
+            Item={
+                "session_id": {"S": session_id},
+                "state": {"S": json.dumps(state)},
+                "expires_at": {"N": str(int(time.time()) + self.ttl_seconds)},
+            },
+        )
+
+
+def truncate(text, max_chars):
+    return text if len(text) <= max_chars else text[:max_chars].rsplit(" ", 1)[0] + "..."
+
+
+def compact(state, max_turns, summary_max_chars, answer_max_chars):
+    """
+    Keep the most recent max_turns turns verbatim and fold older turns into a
+    bounded running summary, so prompts stay small as the conversation grows
+    """
+    turns = state["turns"]
+    if len(turns) <= max_turns:
+        return state
+    folded = turns[:len(turns) - max_turns]
+    lines = [f"Q: {turn['question']} A: {truncate(turn['answer'], answer_max_chars)}" for turn in folded]
+    summary = "\n".join(filter(None, [state["summary"]] + lines))
+    if len(summary) > summary_max_chars:
+        # Drop the oldest part of the summary first
+        summary = summary[-summary_max_chars:].split("\n", 1)[-1]
+    return {"summary": summary, "turns": turns[len(folded):]}
+
+
+def contextual_question(state, question, answer_max_chars=300):
+    """
+    Render the compacted conversation and the follow-up question as one input text
+    """
+    if not state["summary"] and not state["turns"]:
+        return question
+    history = [state["summary"]] if state["summary"] else []
+    history += [f"Q: {turn['question']} A: {truncate(turn['answer'], answer_max_chars)}" for turn in state["turns"]]
+    return "Previous conversation:\n" + "\n".join(history) + f"\n\nFollow-up question: {question}"
+
+
+class Sessions:
+    def __init__(self, store, max_turns, summary_max_chars, answer_max_chars):
+        self.store = store
+        self.max_turns = max_turns
+        self.summary_max_chars = summary_max_chars
+        self.answer_max_chars = answer_max_chars
+
+    def start(self):
+        """
+        Return (session_id, state) of a new session. Ids are only minted here, so clients cannot pick their own
+        """
+        return new_session_id(), empty_state()
+
+    def load(self, session_id):
+        """
+        Return (session_id, state) of an existing session. Raises ValueError for unknown or expired ids.
+        """
+        state = self.store.get(session_id) if is_session_id(session_id) else None
+        if state is None:
+            raise ValueError('Unknown or expired sessionId, start a new session with "session": true')
+        return session_id, state
+
+    def contextual_question(self, state, question):
+        return contextual_question(state, question, self.answer_max_chars)
+
+    def record(self, session_id, state, question, answer):
+        state = {"summary": state["summary"], "turns": state["turns"] + [{"question": question, "answer": answer}]}
+        self.store.put(session_id, compact(state, self.max_turns, self.summary_max_chars, self.answer_max_chars))
+
+
+def from_environment(client_factory):
+    """
+    Build the session manager from the Lambda environment, or None when sessions are disabled
+    """
+    if os.environ.get("SESSIONS_ENABLED", "false").lower() != "true":
+        return None
+    ttl_seconds = int(os.environ.get("SESSION_TTL_SECONDS", "3600"))
+    table_name = os.environ.get("SESSION_TABLE_NAME")
+    if table_name:
+        store = DynamoDBSessionStore(client_factory("dynamodb"), table_name, ttl_seconds)
+    else:
+        store = InMemorySessionStore(ttl_seconds)
+    return Sessions(store,
+                    int(os.environ.get("SESSION_MAX_TURNS", "4")),
+                    int(os.environ.get("SESSION_SUMMARY_MAX_CHARS", "1500")),
+                    int(os.environ.get("SESSION_ANSWER_MAX_CHARS", "300")))
@@ -0,0 +1,141 @@
+import os
+import json
+
+# Placeholders of prompt templates, as in knowledge base prompt templates
+SEARCH_RESULTS = "$search_results$"
+QUERY = "$query$"
+OUTPUT_FORMAT_INSTRUCTIONS = "$output_format_instructions$"
+
+MAX_NUMBER_OF_RESULTS = 100 # Largest numberOfResults of Retrieve and RetrieveAndGenerate
+MAX_TEMPLATE_CHARS = 10000
+# Request body keys that override the generation options
+REQUEST_KEYS = ("numberOfResults", "maxOutputTokens", "promptTemplate")
+
+
+def estimate_tokens(text, chars_per_token=4):
+    """
+    Token count estimate without a tokenizer, about four characters per token of English text
+    """
+    return (len(text) + chars_per_token - 1) // chars_per_token
+
+
+def trim(text, tokens, chars_per_token=4):
+    """
+    The start of the text that fits in tokens, cut at a word boundary
+    """
+    length = tokens * chars_per_token
+    if len(text) <= length:
+        return text
+    cut = text[:length]
+    return cut.rsplit(" ", 1)[0] if " " in cut else cut
+
+
+class GenerationOptions:
+    """
+    Retrieval count, output limit and prompt template of one request
+    """
+    def __init__(self, number_of_results, max_output_tokens, prompt_template, overridden=False):
+        self.number_of_results = number_of_results
+        self.max_output_tokens = max_output_tokens
+        self.prompt_template = prompt_template
+        # Overridden options change the answer, so it is not shared through the answer cache
+        self.overridden = overridden
+
+
+class TokenBudget:
+    """
+    Keeps the retrieved context of each model call within the context budget of the model.
+    The number of results is capped by how many chunks of the configured chunk size fit, and
+    chunks retrieved beyond the budget are trimmed or dropped before they reach the prompt.
+    """
+    def __init__(self, context_budgets, default_context_budget, chunk_tokens, number_of_results, max_output_tokens,
+                 max_output_tokens_limit, prompt_template="", min_chunk_tokens=100, allow_override=True, chars_per_token=4):
+        self.context_budgets = context_budgets
+        self.default_context_budget = default_context_budget
+        # Tokens per chunk of the data source chunking configuration, 0 when documents are not chunked
+        self.chunk_tokens = chunk_tokens
+        self.number_of_results = number_of_results
+        self.max_output_tokens = max_output_tokens
+        self.max_output_tokens_limit = max_output_tokens_limit
+        self.prompt_template = prompt_template
+        self.min_chunk_tokens = min_chunk_tokens
+        self.allow_override = allow_override
+        self.chars_per_token = chars_per_token
+
+    def options(self, body):
+        """
+        Generation options of a request, from "numberOfResults", "maxOutputTokens" and "promptTemplate"
+        in the request body or the configuration. Raises ValueError for invalid overrides.
+        """
+        overrides = [key for key in REQUEST_KEYS if key in body]
+        if overrides and not self.allow_override:
+            raise ValueError(f"{', '.join(overrides)} cannot be set per request")
+        number_of_results = body.get("numberOfResults", self.number_of_results)
+        if not isinstance(number_of_results, int) or isinstance(number_of_results, bool) or not 1 <= number_of_results <= MAX_NUMBER_OF_RESULTS:
+            raise ValueError(f"numberOfResults must be an integer from 1 to {MAX_NUMBER_OF_RESULTS}")
+        max_output_tokens = body.get("maxOutputTokens", self.max_output_tokens)
+        if not isinstance(max_output_tokens, int) or isinstance(max_output_tokens, bool) or not 1 <= max_output_tokens <= self.max_output_tokens_limit:
+            raise ValueError(f"maxOutputTokens must be an integer from 1 to {self.max_output_tokens_limit}")
+        prompt_template = body.get("promptTemplate", self.prompt_template)
+        if prompt_template and (not isinstance(prompt_template, str) or SEARCH_RESULTS not in prompt_template
+                                or len(prompt_template) > MAX_TEMPLATE_CHARS):
+            raise ValueError(f"promptTemplate must contain {SEARCH_RESULTS} and be at most {MAX_TEMPLATE_CHARS} characters")
+        return GenerationOptions(number_of_results, max_output_tokens, prompt_template, bool(overrides))
+
+    def defaults(self):
+        return self.options({})
+
+    def context_budget(self, model_id):
+        # Model ids are matched by prefix, e.g. "amazon.nova-micro", also within model ARNs
+        matches = [prefix for prefix in self.context_budgets if prefix in (model_id or "")]
+        return self.context_budgets[max(matches, key=len)] if matches else self.default_context_budget
+
+    def retrieval_count(self, model_id, number_of_results):
+        """
+        Return (number of results, estimated tokens saved) for the requested number of
+        results, capped to the chunks of the configured size that fit the context budget
+        """
+        if not self.chunk_tokens:
+            return number_of_results, 0
+        capped = min(number_of_results, max(1, self.context_budget(model_id) // self.chunk_tokens))
+        return capped, (number_of_results - capped) * self.chunk_tokens
+
+    def fit(self, chunks, model_id):
+        """
+        Return (chunks, tokens saved) with the chunks, best first, that fit the context budget.
+        The first chunk that does not fit is trimmed to the remaining budget when at least
+        min_chunk_tokens of it fit, and the rest are dropped.
+        """
+        remaining = self.context_budget(model_id)
+        kept, saved = [], 0
+        for chunk in chunks:
+            tokens = estimate_tokens(chunk["text"], self.chars_per_token)
+            if tokens <= remaining:
+                kept.append(chunk)
+                remaining -= tokens
+            elif remaining >= self.min_chunk_tokens:
+                text = trim(chunk["text"], remaining, self.chars_per_token)
+                kept.append(dict(chunk, text=text))
+                saved += tokens - estimate_tokens(text, self.chars_per_token)
+                remaining = 0
+            else:
+                saved += tokens
+        return kept, saved
+
+
+def from_environment():
+    """
+    Build the token budget from the Lambda environment, or None when token budgeting is disabled
+    """
+    if os.environ.get("TOKEN_BUDGET_ENABLED", "false").lower() != "true":
+        return None
+    return TokenBudget(json.loads(os.environ.get("CONTEXT_BUDGETS") or "{}"),
+                       int(os.environ.get("DEFAULT_CONTEXT_BUDGET", "8000")),
+                       int(os.environ.get("CHUNK_TOKENS", "0")),
+                       int(os.environ.get("RETRIEVAL_NUMBER_OF_RESULTS", "5")),
+                       int(os.environ.get("MAX_OUTPUT_TOKENS", "1024")),
+                       int(os.environ.get("MAX_OUTPUT_TOKENS_LIMIT", "4096")),
+                       os.environ.get("PROMPT_TEMPLATE", ""),
+                       int(os.environ.get("MIN_CHUNK_TOKENS", "100")),
+                       os.environ.get("GENERATION_OVERRIDE", "true").lower() == "true",
+                       int(os.environ.get("CHARS_PER_TOKEN", "4")))
@@ -0,0 +1,218 @@
+import os
+import time
+import logging
+import answercache
+import metrics
+import searchfilter
+import tokenbudget
+
+logger = logging.getLogger()
+
+# Models that reject a system prompt in Converse; the instructions are sent in the first user turn instead
+NO_SYSTEM_PROMPT_MODELS = ("amazon.titan-text",)
+
+PIPELINE_RETRIEVE_AND_GENERATE = "retrieve_and_generate"
+PIPELINE_RETRIEVE_THEN_GENERATE = "retrieve_then_generate"
+
+DEFAULT_SYSTEM_PROMPT = ("You are a question answering assistant. Answer the question using only the "
+                         "search results provided. If the search results do not contain the answer, "
+                         "say that you could not find an exact answer.")
+
+
+def build_prompt(question, chunks, template=None):
+    sources = "\n\n".join(f"<source id=\"{i + 1}\">\n{chunk['text']}\n</source>" for i, chunk in enumerate(chunks))
+    search_results = f"<search_results>\n{sources}\n</search_results>"
+    if not template:
+        return f"{search_results}\n\nQuestion: {question}"
+    # Same placeholders as the prompt templates of RetrieveAndGenerate, so one template serves both pipelines
+    prompt = template.replace(tokenbudget.SEARCH_RESULTS, search_results).replace(tokenbudget.OUTPUT_FORMAT_INSTRUCTIONS, "")
+    return prompt.replace(tokenbudget.QUERY, question) if tokenbudget.QUERY in template else f"{prompt}\n\nQuestion: {question}"
+
+
+class RetrieveThenGenerate:
+    """
+    Two-stage alternative to RetrieveAndGenerate: Retrieve from the knowledge base,
+    cache the retrieved chunks keyed on the query, then generate with Converse.
+    Each stage is timed separately so they can be tuned independently.
+    """
+    def __init__(self, bedrock_agent_runtime_client, bedrock_runtime_client, knowledge_base_id, model_id,
+                 number_of_results, retrieval_cache, generation=None, system_prompt=DEFAULT_SYSTEM_PROMPT,
+                 hybrid_retriever=None, reranker=None, federation=None, budget=None, federated_client=None):
+        self.bedrock_agent_runtime_client = bedrock_agent_runtime_client
+        self.bedrock_runtime_client = bedrock_runtime_client
+        self.knowledge_base_id = knowledge_base_id
+        self.model_id = model_id
+        self.number_of_results = number_of_results
+        self.retrieval_cache = retrieval_cache
+        # Callable returning the ingestion generation, so re-ingestion also invalidates retrievals
+        self.generation = generation or (lambda: "initial")
+        self.system_prompt = system_prompt
+        # hybridsearch.HybridRetriever queried directly for HYBRID_RRF searches
+        self.hybrid_retriever = hybrid_retriever
+        # reranker.Reranker that picks number_of_results chunks out of its over-fetched candidates
+        self.reranker = reranker
+        # federation.Federation that fans retrieval out to the knowledge bases of a request
+        self.federation = federation
+        # Agent runtime client of federated retrievals, whose calls end by the federation timeout
+        self.federated_client = federated_client or bedrock_agent_runtime_client
+        # tokenbudget.TokenBudget that caps the retrieved context of each model call
+        self.budget = budget
+
+    def retrieve(self, question, search_type=None, filters=None, knowledge_base_id=None, number_of_results=None, client=None):
+        """
+        Return (chunks, cache_hit) for the question.
+        search_type is SEMANTIC or HYBRID for the knowledge base search, HYBRID_RRF for
+        the hybrid retriever, or None for the knowledge base default.
+        filters are conditions from searchfilter.parse that restrict the search to matching chunks.
+        knowledge_base_id defaults to the knowledge base of this stack.
+        number_of_results defaults to the configured one, and the reranker over-fetches its candidates.
+        client overrides the agent runtime client of the Retrieve call.
+        """
+        knowledge_base_id = knowledge_base_id or self.knowledge_base_id
+        number_of_results = number_of_results or self.number_of_results
+        if self.reranker is not None:
+            number_of_results = max(self.reranker.candidates, number_of_results)
+        key = (self.generation(), knowledge_base_id, search_type, searchfilter.cache_key(filters), number_of_results,
+               answercache.normalize_question(question))
+        chunks = self.retrieval_cache.get(key) if self.retrieval_cache is not None else None
+        if chunks is not None:
+            return chunks, True
+        if search_type == "HYBRID_RRF":
+            if self.hybrid_retriever is None:
+                raise ValueError("HYBRID_RRF search is not enabled")
+            if knowledge_base_id != self.knowledge_base_id:
+                raise ValueError("HYBRID_RRF search only covers the knowledge base of this stack")
+            chunks = self.hybrid_retriever.retrieve(question, number_of_results, metrics.current(), filters)
+        else:
+            vector_search = {"numberOfResults": number_of_results}
+            if search_type:
+                vector_search["overrideSearchType"] = search_type
+            if filters:
+                vector_search["filter"] = searchfilter.to_bedrock(filters)
+            response = (client or self.bedrock_agent_runtime_client).retrieve(
+                knowledgeBaseId=knowledge_base_id,
+                retrievalQuery={"text": question},
+                retrievalConfiguration={"vectorSearchConfiguration": vector_search},
+            )
+            chunks = [{"text": result["content"]["text"],
+                       "score": result.get("score"),
+                       "location": result.get("location"),
+                       "metadata": result.get("metadata", {})}
+                      for result in response.get("retrievalResults", [])]
+        if self.retrieval_cache is not None:
+            self.retrieval_cache.put(key, chunks)
+        return chunks, False
+
+    def generate(self, question, chunks, session_state=None, model_id=None, max_output_tokens=None, prompt_template=None):
+        model_id = model_id or self.model_id
+        system = [{"text": self.system_prompt}]
+        messages = []
+        if session_state:
+            if session_state["summary"]:
+                system.append({"text": f"Summary of the earlier conversation:\n{session_state['summary']}"})
+            for turn in session_state["turns"]:
+                messages.append({"role": "user", "content": [{"text": turn["question"]}]})
+                messages.append({"role": "assistant", "content": [{"text": turn["answer"]}]})
+        messages.append({"role": "user", "content": [{"text": build_prompt(question, chunks, prompt_template)}]})
+        if any(prefix in model_id for prefix in NO_SYSTEM_PROMPT_MODELS):
+            instructions = "\n\n".join(block["text"] for block in system)
+            messages[0] = {"role": "user", "content": [{"text": f"{instructions}\n\n{messages[0]['content'][0]['text']}"}]}
+            system = []
+        response = self.bedrock_runtime_client.converse(
+            modelId=model_id,
+            messages=messages,
+            **({"system": system} if system else {}),
+            **({"inferenceConfig": {"maxTokens": max_output_tokens}} if max_output_tokens else {}),
+        )
+        text = "".join(block.get("text", "") for block in response["output"]["message"]["content"])
+        return text, response.get("usage", {})
+
+    def answer(self, question, session_state=None, choose_model=None, call_model=None, search_type=None, filters=None,
+               knowledge_base_ids=None, options=None):
+        """
+        Return a dict with the answer, the retrieval cache status and per-stage timings in milliseconds.
+        choose_model(question, chunks) picks the model once the context is known, and
+        call_model(operation, models) runs operation(model_id), e.g. with retries and failover.
+        options are the tokenbudget.GenerationOptions of the request.
+        """
+        # Follow-ups are retrieved together with the previous question so references like "it" resolve
+        retrieval_query = question
+        if session_state and session_state["turns"]:
+            retrieval_query = f"{session_state['turns'][-1]['question']} {question}"
+        start = time.perf_counter()
+        statuses = None
+        number_of_results = options.number_of_results if options is not None else self.number_of_results
+        retrieval_saved = 0
+        if self.budget is not None:
+            # The model is only chosen once the context is known, so the default model's budget caps the retrieval
+            number_of_results, retrieval_saved = self.budget.retrieval_count(self.model_id, number_of_results)
+        if knowledge_base_ids and knowledge_base_ids != [self.knowledge_base_id]:
+            candidates = max(self.reranker.candidates, number_of_results) if self.reranker is not None else number_of_results
+            chunks, statuses = self.federation.retrieve(
+                knowledge_base_ids,
+                lambda knowledge_base_id: self.retrieve(retrieval_query, search_type, filters, knowledge_base_id,
+                                                        number_of_results, self.federated_client)[0],
+                candidates, metrics.current())
+            cache_hit = False
+        else:
+            chunks, cache_hit = self.retrieve(retrieval_query, search_type, filters, number_of_results=number_of_results)
+        retrieved = time.perf_counter()
+        timings = {"retrieve": (retrieved - start) * 1000}
+        if self.reranker is not None:
+            chunks = self.reranker.rerank(retrieval_query, chunks, number_of_results)
+            reranked = time.perf_counter()
+            timings["rerank"] = (reranked - retrieved) * 1000
+            retrieved = reranked
+        model_id = choose_model(question, chunks) if choose_model is not None else self.model_id
+
+        def generate(model):
+            context, saved = self.budget.fit(chunks, model) if self.budget is not None else (chunks, 0)
+            answer, usage = self.generate(question, context, session_state, model,
+                                          options.max_output_tokens if options is not None else None,
+                                          options.prompt_template if options is not None else None)
+            # The chunks of the prompt are returned as the references of the answer
+            result = {"answer": answer, "usage": usage, "references": context}
+            if self.budget is not None:
+                result["tokens_saved"] = retrieval_saved + saved
+            return result
+        result = call_model(generate, [model_id]) if call_model is not None else dict(generate(model_id), model=model_id)
+        generated = time.perf_counter()
+        result.update({
+            "retrieval_cache": answercache.CACHE_HIT_L1 if cache_hit else answercache.CACHE_MISS,
+            "timings": dict(timings, generate=(generated - retrieved) * 1000),
+        })
+        if statuses is not None:
+            result["knowledge_bases"] = statuses
+        return result
+
+
+def from_environment(bedrock_agent_runtime_client, client_factory, generation=None, hybrid_retriever=None, reranker=None,
+                     federation=None, budget=None):
+    """
+    Build the two-stage pipeline from the Lambda environment, or None when the
+    configured pipeline is the single RetrieveAndGenerate call
+    """
+    if os.environ.get("PIPELINE_MODE", PIPELINE_RETRIEVE_AND_GENERATE) != PIPELINE_RETRIEVE_THEN_GENERATE:
+        return None
+    retrieval_cache = None
+    max_entries = int(os.environ.get("RETRIEVAL_CACHE_MAX_ENTRIES", "256"))
+    if max_entries > 0:
+        retrieval_cache = answercache.LRUCache(max_entries, int(os.environ.get("RETRIEVAL_CACHE_TTL_SECONDS", "900")))
+    federated_client = None
+    if federation is not None:
+        # Timed out retrievals cannot be cancelled and hold a federation worker until the call ends, so each
+        # call is bounded by the federation timeout, in a single attempt, instead of the default read timeout
+        federated_client = client_factory("bedrock-agent-runtime", read_timeout=federation.timeout, max_attempts=1)
+    return RetrieveThenGenerate(bedrock_agent_runtime_client,
+                                client_factory("bedrock-runtime"),
+                                os.environ["KNOWLEDGE_BASE_ID"],
+                                os.environ["MODEL_ARN"],
+                                int(os.environ.get("RETRIEVAL_NUMBER_OF_RESULTS", "5")),
+                                retrieval_cache,
+                                generation,
+                                os.environ.get("SYSTEM_PROMPT") or DEFAULT_SYSTEM_PROMPT,
+                                hybrid_retriever,
+                                reranker,
+                                federation,
+                                budget,
+                                federated_client)
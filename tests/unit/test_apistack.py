@@ -0,0 +1,122 @@
+import os
+import sys
+
+import pytest
+
+cdk = pytest.importorskip("aws_cdk")
+from aws_cdk.assertions import Match, Template
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, ROOT)
+
+from config import ConcurrencyConfig
+from infrastructure.apistack import APIStack
+
+ACCOUNT = "123456789012"
+REGION = "us-gov-west-1"
+QUERY_FUNCTION_NAME = "chatbotdemo-QueryKb"
+SCHEDULE = [{"cron": "cron(30 12 ? * MON-FRI *)", "min": 10}, {"cron": "cron(0 23 ? * MON-FRI *)", "min": 1}]
+
+
+@pytest.fixture
+def synth(monkeypatch):
+    # Assets such as the function code are resolved relative to the project root, as with cdk synth
+    monkeypatch.chdir(ROOT)
+
+    def synth(**concurrency):
+        for name, value in concurrency.items():
+            monkeypatch.setattr(ConcurrencyConfig, name, value)
+        app = cdk.App()
+        stack = APIStack(app, "apistack", dictenv={"region": REGION, "account_id": ACCOUNT},
+                         env=cdk.Environment(account=ACCOUNT, region=REGION))
+        return Template.from_stack(stack)
+    return synth
+
+
+def test_default_invokes_function_without_alias(synth):
+    template = synth()
+    template.resource_count_is("AWS::Lambda::Alias", 0)
+    template.resource_count_is("AWS::ApplicationAutoScaling::ScalableTarget", 0)
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "FunctionName": QUERY_FUNCTION_NAME,
+        "SnapStart": Match.absent(),
+    })
+
+
+def test_provisioned_concurrency_on_alias(synth):
+    template = synth(PROVISIONED_CONCURRENCY=2, RESERVED_CONCURRENCY=20)
+    template.has_resource_properties("AWS::Lambda::Alias", {
+        "Name": ConcurrencyConfig.ALIAS_NAME,
+        "FunctionVersion": Match.any_value(),
+        "ProvisionedConcurrencyConfig": {"ProvisionedConcurrentExecutions": 2},
+    })
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "FunctionName": QUERY_FUNCTION_NAME,
+        "ReservedConcurrentExecutions": 20,
+    })
+    template.resource_count_is("AWS::ApplicationAutoScaling::ScalableTarget", 0)
+
+
+def test_api_invokes_alias(synth):
+    template = synth(PROVISIONED_CONCURRENCY=2)
+    aliases = template.find_resources("AWS::Lambda::Alias")
+    assert len(aliases) == 1
+    template.has_resource_properties("AWS::Lambda::Permission", {
+        "FunctionName": {"Ref": next(iter(aliases))},
+        "Principal": "apigateway.amazonaws.com",
+    })
+
+
+def test_target_tracking_and_schedules(synth):
+    template = synth(PROVISIONED_CONCURRENCY=2, AUTOSCALING_MAX=20, UTILIZATION_TARGET=0.6, SCHEDULE=SCHEDULE)
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalableTarget", {
+        "ServiceNamespace": "lambda",
+        "ScalableDimension": "lambda:function:ProvisionedConcurrency",
+        "MinCapacity": 2,
+        "MaxCapacity": 20,
+        "ScheduledActions": [
+            Match.object_like({"Schedule": SCHEDULE[0]["cron"], "ScalableTargetAction": {"MinCapacity": 10}}),
+            Match.object_like({"Schedule": SCHEDULE[1]["cron"], "ScalableTargetAction": {"MinCapacity": 1}}),
+        ],
+    })
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalingPolicy", {
+        "PolicyType": "TargetTrackingScaling",
+        "TargetTrackingScalingPolicyConfiguration": Match.object_like({
+            "TargetValue": 0.6,
+            "PredefinedMetricSpecification": {"PredefinedMetricType": "LambdaProvisionedConcurrencyUtilization"},
+        }),
+    })
+
+
+def test_schedules_without_target_tracking(synth):
+    template = synth(PROVISIONED_CONCURRENCY=1, SCHEDULE=SCHEDULE)
+    template.has_resource_properties("AWS::ApplicationAutoScaling::ScalableTarget", {
+        "MinCapacity": 1,
+        "MaxCapacity": 10,
+        "ScheduledActions": Match.array_with([Match.object_like({"Schedule": SCHEDULE[0]["cron"]})]),
+    })
+    template.resource_count_is("AWS::ApplicationAutoScaling::ScalingPolicy", 0)
+
+
+def test_snapstart_on_query_function(synth):
+    template = synth(SNAPSTART=True)
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "FunctionName": QUERY_FUNCTION_NAME,
+        "SnapStart": {"ApplyOn": "PublishedVersions"},
+        "Environment": {"Variables": Match.object_like({"SNAPSTART_ENABLED": "true"})},
+    })
+    template.has_resource_properties("AWS::Lambda::Alias", {
+        "Name": ConcurrencyConfig.ALIAS_NAME,
+        "ProvisionedConcurrencyConfig": Match.absent(),
+    })
+
+
+@pytest.mark.parametrize("concurrency", [
+    {"SNAPSTART": True, "PROVISIONED_CONCURRENCY": 2},
+    {"AUTOSCALING_MAX": 10},
+    {"PROVISIONED_CONCURRENCY": 5, "AUTOSCALING_MAX": 2},
+    {"PROVISIONED_CONCURRENCY": 5, "RESERVED_CONCURRENCY": 4},
+])
+def test_invalid_concurrency_config(synth, concurrency):
+    with pytest.raises(ValueError):
+        synth(**concurrency)
@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import uuid
+import argparse
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "tools"))
+
+import bulkload
+from bulkload import SOURCE_URI_FIELD, BulkWriter, Progress
+
+TEXT_FIELD = bulkload.TEXT_FIELD
+
+
+class FakeCollection:
+    """
+    Local stand-in of the bulk and search APIs of a vector search collection. Ids are assigned
+    by the collection, reject(request, source) returns the status of an item to reject, and
+    deleted documents keep showing up in the next stale_searches searches, like before a refresh.
+    """
+    def __init__(self, reject=None, stale_searches=0):
+        self.reject = reject or (lambda request, source: None)
+        self.stale_searches = stale_searches
+        self.docs = {}
+        self.deleted = {}
+        self.requests = []
+
+    def bulk(self, body):
+        request = len(self.requests)
+        self.requests.append(body)
+        items = []
+        lines = iter(body)
+        for action in lines:
+            if "delete" in action:
+                doc_id = action["delete"]["_id"]
+                if doc_id in self.docs:
+                    self.deleted[doc_id] = [self.docs.pop(doc_id), self.stale_searches]
+                items.append({"delete": {"_id": doc_id, "status": 200}})
+                continue
+            source = next(lines)
+            status = self.reject(request, source)
+            if status:
+                items.append({"index": {"status": status, "error": {"type": "rejected", "status": status}}})
+            else:
+                doc_id = action["index"].get("_id") or str(uuid.uuid4())
+                self.docs[doc_id] = source
+                items.append({"index": {"_id": doc_id, "status": 201}})
+        return {"errors": any(item.get("index", {}).get("status", 200) >= 300 for item in items), "items": items}
+
+    def search(self, index, body):
+        uri = body["query"]["match_phrase"][SOURCE_URI_FIELD]
+        # Stale hits of deleted documents rank first, so a page can hold nothing else
+        visible = {}
+        for doc_id, entry in list(self.deleted.items()):
+            if entry[1] > 0:
+                entry[1] -= 1
+                visible[doc_id] = entry[0]
+        visible.update(self.docs)
+        hits = [{"_id": doc_id, "_source": {SOURCE_URI_FIELD: source[SOURCE_URI_FIELD]}}
+                for doc_id, source in visible.items() if uri in source[SOURCE_URI_FIELD]]
+        return {"hits": {"hits": hits[:body["size"]]}}
+
+    def texts(self):
+        return sorted(source[TEXT_FIELD] for source in self.docs.values())
+
+
+class BulkError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(bulkload.time, "sleep", lambda seconds: None)
+
+
+def chunks(key, count, prefix="chunk"):
+    return [{"key": key, "position": position, "text": f"{prefix} {position}", "vector": [0.0, 1.0],
+             "metadata": {"source": key}} for position in range(count)]
+
+
+def writer(client, max_retries=3):
+    return BulkWriter(client, "index", "vector", False, max_retries, Progress(60))
+
+
+def test_write_retries_only_rejected_items():
+    rejected = {"chunk 1", "chunk 3"}
+    collection = FakeCollection(reject=lambda request, source: 429 if request == 0 and source[TEXT_FIELD] in rejected else None)
+    assert writer(collection).write(chunks("doc", 4)) == []
+
+    assert len(collection.requests) == 2
+    assert [line[TEXT_FIELD] for line in collection.requests[1][1::2]] == ["chunk 1", "chunk 3"]
+    assert collection.texts() == ["chunk 0", "chunk 1", "chunk 2", "chunk 3"]
+
+
+def test_write_returns_rejected_items_without_resending():
+    collection = FakeCollection(reject=lambda request, source: 400 if source[TEXT_FIELD] == "chunk 2" else None)
+    failed = writer(collection).write(chunks("doc", 3))
+
+    assert [chunk["text"] for chunk in failed] == ["chunk 2"]
+    assert len(collection.requests) == 1
+    assert collection.texts() == ["chunk 0", "chunk 1"]
+
+
+def test_write_gives_up_on_items_still_rejected_after_retries():
+    collection = FakeCollection(reject=lambda request, source: 503 if source[TEXT_FIELD] == "chunk 0" else None)
+    failed = writer(collection, max_retries=2).write(chunks("doc", 2))
+
+    assert [chunk["text"] for chunk in failed] == ["chunk 0"]
+    assert len(collection.requests) == 3
+    assert collection.texts() == ["chunk 1"]
+
+
+@pytest.mark.parametrize("status_code, requests", [(429, 2), (504, 1)])
+def test_failed_bulk_request_is_only_resent_after_429(status_code, requests):
+    collection = FakeCollection()
+    bulk = collection.bulk
+    calls = []
+
+    def failing_bulk(body):
+        calls.append(body)
+        if len(calls) == 1:
+            raise BulkError(status_code)
+        return bulk(body)
+    collection.bulk = failing_bulk
+    failed = writer(collection).write(chunks("doc", 2))
+
+    assert len(calls) == requests
+    assert len(failed) == (0 if status_code == 429 else 2)
+
+
+def test_delete_document_pages_past_stale_hits():
+    collection = FakeCollection(stale_searches=2)
+    bulk_writer = writer(collection)
+    bulk_writer.write(chunks("s3://bucket/doc.txt", 7) + chunks("s3://bucket/doc.txt.bak", 2, "other"))
+
+    assert bulk_writer.delete_document("s3://bucket/doc.txt", page_size=3, poll_seconds=0) == 7
+    assert collection.texts() == ["other 0", "other 1"]
+
+
+def test_delete_document_fails_when_deletes_never_show():
+    collection = FakeCollection(stale_searches=10 ** 6)
+    bulk_writer = writer(collection)
+    bulk_writer.write(chunks("doc", 2))
+
+    with pytest.raises(RuntimeError):
+        bulk_writer.delete_document("doc", settle_seconds=0, poll_seconds=0)
+
+
+def load_args(tmp_path, source):
+    return argparse.Namespace(
+        source=str(source), host="collection.local", endpoint=None, index="test", vector_field="vector",
+        create_index=False, region=None, embedder="hash", model_id=None, dimensions=8, max_tokens=4, overlap=0,
+        embed_workers=2, embed_batch=2, bulk_workers=2, bulk_size=3, max_in_flight=4, max_retries=2,
+        checkpoint=str(tmp_path / "load.ckpt"), report_interval=60)
+
+
+def test_resume_rewrites_partly_written_documents_once(tmp_path, monkeypatch):
+    # Loads against a stand-in need neither boto3 nor the OpenSearch client
+    monkeypatch.setitem(sys.modules, "boto3", None)
+    source = tmp_path / "docs.jsonl"
+    documents = {"a": "one two three four five six", "b": " ".join(f"word{i}" for i in range(20))}
+    source.write_text("".join(json.dumps({"id": key, "text": text}) + "\n" for key, text in documents.items()))
+    collection = FakeCollection(reject=lambda request, source: 400 if source[TEXT_FIELD] == "word12 word13 word14 word15" else None,
+                                stale_searches=1)
+
+    first = bulkload.run(load_args(tmp_path, source), collection)
+    assert first["documents"] == 1
+    assert first["failed_documents"] == 1
+    assert "word0 word1 word2 word3" in collection.texts()
+
+    collection.reject = lambda request, source: None
+    second = bulkload.run(load_args(tmp_path, source), collection)
+    assert second["skipped"] == 1
+    assert second["rewritten"] == 1
+    assert second["documents"] == 1
+
+    expected = sorted(" ".join(text.split()[start:start + 4]) for text in documents.values()
+                      for start in range(0, len(text.split()), 4))
+    assert collection.texts() == expected
+
+    third = bulkload.run(load_args(tmp_path, source), collection)
+    assert third["skipped"] == 2
+    assert collection.texts() == expected
@@ -0,0 +1,177 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+
+import metrics
+from hedging import Hedger
+
+# Real waits before a hedge are kept short; stub latencies are measured on the injected clock
+HEDGE_DELAY = 0.01
+TIMEOUT = 5
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            return self.now
+
+    def advance(self, seconds):
+        with self.lock:
+            self.now += seconds
+
+
+class StubModel:
+    """
+    Answers calls in order with the given (latency, result) pairs. A call advances the
+    clock by its latency; calls listed in slow block until release(index) is called.
+    Results that are exceptions are raised.
+    """
+    def __init__(self, clock, responses, slow=()):
+        self.clock = clock
+        self.responses = list(responses)
+        self.released = {index: threading.Event() for index in slow}
+        self.bound_metrics = []
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            index = self.calls
+            self.calls += 1
+        self.bound_metrics.append(metrics.current())
+        if index in self.released:
+            assert self.released[index].wait(TIMEOUT)
+        latency, result = self.responses[index]
+        self.clock.advance(latency)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def release(self, index):
+        self.released[index].set()
+
+
+def hedger(clock, max_rate=1.0, min_samples=20):
+    return Hedger(95, HEDGE_DELAY, HEDGE_DELAY, max_rate, 200, min_samples, 4, clock=clock)
+
+
+def test_fast_call_is_not_hedged():
+    clock = Clock()
+    hedged = hedger(clock)
+    model = StubModel(clock, [(0.4, "primary")])
+    assert hedged.call("model", model) == "primary"
+    assert model.calls == 1
+    assert hedged.stats["hedged"] == 0
+
+
+def test_slow_call_is_hedged_and_hedge_wins():
+    clock = Clock()
+    hedged = hedger(clock)
+    model = StubModel(clock, [(3.0, "primary"), (0.5, "hedge")], slow=[0])
+    request_metrics = metrics.RequestMetrics("/question")
+    try:
+        assert hedged.call("model", model, request_metrics) == "hedge"
+    finally:
+        model.release(0)
+    assert hedged.stats["hedged"] == 1
+    assert hedged.stats["hedge_won"] == 1
+    assert request_metrics.values == {"Hedged": 1, "HedgeWon": 1}
+
+
+def test_first_result_wins():
+    clock = Clock()
+    hedged = hedger(clock)
+    model = StubModel(clock, [(2.0, "primary"), (2.5, "hedge")], slow=[0, 1])
+    result = []
+    caller = threading.Thread(target=lambda: result.append(hedged.call("model", model)))
+    caller.start()
+    try:
+        while model.calls < 2:
+            caller.join(0.001)
+        model.release(0)
+        caller.join(TIMEOUT)
+    finally:
+        model.release(1)
+    assert result == ["primary"]
+    assert hedged.stats["hedged"] == 1
+    assert hedged.stats["hedge_won"] == 0
+
+
+def test_failed_call_is_answered_by_the_other():
+    clock = Clock()
+    hedged = hedger(clock)
+    model = StubModel(clock, [(1.0, RuntimeError("primary failed")), (0.5, "hedge")], slow=[0])
+    result = []
+    caller = threading.Thread(target=lambda: result.append(hedged.call("model", model)))
+    caller.start()
+    while model.calls < 2:
+        caller.join(0.001)
+    model.release(0)
+    caller.join(TIMEOUT)
+    assert result == ["hedge"]
+
+
+def test_budget_exhaustion_skips_hedge():
+    clock = Clock()
+    hedged = hedger(clock, max_rate=0.0)
+    model = StubModel(clock, [(3.0, "first"), (0.5, "hedge"), (3.0, "second")], slow=[0, 2])
+    request_metrics = metrics.RequestMetrics("/question")
+    try:
+        assert hedged.call("model", model) == "hedge"
+    finally:
+        model.release(0)
+
+    # The only credit is spent and none is earned, so the second slow call waits for its own answer
+    threading.Timer(HEDGE_DELAY * 10, model.release, [2]).start()
+    assert hedged.call("model", model, request_metrics) == "second"
+    assert model.calls == 3
+    assert hedged.stats["skipped_by_budget"] == 1
+    assert request_metrics.values == {"HedgeSkipped": 1}
+
+
+def test_hedge_without_rate_limit_token_is_skipped_and_refunded():
+    clock = Clock()
+    hedged = hedger(clock, max_rate=0.0)
+    model = StubModel(clock, [(3.0, "primary")], slow=[0])
+    threading.Timer(HEDGE_DELAY * 10, model.release, [0]).start()
+    assert hedged.call("model", model, acquire=lambda: False) == "primary"
+    assert model.calls == 1
+    assert hedged.stats["skipped_by_rate_limit"] == 1
+    assert hedged.budget.credits == 1.0
+
+
+def test_delay_follows_primary_latencies():
+    clock = Clock()
+    hedged = hedger(clock, min_samples=10)
+    assert hedged.delay("model") == HEDGE_DELAY
+    latencies = [0.1 * i for i in range(1, 11)]
+    model = StubModel(clock, [(latency, "answer") for latency in latencies])
+    for count in range(1, len(latencies) + 1):
+        hedged.call("model", model)
+        # Latencies are recorded by a callback of the worker, so wait for it before the next call moves the clock
+        while len(hedged.tracker("model")) < count:
+            threading.Event().wait(0.001)
+    assert hedged.delay("model") == pytest.approx(1.0)
+    assert hedged.delay("other") == HEDGE_DELAY
+
+
+def test_calls_run_with_caller_metrics():
+    clock = Clock()
+    hedged = hedger(clock)
+    model = StubModel(clock, [(3.0, "primary"), (0.5, "hedge")], slow=[0])
+    request_metrics = metrics.RequestMetrics("/questions:batch")
+    metrics.bind(request_metrics)
+    try:
+        hedged.call("model", model, request_metrics)
+    finally:
+        metrics.bind(None)
+        model.release(0)
+    assert model.bound_metrics == [request_metrics, request_metrics]
@@ -0,0 +1,105 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, ResilientInvoker, ThrottledError, TokenBucket
+
+MODEL = "arn:aws:bedrock:us-gov-west-1::foundation-model/amazon.nova-micro-v1:0"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ClientError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+def invoker(clock, bucket=None, max_attempts=1):
+    return ResilientInvoker([MODEL], bucket or TokenBucket(100, 100, clock=clock),
+                            lambda: CircuitBreaker(1, 30, clock=clock),
+                            max_attempts, 0, 0, 0, sleep=clock.sleep)
+
+
+def open_circuit(clock, resilient):
+    with pytest.raises(CircuitOpenError):
+        resilient.call(lambda model: (_ for _ in ()).throw(ClientError("ServiceUnavailableException")))
+    assert resilient.breaker(MODEL).state == CircuitBreaker.OPEN
+    clock.now += 30
+
+
+def test_non_retryable_error_of_trial_call_reopens_circuit():
+    clock = Clock()
+    resilient = invoker(clock)
+    open_circuit(clock, resilient)
+
+    with pytest.raises(ClientError):
+        resilient.call(lambda model: (_ for _ in ()).throw(ClientError("ValidationException")))
+    assert resilient.breaker(MODEL).state == CircuitBreaker.OPEN
+
+    assert resilient.call(lambda model: {"answer": "ok"})["answer"] == "ok"
+    assert resilient.breaker(MODEL).state == CircuitBreaker.CLOSED
+
+
+def test_client_side_throttle_of_trial_call_reopens_circuit():
+    clock = Clock()
+    bucket = TokenBucket(1, 1, clock=clock)
+    resilient = invoker(clock, bucket)
+    open_circuit(clock, resilient)
+
+    bucket.tokens, bucket.updated = 0, clock.now
+    with pytest.raises(ThrottledError) as raised:
+        resilient.call(lambda model: {"answer": "ok"})
+    assert type(raised.value) is ThrottledError
+    assert resilient.breaker(MODEL).state == CircuitBreaker.OPEN
+
+    clock.now += 1
+    assert resilient.call(lambda model: {"answer": "ok"})["answer"] == "ok"
+    assert resilient.breaker(MODEL).state == CircuitBreaker.CLOSED
+
+
+def test_failed_trial_call_reopens_circuit_for_recovery_time():
+    clock = Clock()
+    resilient = invoker(clock)
+    open_circuit(clock, resilient)
+
+    with pytest.raises(CircuitOpenError):
+        resilient.call(lambda model: (_ for _ in ()).throw(ClientError("ServiceUnavailableException")))
+    assert resilient.breaker(MODEL).state == CircuitBreaker.OPEN
+    assert resilient.breaker(MODEL).retry_after() == 30
+
+
+def test_retry_after_covers_token_deficit():
+    clock = Clock()
+    bucket = TokenBucket(0.5, 1, clock=clock)
+    assert bucket.try_acquire() == 0.0
+    assert bucket.retry_after() == 2
+    clock.now += 1.5
+    assert bucket.retry_after() == 1
+
+
+def test_token_wait_lets_callers_queue_for_tokens():
+    clock = Clock()
+    resilient = invoker(clock, TokenBucket(1, 1, clock=clock))
+    resilient.call(lambda model: {"answer": "first"})
+    with pytest.raises(ThrottledError):
+        resilient.call(lambda model: {"answer": "second"})
+    assert resilient.call(lambda model: {"answer": "second"}, token_wait=5)["answer"] == "second"
+
+
+def test_from_environment_is_disabled_by_default(monkeypatch):
+    monkeypatch.delenv("RESILIENCE_ENABLED", raising=False)
+    assert resilience.from_environment() is None
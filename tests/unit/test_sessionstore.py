@@ -0,0 +1,99 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+
+from sessionstore import InMemorySessionStore, Sessions, contextual_question, is_session_id
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def sessions(clock, max_turns=2, summary_max_chars=1500, answer_max_chars=300):
+    return Sessions(InMemorySessionStore(60, clock=clock), max_turns, summary_max_chars, answer_max_chars)
+
+
+def test_start_and_load_round_trip():
+    manager = sessions(Clock())
+    session_id, state = manager.start()
+    assert is_session_id(session_id)
+    assert state == {"summary": "", "turns": []}
+
+    manager.record(session_id, state, "What is the travel policy?", "Book through the portal.")
+    loaded_id, loaded = manager.load(session_id)
+    assert loaded_id == session_id
+    assert loaded == {"summary": "", "turns": [{"question": "What is the travel policy?",
+                                                "answer": "Book through the portal."}]}
+
+
+def test_started_sessions_are_distinct():
+    manager = sessions(Clock())
+    assert manager.start()[0] != manager.start()[0]
+
+
+@pytest.mark.parametrize("session_id", [
+    "00000000-0000-4000-8000-000000000000",  # well formed but never started
+    "my-own-session",
+    "",
+    None,
+])
+def test_load_rejects_unknown_session_ids(session_id):
+    with pytest.raises(ValueError):
+        sessions(Clock()).load(session_id)
+
+
+def test_load_rejects_expired_session():
+    clock = Clock()
+    manager = sessions(clock)
+    session_id, state = manager.start()
+    manager.record(session_id, state, "question", "answer")
+    clock.now += 59
+    manager.load(session_id)
+
+    clock.now += 1
+    with pytest.raises(ValueError):
+        manager.load(session_id)
+    assert session_id not in manager.store.sessions
+
+
+def test_turns_beyond_limit_are_folded_into_summary():
+    manager = sessions(Clock(), max_turns=2, answer_max_chars=12)
+    session_id, state = manager.start()
+    for i in range(1, 5):
+        manager.record(session_id, state, f"question {i}", f"answer number {i} is long")
+        state = manager.load(session_id)[1]
+
+    assert [turn["question"] for turn in state["turns"]] == ["question 3", "question 4"]
+    assert state["summary"] == "Q: question 1 A: answer...\nQ: question 2 A: answer..."
+
+
+def test_summary_drops_oldest_lines_first():
+    manager = sessions(Clock(), max_turns=1, summary_max_chars=40)
+    session_id, state = manager.start()
+    for i in range(1, 5):
+        manager.record(session_id, state, f"question {i}", f"answer {i}")
+        state = manager.load(session_id)[1]
+
+    assert len(state["summary"]) <= 40
+    assert state["summary"] == "Q: question 3 A: answer 3"
+    assert [turn["question"] for turn in state["turns"]] == ["question 4"]
+
+
+def test_contextual_question():
+    assert contextual_question({"summary": "", "turns": []}, "What next?") == "What next?"
+
+    state = {"summary": "Q: question 1 A: answer 1",
+             "turns": [{"question": "question 2", "answer": "a long answer to question 2"}]}
+    assert contextual_question(state, "What next?", answer_max_chars=16) == (
+        "Previous conversation:\n"
+        "Q: question 1 A: answer 1\n"
+        "Q: question 2 A: a long answer...\n"
+        "\n"
+        "Follow-up question: What next?")
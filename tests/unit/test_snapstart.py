@@ -0,0 +1,58 @@
+import os
+import sys
+import types
+import importlib
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+
+
+@pytest.fixture
+def hooks(monkeypatch):
+    """
+    Stand-in of the snapshot_restore_py module of the Lambda Python runtime, recording the registered hooks
+    """
+    registered = {}
+    runtime_hooks = types.ModuleType("snapshot_restore_py")
+
+    def register(name):
+        def decorator(fn):
+            registered.setdefault(name, []).append(fn)
+            return fn
+        return decorator
+    runtime_hooks.register_before_snapshot = register("before_snapshot")
+    runtime_hooks.register_after_restore = register("after_restore")
+    monkeypatch.setitem(sys.modules, "snapshot_restore_py", runtime_hooks)
+    return registered
+
+
+def import_handler(monkeypatch, snapstart_enabled):
+    monkeypatch.setenv("SNAPSTART_ENABLED", snapstart_enabled)
+    monkeypatch.setenv("KNOWLEDGE_BASE_ID", "kb")
+    monkeypatch.setenv("MODEL_ARN", "arn:aws:bedrock:us-east-1::foundation-model/model")
+    # No clients are built at import, so the handler imports without boto3
+    monkeypatch.setenv("PREWARM_CLIENTS", "")
+    monkeypatch.delitem(sys.modules, "kbquery_handler", raising=False)
+    return importlib.import_module("kbquery_handler")
+
+
+def test_hooks_are_registered_with_snapstart(monkeypatch, hooks):
+    handler = import_handler(monkeypatch, "true")
+    assert hooks == {"before_snapshot": [handler.before_snapshot], "after_restore": [handler.after_restore]}
+
+    prewarmed = []
+    monkeypatch.setattr(handler, "prewarm", prewarmed.append)
+    handler.before_snapshot()
+    assert prewarmed == [handler.PREWARM_CLIENTS]
+
+    refreshed = []
+    monkeypatch.setattr(handler, "refresh", lambda: refreshed.append(True))
+    handler.after_restore()
+    assert refreshed == [True]
+
+
+def test_hooks_are_not_registered_without_snapstart(monkeypatch, hooks):
+    handler = import_handler(monkeypatch, "false")
+    assert hooks == {}
+    assert not hasattr(handler, "after_restore")
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+"""
+Bulk load documents straight into the knowledge base vector index.
+
+Documents are streamed from local files, a JSONL file or an S3 prefix,
+chunked locally, embedded by parallel workers and written with the
+OpenSearch bulk API. Writes back off when the collection pushes back with
+429s, completed documents are appended to a checkpoint file so an
+interrupted load resumes where it stopped, and throughput is reported as it runs.
+Vector search collections assign their own document ids, so a document that
+was only partly written is deleted by its source URI before it is written again.
+
+    python3 tools/bulkload.py --source s3://my-bucket/docs/ --host <collection-id>.us-gov-west-1.aoss.amazonaws.com \\
+        --checkpoint load.ckpt
+    # Against a local OpenSearch, without Bedrock
+    python3 tools/bulkload.py --source ./docs --endpoint http://localhost:9200 --index test --create-index --embedder hash
+
+Requires opensearch-py, and boto3 and requests-aws4auth for collections, S3 sources and Bedrock, as in layers/index.
+"""
+import os
+import sys
+import glob
+import json
+import math
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ossindex import index_body, aoss_client, TEXT_FIELD, METADATA_FIELD
+from config import EMBEDDING_MODEL_IDs, OpenSearchServerlessConfig
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+logger = logging.getLogger("bulkload")
+
+TEXT_SUFFIXES = (".txt", ".md", ".html", ".csv", ".json")
+# Metadata sidecar of a document, as read by the knowledge base
+SIDECAR_SUFFIX = ".metadata.json"
+# Bedrock reads the source location of a chunk from this field
+SOURCE_URI_FIELD = "x-amz-bedrock-kb-source-uri"
+
+
+def sidecar_attributes(raw):
+    """
+    Attributes of a {"metadataAttributes": {...}} sidecar, with typed values unwrapped
+    """
+    attributes = {}
+    for name, value in json.loads(raw).get("metadataAttributes", {}).items():
+        if isinstance(value, dict) and "value" in value:
+            value = next((item for key, item in value["value"].items() if key != "type"), None)
+        attributes[name] = value
+    return attributes
+
+
+def is_document(key):
+    return key.lower().endswith(TEXT_SUFFIXES) and not key.lower().endswith(SIDECAR_SUFFIX)
+
+
+def read_documents(source, session=None):
+    """
+    Yield (key, text, metadata) one document at a time.
+    source is a directory, a glob, a .jsonl file with {"id", "text", "metadata"} per line, or an s3:// prefix.
+    Attributes from <document>.metadata.json sidecars are added to the metadata.
+    """
+    if source.startswith("s3://"):
+        bucket, _, prefix = source[5:].partition("/")
+        s3 = session.client("s3")
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                if is_document(item["Key"]):
+                    body = s3.get_object(Bucket=bucket, Key=item["Key"])["Body"].read()
+                    uri = f"s3://{bucket}/{item['Key']}"
+                    try:
+                        attributes = sidecar_attributes(s3.get_object(Bucket=bucket, Key=item["Key"] + SIDECAR_SUFFIX)["Body"].read())
+                    except s3.exceptions.NoSuchKey:
+                        attributes = {}
+                    yield uri, body.decode("utf8", errors="replace"), {**attributes, "source": uri}
+        return
+    if source.endswith(".jsonl"):
+        with open(source) as f:
+            for line in f:
+                if line.strip():
+                    document = json.loads(line)
+                    yield document["id"], document["text"], document.get("metadata", {"source": document["id"]})
+        return
+    paths = glob.glob(os.path.join(source, "**", "*"), recursive=True) if os.path.isdir(source) else glob.glob(source)
+    for path in sorted(paths):
+        if os.path.isfile(path) and is_document(path):
+            attributes = {}
+            if os.path.isfile(path + SIDECAR_SUFFIX):
+                with open(path + SIDECAR_SUFFIX) as f:
+                    attributes = sidecar_attributes(f.read())
+            with open(path, encoding="utf8", errors="replace") as f:
+                yield path, f.read(), {**attributes, "source": os.path.abspath(path)}
+
+
+def chunk_text(text, max_tokens, overlap_percentage):
+    """
+    Fixed-size chunks of about max_tokens words, overlapping like the knowledge base FIXED_SIZE strategy
+    """
+    words = text.split()
+    step = max(1, int(max_tokens * (1 - overlap_percentage / 100)))
+    for start in range(0, max(1, len(words)), step):
+        chunk = " ".join(words[start:start + max_tokens])
+        if chunk:
+            yield chunk
+        if start + max_tokens >= len(words):
+            break
+
+
+class BedrockEmbedder:
+    def __init__(self, session, model_id, dimensions):
+        from botocore.config import Config
+        self.client = session.client("bedrock-runtime", config=Config(
+            max_pool_connections=64, retries={"mode": "adaptive", "max_attempts": 8}))
+        self.model_id = model_id
+        self.dimensions = dimensions
+
+    def embed(self, text):
+        response = self.client.invoke_model(modelId=self.model_id, body=json.dumps(
+            {"inputText": text, "dimensions": self.dimensions, "normalize": True}))
+        return json.loads(response["body"].read())["embedding"]
+
+
+class HashEmbedder:
+    """
+    Deterministic unit vectors from the text hash, for loads without Bedrock access
+    """
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+
+    def embed(self, text):
+        rng = random.Random(hashlib.sha256(text.encode("utf8")).digest())
+        vector = [rng.gauss(0, 1) for _ in range(self.dimensions)]
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector]
+
+
+class Checkpoint:
+    """
+    Append-only file of the keys of fully written documents, and of the documents
+    whose writing started, prefixed with STARTED
+    """
+    STARTED = "started\t"
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.started = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    line = line.rstrip("\n")
+                    if line.startswith(self.STARTED):
+                        self.started.add(line[len(self.STARTED):])
+                    elif line:
+                        self.done.add(line)
+        self.file = open(path, "a") if path else None
+        self.lock = threading.Lock()
+
+    def incomplete(self, key):
+        """
+        Whether an earlier run may have written part of the document
+        """
+        return key in self.started and key not in self.done
+
+    def _append(self, line):
+        if self.file:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def start(self, key):
+        with self.lock:
+            self.started.add(key)
+            self._append(self.STARTED + key)
+
+    def mark(self, key):
+        with self.lock:
+            self.done.add(key)
+            self._append(key)
+
+
+class Progress:
+    def __init__(self, interval):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.reported = self.started
+        self.counts = {"documents": 0, "skipped": 0, "rewritten": 0, "chunks": 0, "bulk_requests": 0, "bulk_retries": 0,
+                       "failed": 0, "failed_documents": 0}
+        self.lock = threading.Lock()
+
+    def add(self, name, value=1):
+        with self.lock:
+            self.counts[name] += value
+
+    def report(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.reported < self.interval:
+            return
+        self.reported = now
+        elapsed = now - self.started
+        with self.lock:
+            counts = dict(self.counts)
+        logger.info(json.dumps({**counts, "elapsed_s": round(elapsed, 1),
+                                "chunks_per_s": round(counts["chunks"] / elapsed, 1) if elapsed else 0}))
+        return counts
+
+
+def source_uri(chunk):
+    return chunk["metadata"].get("source", chunk["key"])
+
+
+class BulkWriter:
+    """
+    Writes chunks with the bulk API, retrying rejected items with exponential backoff.
+    Only the items the collection rejected are retried: without custom ids, writing a
+    chunk again adds a duplicate.
+    """
+    def __init__(self, client, index, vector_field, use_ids, max_retries, progress):
+        self.client = client
+        self.index = index
+        self.vector_field = vector_field
+        self.use_ids = use_ids
+        self.max_retries = max_retries
+        self.progress = progress
+
+    def actions(self, chunks):
+        lines = []
+        for chunk in chunks:
+            # Vector search collections reject custom ids, so ids are only sent to a local OpenSearch
+            action = {"_index": self.index}
+            if self.use_ids:
+                action["_id"] = hashlib.sha256(f"{chunk['key']}#{chunk['position']}".encode("utf8")).hexdigest()
+            lines.append({"index": action})
+            lines.append({self.vector_field: chunk["vector"],
+                          TEXT_FIELD: chunk["text"],
+                          METADATA_FIELD: json.dumps(chunk["metadata"]),
+                          SOURCE_URI_FIELD: source_uri(chunk),
+                          # Like the knowledge base, every attribute also gets its own field so it can be filtered on
+                          **{name: value for name, value in chunk["metadata"].items() if name != "source"}})
+        return lines
+
+    def write(self, chunks):
+        """
+        Write the chunks and return the ones that failed or may only partly have been written
+        """
+        pending = chunks
+        failed = []
+        for attempt in range(self.max_retries + 1):
+            self.progress.add("bulk_requests")
+            try:
+                response = self.client.bulk(body=self.actions(pending))
+            except Exception as e:
+                # A 429 rejects the whole request before any item is written. After other errors, such as
+                # gateway timeouts, some items may have been written, so the request is not sent again
+                if getattr(e, "status_code", None) != 429 or attempt == self.max_retries:
+                    logger.error("Bulk request of %d chunks failed: %s", len(pending), e)
+                    self.progress.add("failed", len(pending))
+                    return failed + pending
+                logger.warning("Bulk request rejected (429), backing off")
+                retry = pending
+            else:
+                retry = [chunk for chunk, item in zip(pending, response["items"])
+                         if item["index"].get("status", 200) in (429, 502, 503, 504)]
+                errors = [(chunk, item["index"].get("error")) for chunk, item in zip(pending, response["items"])
+                          if item["index"].get("status", 200) >= 300 and item["index"].get("status") not in (429, 502, 503, 504)]
+                if errors:
+                    self.progress.add("failed", len(errors))
+                    logger.error("%d chunks failed, first error: %s", len(errors), errors[0][1])
+                    failed += [chunk for chunk, _ in errors]
+                self.progress.add("chunks", len(pending) - len(retry) - len(errors))
+                if not retry:
+                    return failed
+            self.progress.add("bulk_retries")
+            # Full jitter backoff while the collection is applying backpressure
+            time.sleep(random.uniform(0, min(30, 0.5 * 2 ** attempt)))
+            pending = retry
+        logger.error("%d chunks still rejected after %d retries", len(pending), self.max_retries)
+        self.progress.add("failed", len(pending))
+        return failed + pending
+
+    def delete_document(self, uri, page_size=1000, settle_seconds=120, poll_seconds=2):
+        """
+        Delete every chunk written for the source URI, and return how many were deleted.
+        Deletes only leave search results after a refresh, which collections run on their own schedule,
+        so a page can list only chunks deleted already while more are behind it. The search is
+        repeated until it finds none, and fails after settle_seconds without progress.
+        """
+        deleted = set()
+        deadline = time.monotonic() + settle_seconds
+        while True:
+            if self.use_ids:
+                # Only a local OpenSearch, which also gets custom ids, supports the refresh API
+                self.client.indices.refresh(index=self.index)
+            hits = self.client.search(index=self.index, body={
+                "size": page_size, "_source": [SOURCE_URI_FIELD],
+                "query": {"match_phrase": {SOURCE_URI_FIELD: uri}}})["hits"]["hits"]
+            # The phrase match is on the analyzed text, so other URIs containing this one are left alone
+            found = [hit["_id"] for hit in hits if hit["_source"].get(SOURCE_URI_FIELD) == uri]
+            if not found:
+                return len(deleted)
+            ids = [doc_id for doc_id in found if doc_id not in deleted]
+            if ids:
+                self.client.bulk(body=[{"delete": {"_index": self.index, "_id": doc_id}} for doc_id in ids])
+                deleted.update(ids)
+                deadline = time.monotonic() + settle_seconds
+            elif time.monotonic() > deadline:
+                raise RuntimeError(f"Chunks of {uri} are still found {settle_seconds}s after they were deleted")
+            else:
+                time.sleep(poll_seconds)
+
+
+def run(args, client=None):
+    """
+    Load the documents and return the final progress counts.
+    client overrides the OpenSearch client, e.g. with a local stand-in of the bulk API.
+    """
+    session = None
+
+    def aws_session():
+        # boto3 is only needed for collections, S3 sources, Bedrock embeddings and the index name lookup
+        nonlocal session
+        if session is None:
+            import boto3
+            session = boto3.Session(region_name=args.region)
+        return session
+
+    if client is None and args.endpoint:
+        from opensearchpy import OpenSearch
+        client = OpenSearch(hosts=[args.endpoint], pool_maxsize=args.bulk_workers * 2, timeout=120)
+    elif client is None:
+        client = aoss_client(args.host, aws_session().region_name, aws_session(), pool_maxsize=args.bulk_workers * 2)
+    if args.index is None:
+        args.index = aws_session().client("ssm").get_parameter(Name="/serverlessrag/vectorIndexName")["Parameter"]["Value"]
+        logger.info("Writing to the active index %s", args.index)
+    if args.create_index and not client.indices.exists(index=args.index):
+        client.indices.create(index=args.index, body=index_body(
+            args.vector_field, args.dimensions, OpenSearchServerlessConfig.HNSW_M,
+            OpenSearchServerlessConfig.HNSW_EF_CONSTRUCTION, OpenSearchServerlessConfig.HNSW_EF_SEARCH,
+            OpenSearchServerlessConfig.VECTOR_ENCODING, OpenSearchServerlessConfig.FILTERABLE_FIELDS))
+        logger.info("Created index %s", args.index)
+
+    embedder = HashEmbedder(args.dimensions) if args.embedder == "hash" else BedrockEmbedder(aws_session(), args.model_id, args.dimensions)
+    checkpoint = Checkpoint(args.checkpoint)
+    progress = Progress(args.report_interval)
+    writer = BulkWriter(client, args.index, args.vector_field, bool(args.endpoint),
+                        args.max_retries, progress)
+    # Chunks of each document still to be written; the document is checkpointed when it reaches zero
+    remaining = {}
+    # Documents with chunks that failed are not checkpointed, so the next run deletes and rewrites them
+    failed_documents = set()
+    remaining_lock = threading.Lock()
+
+    def embed_batch(batch):
+        for chunk in batch:
+            chunk["vector"] = embedder.embed(chunk["text"])
+        return batch
+
+    def write_batch(batch):
+        failed = writer.write(batch)
+        finished = []
+        with remaining_lock:
+            for chunk in failed:
+                if chunk["key"] not in failed_documents:
+                    failed_documents.add(chunk["key"])
+                    progress.add("failed_documents")
+            for chunk in batch:
+                remaining[chunk["key"]] -= 1
+                if remaining[chunk["key"]] == 0:
+                    del remaining[chunk["key"]]
+                    if chunk["key"] not in failed_documents:
+                        finished.append(chunk["key"])
+        for key in finished:
+            checkpoint.mark(key)
+            progress.add("documents")
+
+    embed_pool = ThreadPoolExecutor(max_workers=args.embed_workers, thread_name_prefix="embed")
+    bulk_pool = ThreadPoolExecutor(max_workers=args.bulk_workers, thread_name_prefix="bulk")
+    embedding, writing = set(), set()
+    ready = []
+
+    def drain(limit):
+        """
+        Move embedded batches to the writers and block while either stage has more than limit batches in flight
+        """
+        nonlocal embedding, writing
+        while True:
+            done_embedding = {future for future in embedding if future.done()}
+            embedding -= done_embedding
+            for future in done_embedding:
+                ready.extend(future.result())
+            while len(ready) >= args.bulk_size or (ready and limit == 0):
+                writing.add(bulk_pool.submit(write_batch, ready[:args.bulk_size]))
+                del ready[:args.bulk_size]
+            for future in {future for future in writing if future.done()}:
+                writing.discard(future)
+                future.result()
+            progress.report()
+            if len(embedding) <= limit and len(writing) <= limit:
+                return
+            # Backpressure: the reader waits until a slot frees up in the slower stage
+            wait(embedding | writing, return_when=FIRST_COMPLETED)
+
+    batch = []
+    for key, text, metadata in read_documents(args.source, aws_session() if args.source.startswith("s3://") else None):
+        if key in checkpoint.done:
+            progress.add("skipped")
+            continue
+        chunks = [{"key": key, "position": position, "text": chunk, "metadata": metadata}
+                  for position, chunk in enumerate(chunk_text(text, args.max_tokens, args.overlap))]
+        if not chunks:
+            continue
+        if checkpoint.incomplete(key):
+            # An earlier run stopped part way through this document
+            deleted = writer.delete_document(source_uri(chunks[0]))
+            logger.info("Deleted %d chunks of partly written %s", deleted, key)
+            progress.add("rewritten")
+        else:
+            checkpoint.start(key)
+        with remaining_lock:
+            remaining[key] = len(chunks)
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) >= args.embed_batch:
+                embedding.add(embed_pool.submit(embed_batch, batch))
+                batch = []
+                drain(args.max_in_flight)
+    if batch:
+        embedding.add(embed_pool.submit(embed_batch, batch))
+    drain(0)
+    embed_pool.shutdown()
+    bulk_pool.shutdown()
+    return progress.report(force=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", required=True, help="Directory, glob, .jsonl file or s3://bucket/prefix")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--host", help="Collection endpoint host, without https://")
+    target.add_argument("--endpoint", help="URL of a local OpenSearch, e.g. http://localhost:9200 (no request signing)")
+    parser.add_argument("--index", help="Index to write to. Defaults to the active version in Parameter Store")
+    parser.add_argument("--vector-field", default=OpenSearchServerlessConfig.VECTOR_FIELD_NAME)
+    parser.add_argument("--create-index", action="store_true", help="Create the index from ossindex.index_body if missing")
+    parser.add_argument("--region", default=os.environ.get("AWS_REGION"))
+    parser.add_argument("--embedder", default="bedrock", choices=["bedrock", "hash"])
+    parser.add_argument("--model-id", default=EMBEDDING_MODEL_IDs[0])
+    parser.add_argument("--dimensions", type=int, default=OpenSearchServerlessConfig.VECTOR_DIMENSION)
+    parser.add_argument("--max-tokens", type=int, default=300, help="Approximate chunk size in words")
+    parser.add_argument("--overlap", type=int, default=20, help="Chunk overlap percentage")
+    parser.add_argument("--embed-workers", type=int, default=16)
+    parser.add_argument("--embed-batch", type=int, default=16, help="Chunks embedded per worker task")
+    parser.add_argument("--bulk-workers", type=int, default=4)
+    parser.add_argument("--bulk-size", type=int, default=200, help="Chunks per bulk request")
+    parser.add_argument("--max-in-flight", type=int, default=32, help="Batches queued per stage before reading pauses")
+    parser.add_argument("--max-retries", type=int, default=8)
+    parser.add_argument("--checkpoint", help="File of completed documents, used to resume")
+    parser.add_argument("--report-interval", type=float, default=10)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()